@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Measure the start-up time of a frozen (PyInstaller) build of the oprattle program, and check it against a budget.
+
+The frozen program is built as a single directory (see freeze/general/oprattle.general.spec), so nothing is extracted
+when it starts; a build that re-extracts itself on every invocation (as a onefile build does) will blow the budget.
+Each command is run several times and the best (minimum) and median wall times are reported.
+
+Usage:
+    python benchmark/frozen.py [--binary PATH] [--repeat N] [--version-budget SECONDS] [--convert-budget SECONDS] [--json]
+
+Exits with a non-zero status if the best time of any command is over its budget.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+import json
+import statistics
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DATA = Path(ROOT, "test", "data")
+
+# Where freeze/general/freeze writes the frozen build.
+DIST = Path(ROOT, "freeze", "general", "dist")
+
+
+def find_binary():
+    """
+    Find the oprattle executable of the most recent frozen build.
+    """
+    binaries = sorted(DIST.glob("openprattle.*/oprattle"), key = lambda path: path.stat().st_mtime)
+    if len(binaries) == 0:
+        raise FileNotFoundError("No frozen build found in '{}'; build one with freeze/general/freeze or use --binary".format(DIST))
+
+    return binaries[-1]
+
+
+def commands(binary, directory):
+    """
+    Get the commands to time.
+
+    :param binary: The frozen oprattle executable.
+    :param directory: A temporary directory to write output files to.
+    :return: A dictionary of each command name to its arguments.
+    """
+    return {
+        "oprattle --version": [str(binary), "--version"],
+        "oprattle Benzene.cml -o xyz": [str(binary), str(Path(DATA, "Benzene.cml")), "-o", "xyz"],
+        "oprattle Benzene.cdx -O Benzene.xyz": [str(binary), str(Path(DATA, "Benzene.cdx")), "-O", str(Path(directory, "Benzene.xyz"))],
+    }
+
+
+def measure(signature, repeat):
+    """
+    Run a command several times, returning the best and median wall times (in seconds).
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(signature, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+        timings.append(time.perf_counter() - start)
+
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the start-up time of the frozen oprattle program")
+    parser.add_argument("--binary", help = "The frozen oprattle executable. If not given, the most recent build in freeze/general/dist is used", type = Path)
+    parser.add_argument("--repeat", help = "The number of times to run each command", type = int, default = 10)
+    parser.add_argument("--version-budget", help = "The maximum time (in seconds) for 'oprattle --version'", type = float, default = 0.5)
+    parser.add_argument("--convert-budget", help = "The maximum time (in seconds) to convert benzene", type = float, default = 1.0)
+    parser.add_argument("--json", help = "Print results in JSON", action = "store_true")
+    args = parser.parse_args()
+
+    try:
+        binary = args.binary if args.binary is not None else find_binary()
+
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {name: measure(signature, args.repeat) for name, signature in commands(binary, directory).items()}
+
+    over_budget = []
+    for name, timings in results.items():
+        timings['budget'] = args.version_budget if name == "oprattle --version" else args.convert_budget
+        if timings['min'] > timings['budget']:
+            over_budget.append(name)
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+
+    else:
+        for name, timings in results.items():
+            print("{:40} : {:8.1f} ms (median {:8.1f} ms, budget {:8.1f} ms){}".format(
+                name,
+                timings['min'] * 1000,
+                timings['median'] * 1000,
+                timings['budget'] * 1000,
+                " OVER BUDGET" if name in over_budget else ""
+            ))
+
+    return 1 if len(over_budget) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
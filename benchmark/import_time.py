@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Measure the start-up time of the openprattle library and the oprattle program.
+
+Each command is run in a fresh interpreter several times and the best (minimum) wall time is reported,
+which is the least noisy estimate of the real cost.
+
+Usage:
+    python benchmark/import_time.py [--repeat N] [--json]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+import json
+import os
+from pathlib import Path
+
+# Run against the checked-out source, not whatever happens to be installed.
+ROOT = Path(__file__).resolve().parent.parent
+
+COMMANDS = {
+    "python (baseline)": "pass",
+    "import openprattle": "import openprattle",
+    "import openbabel.pybel": "from openbabel import pybel",
+    "oprattle --version": "import sys, openprattle.program; sys.argv = ['oprattle', '--version']; openprattle.program.main()",
+    "oprattle --bindings": "import sys, openprattle.program; sys.argv = ['oprattle', '--bindings']; openprattle.program.main()",
+    "oprattle --readable --json": "import sys, openprattle.program; sys.argv = ['oprattle', '--readable', '--json']; openprattle.program.main()",
+}
+
+
+def measure(code, repeat):
+    """
+    Run a snippet of python code in a new interpreter, returning the best wall time (in seconds).
+    """
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], stdout = subprocess.DEVNULL, env = env, check = False)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the start-up time of openprattle")
+    parser.add_argument("--repeat", help = "The number of times to run each command", type = int, default = 10)
+    parser.add_argument("--json", help = "Print results in JSON", action = "store_true")
+    args = parser.parse_args()
+
+    results = {name: measure(code, args.repeat) for name, code in COMMANDS.items()}
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+
+    else:
+        for name, timing in results.items():
+            print("{:30} : {:8.1f} ms".format(name, timing * 1000))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Measure the overhead of capturing openbabel's log messages during pybel conversions.
+
+Reports the cost of a single (outermost) capture, of a nested checkpoint, and of the previous approach
+(redirecting stderr with dup2() around every openbabel call), along with the time taken by a complete conversion,
+both serially and from a pool of threads.
+
+Usage:
+    python benchmark/log_capture.py [--repeat N] [--threads N] [--json]
+"""
+
+import argparse
+import sys
+import os
+import time
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Run against the checked-out source, not whatever happens to be installed.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from openprattle.babel import HAVE_PYBEL, pybel
+
+DATA = Path(ROOT, "test", "data")
+
+
+def timed(function, repeat):
+    """
+    Call a function several times, returning the mean wall time of each call (in seconds).
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def redirect():
+    """
+    The previous capture mechanism: redirect stderr to /dev/null and read back the entire log.
+    """
+    pybel.ob.obErrorLog.ClearLog()
+    stream_no = sys.stderr.fileno()
+    stream_back = os.dup(stream_no)
+    devnull = open(os.devnull, "w")
+    os.dup2(devnull.fileno(), stream_no)
+    
+    devnull.close()
+    os.dup2(stream_back, stream_no)
+    os.close(stream_back)
+    for level in (pybel.ob.obDebug, pybel.ob.obAuditMsg, pybel.ob.obInfo, pybel.ob.obWarning, pybel.ob.obError):
+        pybel.ob.obErrorLog.GetMessagesOfLevel(level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the overhead of capturing openbabel log messages")
+    parser.add_argument("--repeat", help = "The number of times to run each measurement", type = int, default = 2000)
+    parser.add_argument("--threads", help = "The number of threads to convert with", type = int, default = 4)
+    parser.add_argument("--json", help = "Print results in JSON", action = "store_true")
+    args = parser.parse_args()
+    
+    if not HAVE_PYBEL:
+        print("The pybel bindings are not available", file = sys.stderr)
+        return 1
+    
+    from openprattle.babel import ObErrorLog_wrapper, Pybel_converter
+    
+    buffer = Path(DATA, "Benzene.cml").read_text()
+    def convert():
+        return Pybel_converter(input_file_buffer = buffer, input_file_type = "cml").convert("xyz", gen3D = False)
+    
+    def capture():
+        with ObErrorLog_wrapper():
+            pass
+    
+    def checkpoint():
+        with ObErrorLog_wrapper():
+            pass
+    
+    def nested():
+        # Time the nested wrapper only.
+        with ObErrorLog_wrapper():
+            return timed(checkpoint, args.repeat)
+    
+    # Warm up (loads the openbabel plugins).
+    expected = convert()
+    
+    results = {
+        "redirect (previous, per call)": timed(redirect, args.repeat),
+        "capture (outermost)": timed(capture, args.repeat),
+        "checkpoint (nested)": nested(),
+        "conversion (serial)": timed(convert, args.repeat // 10),
+    }
+    
+    with ThreadPoolExecutor(args.threads) as executor:
+        start = time.perf_counter()
+        outputs = list(executor.map(lambda i: convert(), range(args.repeat // 10)))
+        results["conversion ({} threads)".format(args.threads)] = (time.perf_counter() - start) / len(outputs)
+    
+    if any(output != expected for output in outputs):
+        print("Threaded conversions gave different results", file = sys.stderr)
+        return 1
+    
+    if args.json:
+        print(json.dumps(results, indent = 4))
+    
+    else:
+        for name, timing in results.items():
+            print("{:30} : {:8.1f} us".format(name, timing * 1000000))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
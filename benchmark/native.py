@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Compare the speed of the pure-python Native backend with the openbabel backends on large multi-frame trajectories.
+
+A random xyz trajectory is generated (and converted to turbomole format for the single-frame cases), then each backend
+converts it to each of the formats the Native backend can write. Each case is repeated several times and the best
+(minimum) wall time is reported, along with the speed-up of the Native backend over the fastest openbabel backend.
+
+Usage:
+    python benchmark/native.py [--frames N] [--atoms N] [--repeat N] [--json]
+"""
+
+import argparse
+import sys
+import time
+import json
+import random
+import tempfile
+import logging
+from pathlib import Path
+
+# Run against the checked-out source, not whatever happens to be installed.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+BACKENDS = ("Native", "Pybel", "Obabel")
+
+SYMBOLS = ("C", "H", "N", "O", "S")
+
+
+def generate_trajectory(path, frames, atoms):
+    """
+    Write a random xyz trajectory.
+
+    :param path: The path to write to.
+    :param frames: The number of frames.
+    :param atoms: The number of atoms in each frame.
+    """
+    generator = random.Random(0)
+    symbols = [generator.choice(SYMBOLS) for atom in range(atoms)]
+
+    with open(path, "w") as trajectory:
+        for frame in range(frames):
+            trajectory.write("{}\nframe {}\n".format(atoms, frame))
+            trajectory.write("".join(
+                "{} {:.8f} {:.8f} {:.8f}\n".format(symbol, *(generator.uniform(-20, 20) for axis in range(3))) for symbol in symbols
+            ))
+
+
+def cases(trajectory, single):
+    """
+    Get the benchmark cases.
+
+    :param trajectory: Path to the xyz trajectory.
+    :param single: Path to a single frame turbomole file.
+    :return: An iterator of (name, function) pairs, where function performs the conversion with a given backend.
+    """
+    from openprattle import Openbabel_converter
+
+    for output_file_type in ("xyz", "tmol", "com"):
+        yield "xyz trajectory->{} (iter_convert)".format(output_file_type), lambda backend, output_file_type = output_file_type: sum(
+            1 for molecule in Openbabel_converter.from_file(input_file_path = trajectory, backend = backend).iter_convert(output_file_type, charge = 0, multiplicity = 1)
+        )
+
+    for output_file_type in ("xyz", "com"):
+        yield "tmol frame->{} (convert)".format(output_file_type), lambda backend, output_file_type = output_file_type: \
+            Openbabel_converter.from_file(input_file_path = single, backend = backend).convert(output_file_type, charge = 0, multiplicity = 1)
+
+
+def measure(function, backend, repeat):
+    """
+    Perform a conversion several times, returning the best wall time (in seconds), or None if the backend failed.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        try:
+            function(backend)
+
+        except Exception:
+            return None
+
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare the Native backend with the openbabel backends")
+    parser.add_argument("--frames", help = "The number of frames in the trajectory", type = int, default = 1000)
+    parser.add_argument("--atoms", help = "The number of atoms in each frame", type = int, default = 100)
+    parser.add_argument("--repeat", help = "The number of times to repeat each case", type = int, default = 3)
+    parser.add_argument("--json", help = "Print results in JSON", action = "store_true")
+    args = parser.parse_args()
+
+    from openprattle import Openbabel_converter
+
+    # The obabel backend warns that it can't set the charge and multiplicity of gaussian input files.
+    logging.getLogger("openprattle").setLevel(logging.ERROR)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        trajectory = Path(directory, "trajectory.xyz")
+        generate_trajectory(trajectory, args.frames, args.atoms)
+
+        single = Path(directory, "coord")
+        Openbabel_converter.from_file(input_file_path = trajectory, backend = "Native").convert("tmol", single)
+
+        for name, function in cases(str(trajectory), str(single)):
+            results[name] = {backend: measure(function, backend, args.repeat) for backend in BACKENDS}
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+
+    else:
+        print("{:40} {:>12} {:>12} {:>12} {:>9}".format("case", *("{} ms".format(backend) for backend in BACKENDS), "speed-up"))
+        for name, timings in results.items():
+            others = [timings[backend] for backend in BACKENDS[1:] if timings[backend] is not None]
+            print("{:40} {} {:>8.1f}x".format(
+                name,
+                " ".join("{:12.1f}".format(timings[backend] * 1000) if timings[backend] is not None else "{:>12}".format("failed") for backend in BACKENDS),
+                min(others) / timings['Native'] if len(others) > 0 and timings['Native'] else float("nan")
+            ))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
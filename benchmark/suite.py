@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Benchmark the conversion backends over a grid of input formats, molecule sizes, gen3D settings and input sources.
+
+For each case, the latency (median and best wall time of a conversion), throughput (conversions per second) and peak
+memory use (of the converting process, and of any obabel child processes) are recorded. Each case runs in its own
+interpreter, so peak memory is not polluted by earlier cases.
+
+Usage:
+    python benchmark/suite.py run [--output FILE] [--repeat N] [--budget SECONDS] [--filter REGEX]
+    python benchmark/suite.py compare BASELINE [CURRENT] [--threshold FRACTION]
+
+'compare' compares two sets of results (running the benchmark now if CURRENT is not given), printing the change in
+each measurement and exiting with a non-zero status if any case has become slower (or uses more memory) by more than
+the threshold. A baseline for the reference machine is kept in benchmark/baseline.json.
+"""
+
+import argparse
+import sys
+import os
+import re
+import time
+import json
+import platform
+import subprocess
+import resource
+import statistics
+import tempfile
+from pathlib import Path
+
+# Run against the checked-out source, not whatever happens to be installed.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DATA = Path(ROOT, "test", "data")
+
+BASELINE = Path(ROOT, "benchmark", "baseline.json")
+
+BACKENDS = ("Pybel", "Obabel")
+
+SOURCES = ("file", "buffer", "stdin")
+
+# The molecules to convert, and the formats each is available in.
+# cdx cannot be written by openbabel, so it is only available for the benzene test file.
+MOLECULES = {
+    "benzene": ("cml", "xyz", "cdx", "sdf"),
+    "polymer": ("cml", "xyz", "sdf"),
+    "protein": ("cml", "xyz", "sdf"),
+}
+
+# The format each input format is converted to.
+OUTPUT_FORMATS = {
+    "cml": "xyz",
+    "xyz": "cml",
+    "cdx": "xyz",
+    "sdf": "xyz",
+}
+
+
+def generate_inputs(directory):
+    """
+    Write the input files used by the benchmark to a directory.
+
+    The benzene files are copied from the test data; larger molecules are generated:
+     - polymer: a 50-unit polyethylene chain (302 atoms).
+     - protein: a 40-residue peptide (651 atoms).
+
+    :return: A dictionary of input file paths, keyed by (molecule, format).
+    """
+    from openprattle import Openbabel_converter
+
+    inputs = {}
+    for input_format in MOLECULES["benzene"]:
+        inputs[("benzene", input_format)] = Path(DATA, "Benzene." + input_format)
+
+    generated = {
+        # Generate 3D coordinates from SMILES.
+        "polymer": Openbabel_converter.from_file(input_file_buffer = "C" * 100, input_file_type = "smi").convert("xyz", gen3D = True),
+        # The fasta format builds a 3D peptide from its sequence.
+        "protein": Openbabel_converter.from_file(input_file_buffer = ">protein\n" + "ACDEFGHIKLMNPQRSTVWY" * 2, input_file_type = "fasta").convert("xyz", gen3D = False),
+    }
+
+    for molecule, xyz in generated.items():
+        for input_format in MOLECULES[molecule]:
+            path = Path(directory, "{}.{}".format(molecule, input_format))
+            Openbabel_converter.from_file(input_file_buffer = xyz, input_file_type = "xyz").convert(input_format, path, gen3D = False)
+            inputs[(molecule, input_format)] = path
+
+    return inputs
+
+
+def cases():
+    """
+    Get the grid of benchmark cases.
+
+    Every input source is measured without gen3D; gen3D (which is much slower) is measured for file input only.
+
+    :return: An iterator of case dictionaries.
+    """
+    for molecule, input_formats in MOLECULES.items():
+        for input_format in input_formats:
+            for backend in BACKENDS:
+                if backend == "Pybel" and input_format == "cdx":
+                    # Not supported by pybel.
+                    continue
+
+                for gen3D in (False, True):
+                    for source in (SOURCES if not gen3D else ("file",)):
+                        yield {
+                            "molecule": molecule,
+                            "input_format": input_format,
+                            "output_format": OUTPUT_FORMATS[input_format],
+                            "backend": backend,
+                            "gen3D": gen3D,
+                            "source": source
+                        }
+
+
+def case_name(case):
+    """
+    A unique name for a benchmark case.
+    """
+    return "{backend}/{molecule}.{input_format}->{output_format}/gen3D={gen3D}/{source}".format(**case)
+
+
+def run_case(case, path, repeat, budget):
+    """
+    Measure a single case in the current process.
+
+    :param case: The case dictionary.
+    :param path: Path to the input file.
+    :param repeat: The maximum number of conversions to perform.
+    :param budget: Stop after this many seconds (after at least one conversion).
+    :return: A dictionary of measurements.
+    """
+    from openprattle import Openbabel_converter
+
+    input_buffer = Path(path).read_bytes() if case['input_format'] == "cdx" else Path(path).read_text()
+
+    def convert():
+        options = {"input_file_type": case['input_format'], "backend": case['backend']}
+
+        if case['source'] == "file":
+            converter = Openbabel_converter.from_file(input_file_path = path, **options)
+            return converter.convert(case['output_format'], gen3D = case['gen3D'])
+
+        elif case['source'] == "buffer":
+            converter = Openbabel_converter.from_file(input_file_buffer = input_buffer, **options)
+            return converter.convert(case['output_format'], gen3D = case['gen3D'])
+
+        else:
+            # An open file, as used when reading from stdin.
+            with open(path, "rb") as input_file:
+                converter = Openbabel_converter.from_file(input_file = input_file, **options)
+                return converter.convert(case['output_format'], gen3D = case['gen3D'])
+
+    timings = []
+    total_start = time.perf_counter()
+    while len(timings) < repeat and (len(timings) == 0 or time.perf_counter() - total_start < budget):
+        start = time.perf_counter()
+        convert()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "runs": len(timings),
+        "latency_median": statistics.median(timings),
+        "latency_min": min(timings),
+        "throughput": len(timings) / sum(timings),
+        # ru_maxrss is in kilobytes on linux.
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "child_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def metadata():
+    """
+    Describe the environment the benchmark was run in.
+    """
+    from openprattle.babel import Obabel_converter
+    import openprattle
+
+    try:
+        openbabel_version = Obabel_converter.version()
+
+    except Exception:
+        openbabel_version = None
+
+    return {
+        "openprattle": str(openprattle.__version__),
+        "openbabel": openbabel_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%d"),
+    }
+
+
+def run(args):
+    """
+    Run the benchmark, with each case in a new interpreter.
+
+    :return: The results dictionary.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # Generate the inputs in a separate interpreter; linux carries the peak RSS of a process over to the programs it runs,
+        # so this one must stay small.
+        inputs = {
+            tuple(key.split(".")): path
+                for key, path in json.loads(subprocess.run([sys.executable, __file__, "generate", directory], stdout = subprocess.PIPE, check = True).stdout).items()
+        }
+
+        for case in cases():
+            name = case_name(case)
+            if args.filter and not re.search(args.filter, name):
+                continue
+
+            done = subprocess.run(
+                [
+                    sys.executable, __file__, "case",
+                    json.dumps(case),
+                    str(inputs[(case['molecule'], case['input_format'])]),
+                    "--repeat", str(args.repeat),
+                    "--budget", str(args.budget)
+                ],
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+                universal_newlines = True
+            )
+
+            if done.returncode != 0:
+                results[name] = {"error": done.stderr.strip().split("\n")[-1]}
+                print("{:60} : failed ({})".format(name, results[name]['error']), file = sys.stderr)
+
+            else:
+                results[name] = json.loads(done.stdout)
+                print("{:60} : {:10.2f} ms {:8.0f} KiB".format(name, results[name]['latency_median'] * 1000, results[name]['peak_rss_kb']), file = sys.stderr)
+
+    return {"meta": metadata(), "results": results}
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare two sets of results.
+
+    :param baseline: The reference results.
+    :param current: The results to check.
+    :param threshold: The fractional increase above which a measurement counts as a regression.
+    :return: The number of regressions.
+    """
+    regressions = 0
+    missing = 0
+    print("{:60} {:>12} {:>12} {:>8} {:>8}".format("case", "baseline ms", "current ms", "time", "rss"))
+
+    for name, reference in baseline['results'].items():
+        result = current['results'].get(name)
+        if result is None:
+            missing += 1
+            continue
+
+        elif "error" in result or "error" in reference:
+            print("{:60} {}".format(name, "failed" if "error" in result else "fixed"))
+            regressions += "error" in result and "error" not in reference
+            continue
+
+        # The best time is the least noisy estimate of the real cost.
+        time_change = result['latency_min'] / reference['latency_min'] - 1
+        rss_change = result['peak_rss_kb'] / reference['peak_rss_kb'] - 1
+        regressed = time_change > threshold or rss_change > threshold
+        regressions += regressed
+
+        print("{:60} {:12.2f} {:12.2f} {:+7.0%} {:+7.0%}{}".format(
+            name,
+            reference['latency_min'] * 1000,
+            result['latency_min'] * 1000,
+            time_change,
+            rss_change,
+            "  REGRESSION" if regressed else ""
+        ))
+
+    if missing > 0:
+        print("{} baseline cases were not run".format(missing))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the openprattle conversion backends")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    run_parser = subparsers.add_parser("run", help = "Run the benchmark")
+    run_parser.add_argument("--output", help = "File to write the results to (default stdout)")
+    run_parser.add_argument("--filter", help = "Only run cases whose name matches this regular expression")
+
+    compare_parser = subparsers.add_parser("compare", help = "Compare results against a baseline")
+    compare_parser.add_argument("baseline", help = "The baseline results", nargs = "?", default = str(BASELINE))
+    compare_parser.add_argument("current", help = "The results to compare; if not given, the benchmark is run now", nargs = "?")
+    compare_parser.add_argument("--threshold", help = "Fractional slow-down (or memory increase) that counts as a regression", type = float, default = 0.25)
+    compare_parser.add_argument("--filter", help = "Only run cases whose name matches this regular expression")
+
+    generate_parser = subparsers.add_parser("generate", help = argparse.SUPPRESS)
+    generate_parser.add_argument("directory")
+
+    case_parser = subparsers.add_parser("case", help = argparse.SUPPRESS)
+    case_parser.add_argument("case")
+    case_parser.add_argument("path")
+
+    for subparser in (run_parser, compare_parser, case_parser):
+        subparser.add_argument("--repeat", help = "The maximum number of conversions per case", type = int, default = 20)
+        subparser.add_argument("--budget", help = "The maximum time (in seconds) to spend repeating each case", type = float, default = 2.0)
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        print(json.dumps({"{}.{}".format(*key): str(path) for key, path in generate_inputs(args.directory).items()}))
+
+    elif args.command == "case":
+        print(json.dumps(run_case(json.loads(args.case), args.path, args.repeat, args.budget)))
+
+    elif args.command == "run":
+        results = json.dumps(run(args), indent = 4)
+        if args.output:
+            Path(args.output).write_text(results + "\n")
+
+        else:
+            print(results)
+
+    else:
+        baseline = json.loads(Path(args.baseline).read_text())
+        current = json.loads(Path(args.current).read_text()) if args.current else run(args)
+        return 1 if compare(baseline, current, args.threshold) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,11 @@
 # -*- mode: python ; coding: utf-8 -*-
 
 import sys
+import json
 import itertools
 from pathlib import Path
 sys.path.insert(0,str(Path("../").resolve()))
+sys.path.insert(0,str(Path("../../").resolve()))
 from collect_licenses import find_licenses
 
 datas = []
@@ -18,6 +20,13 @@ binaries = [
     (Path(os.environ['CONDA_PREFIX'], "lib/libinchi.so.0"), ".")
 ]
 
+# Precompute the table of formats supported by the bundled openbabel, so the frozen program doesn't need to load every plugin just to list them.
+from openprattle.babel import Pybel_formats
+formats_table = Path("build", "formats.json")
+formats_table.parent.mkdir(exist_ok = True)
+formats_table.write_text(json.dumps({"PYBEL": Pybel_formats().table(refresh = True)}))
+datas.append((formats_table, "openprattle"))
+
 script = "../../bin/oprattle"
 prog_name = "oprattle"
 package_name = os.environ['BUILD_TARGET']
@@ -54,6 +63,9 @@ pyz = PYZ(a.pure, a.zipped_data,
      cipher=None
 )
 
+# Build a single directory (onedir) rather than a single file. A onefile build extracts itself (including the whole
+# openbabel lib and data directories, which BABEL_LIBDIR and BABEL_DATADIR point to) to a new temporary directory
+# on every invocation; onedir builds are run in place. Check start-up time with benchmark/frozen.py.
 exe = EXE(pyz,
      a.scripts,
      [],
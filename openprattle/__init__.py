@@ -41,4 +41,5 @@ if frozen:
     os.environ['BABEL_DATADIR'] = str(Path(sys._MEIPASS, "openbabel", "data", openbabel_version))
 
 # Convenience imports.
-from .babel import Openbabel_converter, HAVE_PYBEL, formats
+from .babel import Openbabel_converter, Conversion_timeout, HAVE_PYBEL, formats
+from .batch import Conversion_job, Conversion_result
@@ -0,0 +1,429 @@
+"""Adaptive selection of the conversion backend, based on measured performance."""
+
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+import logging
+from pathlib import Path
+
+from openprattle.babel import Openbabel_converter, Obabel_converter, HAVE_PYBEL, FOUND_PYBEL, FORBIDDEN
+from openprattle.cache import cache_dir
+
+if FOUND_PYBEL:
+    from openprattle.babel import Pybel_converter, pybel
+
+
+# The upper limits (in bytes) of the input size buckets; larger inputs go in a final, unbounded bucket.
+SIZE_BUCKETS = (
+    1024,
+    16 * 1024,
+    256 * 1024,
+    4 * 1024 * 1024
+)
+
+def size_bucket(size):
+    """
+    Get the name of the bucket that an input of a given size belongs to.
+
+    :param size: The size of the input file (in bytes), or None if not known.
+    """
+    if size is None:
+        return "unknown"
+
+    for limit in SIZE_BUCKETS:
+        if size < limit:
+            return "<{}".format(limit)
+
+    return ">={}".format(SIZE_BUCKETS[-1])
+
+
+class Backend_stats():
+    """
+    Records the latency and failure rate of each backend, for each combination of input format, output format, input size and conversion options.
+
+    Statistics are kept in memory and periodically written to a JSON file, so they persist across runs.
+    """
+
+    # The number of samples each backend needs before we trust its statistics.
+    MIN_SAMPLES = 3
+
+    # Every this many requests, the backend with the fewest samples is tried, so a backend that was slow (or failed) once isn't ignored forever.
+    EXPLORE_INTERVAL = 50
+
+    # The weight given to each new latency measurement in the (exponentially weighted) mean.
+    SMOOTHING = 0.2
+
+    # The number of new records after which the statistics are written to disk.
+    SAVE_INTERVAL = 20
+
+    def __init__(self, path = None):
+        """
+        :param path: Path to the file to persist statistics to. If None, statistics are kept in memory only.
+        """
+        self.path = Path(path) if path is not None else None
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.unsaved = 0
+
+        if self.path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(input_file_type, output_file_type, size, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        The key under which the statistics for a given conversion are stored.
+        """
+        return "{}:{}:{}:gen3D={}:charge={}:multiplicity={}".format(input_file_type.lower(), output_file_type.lower(), size_bucket(size), gen3D, charge, multiplicity)
+
+    def load(self):
+        """
+        Load previously saved statistics (if there are any).
+        """
+        try:
+            stats = json.loads(self.path.read_text())
+
+        except FileNotFoundError:
+            return
+
+        except Exception:
+            logging.getLogger("openprattle").warning("Could not read backend statistics file '{}'; starting afresh".format(self.path), exc_info = True)
+            return
+
+        with self.lock:
+            self.stats = stats
+
+    def save(self):
+        """
+        Write the statistics to disk.
+        """
+        if self.path is None:
+            return
+
+        with self.lock:
+            data = json.dumps(self.stats, indent = 4, sort_keys = True)
+            self.unsaved = 0
+
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            # Write to a temporary file first, so other processes never see a partial file.
+            descriptor, temp_path = tempfile.mkstemp(dir = self.path.parent, prefix = ".")
+            with os.fdopen(descriptor, "w") as temp_file:
+                temp_file.write(data)
+
+            os.replace(temp_path, self.path)
+
+        except Exception:
+            logging.getLogger("openprattle").warning("Could not write backend statistics file '{}'".format(self.path), exc_info = True)
+
+    def record(self, input_file_type, output_file_type, size, backend, latency, success, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Record the outcome of a conversion.
+
+        :param input_file_type: The format that was converted from.
+        :param output_file_type: The format that was converted to.
+        :param size: The size of the input file (in bytes).
+        :param backend: The name of the backend that performed the conversion.
+        :param latency: The time the conversion took (in seconds).
+        :param success: Whether the conversion succeeded.
+        :param gen3D: Whether 3D coordinates were generated.
+        :param charge: The charge that was set.
+        :param multiplicity: The multiplicity that was set.
+        """
+        with self.lock:
+            entry = self.stats.setdefault(self.key(input_file_type, output_file_type, size, gen3D = gen3D, charge = charge, multiplicity = multiplicity), {}).setdefault(backend, {
+                "count": 0,
+                "failures": 0,
+                "latency": None
+            })
+
+            entry['count'] += 1
+            if not success:
+                entry['failures'] += 1
+
+            elif entry['latency'] is None:
+                entry['latency'] = latency
+
+            else:
+                entry['latency'] += self.SMOOTHING * (latency - entry['latency'])
+
+            self.unsaved += 1
+            save = self.unsaved >= self.SAVE_INTERVAL
+
+        if save:
+            self.save()
+
+    def cost(self, entry):
+        """
+        The expected cost (in seconds) of a conversion with a backend, accounting for the chance that it will fail (and need to be repeated).
+        """
+        success_rate = (entry['count'] - entry['failures']) / entry['count']
+        if entry['latency'] is None or success_rate == 0:
+            return float("inf")
+
+        return entry['latency'] / success_rate
+
+    def choose(self, input_file_type, output_file_type, size, backends, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Choose the backend to perform a conversion with.
+
+        :param input_file_type: The format to convert from.
+        :param output_file_type: The format to convert to.
+        :param size: The size of the input file (in bytes).
+        :param backends: A list of the names of the backends that can perform the conversion, in order of preference.
+        :param gen3D: Whether 3D coordinates will be generated.
+        :param charge: The charge that will be set.
+        :param multiplicity: The multiplicity that will be set.
+        :return: A list of backend names, in the order they should be tried.
+        """
+        with self.lock:
+            stats = self.stats.setdefault(self.key(input_file_type, output_file_type, size, gen3D = gen3D, charge = charge, multiplicity = multiplicity), {})
+            stats['requests'] = stats.get('requests', 0) + 1
+            entries = {backend: stats.get(backend, {"count": 0, "failures": 0, "latency": None}) for backend in backends}
+
+            # Try backends we don't know much about first.
+            untested = [backend for backend in backends if entries[backend]['count'] < self.MIN_SAMPLES]
+            if len(untested) > 0:
+                first = untested[0]
+
+            elif stats['requests'] % self.EXPLORE_INTERVAL == 0:
+                first = min(backends, key = lambda backend: entries[backend]['count'])
+
+            else:
+                first = min(backends, key = lambda backend: self.cost(entries[backend]))
+
+        return [first] + [backend for backend in backends if backend != first]
+
+    def table(self):
+        """
+        Get a summary of the recorded statistics, suitable for inspection.
+
+        :return: A dictionary, keyed by 'input:output:size:options', of dictionaries of backend statistics (count, failures, failure_rate, latency and cost, in seconds).
+        """
+        with self.lock:
+            return {
+                key: {
+                    backend: dict(entry, failure_rate = entry['failures'] / entry['count'], cost = self.cost(entry) if self.cost(entry) != float("inf") else None)
+                        for backend, entry in stats.items() if backend != "requests"
+                }
+                    for key, stats in self.stats.items()
+            }
+
+    def clear(self):
+        """
+        Forget all recorded statistics.
+        """
+        with self.lock:
+            self.stats = {}
+            self.unsaved = 0
+
+        if self.path is not None:
+            try:
+                self.path.unlink()
+
+            except FileNotFoundError:
+                pass
+
+
+# The statistics used by default, created when first needed.
+_default_stats = None
+_default_stats_lock = threading.Lock()
+
+def default_stats():
+    """
+    Get the Backend_stats object shared by adaptive converters by default, which is stored in the openprattle cache directory.
+    """
+    global _default_stats
+
+    with _default_stats_lock:
+        if _default_stats is None:
+            _default_stats = Backend_stats(Path(cache_dir(), "backend_stats.json"))
+
+        return _default_stats
+
+
+class Adaptive_converter(Openbabel_converter):
+    """
+    A converter that chooses which backend to convert with each time it is used, based on the measured performance of each backend.
+
+    For each combination of input format, output format, input size and conversion options, the latency and failure rate of each backend are recorded,
+    and requests are routed to whichever backend is expected to be cheapest. If the chosen backend fails, the other is tried.
+
+    The backends only choose between giving the same result: gen3D is decided before choosing (Obabel doesn't generate 3D coordinates
+    by default, while Pybel does for molecules that aren't already 3D), and only Pybel is used when a charge or multiplicity is given (because Obabel can't set them).
+    """
+
+    BACKEND = "Adaptive"
+
+    def __init__(self, *args, stats = None, **kwargs):
+        """
+        See Openbabel_converter for the full list of arguments.
+
+        :param stats: The Backend_stats object used to record and choose backends. If None, the default (persistent) statistics are used.
+        """
+        super().__init__(*args, **kwargs)
+        self.stats = stats if stats is not None else default_stats()
+
+    @classmethod
+    def version(self):
+        """
+        Get the version of openbabel used by this class.
+        """
+        return Obabel_converter.version()
+
+    def backends(self, *, charge = None, multiplicity = None):
+        """
+        Get the names of the backends that can perform a conversion, in order of preference.
+
+        :param charge: The charge to set; only Pybel can set the charge, so it is the only backend used if this is given.
+        :param multiplicity: The multiplicity to set; as for charge.
+        """
+        if HAVE_PYBEL and self.input_file_type.lower() not in FORBIDDEN['PYBEL']:
+            return ["Pybel"] if charge is not None or multiplicity is not None else ["Pybel", "Obabel"]
+
+        else:
+            return ["Obabel"]
+
+    def resolve_gen3D(self, gen3D, backends):
+        """
+        Decide whether to generate 3D coordinates, so that every backend gives the same result.
+
+        Pybel generates 3D coordinates by default for molecules that aren't already 3D, while Obabel doesn't, so the (first) molecule is read to decide.
+
+        :param gen3D: Whether to generate 3D coordinates, or None to decide automatically.
+        :param backends: The names of the backends that can perform the conversion.
+        :return: A tuple of (gen3D, backends). If gen3D could not be decided, only the preferred backend is returned.
+        """
+        if gen3D is not None or "Pybel" not in backends:
+            # Obabel decides gen3D itself.
+            return gen3D, backends
+
+        if self.input_file is None:
+            try:
+                return self.delegate("Pybel").read_molecule().dim != 3, backends
+
+            except Exception:
+                # The conversion will (probably) fail too, and report the problem.
+                logging.getLogger("openprattle").debug("Could not read file '{}' to decide whether to generate 3D coordinates".format(self.input_name), exc_info = True)
+
+        return gen3D, backends[:1]
+
+    def input_size(self):
+        """
+        The size (in bytes) of the input file.
+        """
+        if self.input_file_buffer is not None:
+            return len(self.input_file_buffer)
+
+        elif self.input_file_path is not None:
+            try:
+                return os.path.getsize(self.input_file_path)
+
+            except OSError:
+                return None
+
+        return None
+
+    def delegate(self, backend):
+        """
+        Get a converter of a given backend that wraps the same input file as this one.
+        """
+        cls = Pybel_converter if backend == "Pybel" else Obabel_converter
+        return cls(
+            input_file_buffer = self.input_file_buffer,
+            input_file_path = self.input_file_path,
+            input_file_type = self.input_file_type,
+            hooks = self.hooks,
+            geometry_cache = self.geometry_cache,
+            seed = self.seed
+        )
+
+    def _convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, with whichever backend is expected to be cheapest.
+
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param output_stream: Optional binary file object or file descriptor to write the converted file to.
+        :return: The converted file, or None if output_file is not None (or the file was written to output_stream).
+        """
+        if self.input_file is not None:
+            # We may need to read the input more than once (if the first backend fails).
+            self.input_file_buffer = self.input_file.read()
+            self.input_file = None
+
+        size = self.input_size()
+        gen3D, backends = self.resolve_gen3D(gen3D, self.backends(charge = charge, multiplicity = multiplicity))
+        options = {"gen3D": gen3D, "charge": charge, "multiplicity": multiplicity}
+        backends = self.stats.choose(self.input_file_type, output_file_type, size, backends, **options)
+
+        for attempt, backend in enumerate(backends):
+            start = time.perf_counter()
+            try:
+                # Only the last backend can stream its output; otherwise a failure could leave a partial file in the stream.
+                result = self.delegate(backend)._convert(
+                    output_file_type,
+                    output_file,
+                    gen3D = gen3D,
+                    charge = charge,
+                    multiplicity = multiplicity,
+                    output_stream = output_stream if attempt == len(backends) -1 else None
+                )
+
+            except Exception:
+                self.stats.record(self.input_file_type, output_file_type, size, backend, time.perf_counter() - start, False, **options)
+
+                if attempt == len(backends) -1:
+                    raise
+
+                logging.getLogger("openprattle").debug("Backend '{}' failed to convert file '{}'; trying '{}' instead".format(backend, self.input_name, backends[attempt +1]), exc_info = True)
+
+            else:
+                self.stats.record(self.input_file_type, output_file_type, size, backend, time.perf_counter() - start, True, **options)
+                return result
+
+    def _convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to several formats at once, with whichever backend is expected to be cheapest.
+
+        The backend is chosen based on the statistics of the first output format; statistics are not recorded.
+
+        :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output formats.
+        :param multiplicity: Optional multiplicity of the output formats.
+        :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+        """
+        if self.input_file is not None:
+            # The input may be read to decide gen3D.
+            self.input_file_buffer = self.input_file.read()
+            self.input_file = None
+
+        gen3D, backends = self.resolve_gen3D(gen3D, self.backends(charge = charge, multiplicity = multiplicity))
+        backend = self.stats.choose(self.input_file_type, next(iter(outputs)), self.input_size(), backends, gen3D = gen3D, charge = charge, multiplicity = multiplicity)[0]
+        return self.delegate(backend)._convert_multi(outputs, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+
+    def iter_convert(self, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert each of the molecules in the input file wrapped by this class to the designated output_file_type, with whichever backend is expected to be cheapest.
+
+        Statistics are not recorded for iterative conversions (the time taken depends on how quickly the results are consumed).
+        Whether to generate 3D coordinates is decided from the first molecule (unless reading from an open file, in which case Pybel is preferred).
+
+        :param output_file_type: The file type to convert to.
+        :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :return: An iterator of converted molecules, each as a string.
+        """
+        gen3D, backends = self.resolve_gen3D(gen3D, self.backends(charge = charge, multiplicity = multiplicity))
+        backend = self.stats.choose(self.input_file_type, output_file_type, self.input_size(), backends, gen3D = gen3D, charge = charge, multiplicity = multiplicity)[0]
+        converter = self.delegate(backend)
+        converter.input_file = self.input_file
+        return converter.iter_convert(output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
@@ -0,0 +1,199 @@
+"""Conversion of molecules to and from numpy arrays of atomic numbers, coordinates and bonds."""
+
+import ctypes
+
+from openprattle.babel import FOUND_PYBEL
+
+if FOUND_PYBEL:
+    from openprattle.babel import Pybel_converter, pybel
+
+
+def import_numpy():
+    """
+    Import numpy, which is only needed (and so is only an optional dependency) for array conversions.
+    """
+    try:
+        import numpy
+
+    except ImportError:
+        raise ImportError("numpy is required to convert molecules to and from arrays") from None
+
+    return numpy
+
+
+class Molecule_arrays():
+    """
+    A molecule described by arrays, rather than by a file.
+
+     - atomic_numbers: An (N,) integer array of the atomic number of each atom.
+     - coordinates: An (N,3) float64 array of the cartesian coordinates (in angstrom) of each atom, or None if the molecule has no coordinates.
+     - bonds: An (M,2) integer array of the (zero-based) indices of the two atoms joined by each bond, or None if bonds should be perceived from the coordinates.
+     - bond_orders: An (M,) integer array of the order of each bond.
+     - charge: The total charge of the molecule.
+     - multiplicity: The spin multiplicity of the molecule, or None if it should be perceived.
+     - title: The title (name) of the molecule.
+    """
+
+    def __init__(self, atomic_numbers, coordinates = None, *, bonds = None, bond_orders = None, charge = 0, multiplicity = None, title = ""):
+        """
+        Arguments can be numpy arrays, or anything numpy can convert to an array (lists etc).
+
+        :param atomic_numbers: The atomic number of each atom.
+        :param coordinates: Optional cartesian coordinates of each atom, with shape (N,3).
+        :param bonds: Optional pairs of atom indices (counting from zero), with shape (M,2). If not given (and coordinates are), bonds are perceived from the coordinates.
+        :param bond_orders: Optional order of each bond. If not given, all bonds are single.
+        :param charge: The total charge of the molecule.
+        :param multiplicity: Optional spin multiplicity of the molecule.
+        :param title: Optional title of the molecule.
+        """
+        numpy = import_numpy()
+
+        self.atomic_numbers = numpy.asarray(atomic_numbers, dtype = numpy.int64).reshape(-1)
+        self.coordinates = numpy.asarray(coordinates, dtype = numpy.float64) if coordinates is not None else None
+        self.bonds = numpy.asarray(bonds, dtype = numpy.int64).reshape(-1, 2) if bonds is not None else None
+        self.bond_orders = numpy.asarray(bond_orders, dtype = numpy.int64).reshape(-1) if bond_orders is not None else None
+        self.charge = int(charge)
+        self.multiplicity = int(multiplicity) if multiplicity is not None else None
+        self.title = title
+
+        if self.coordinates is not None and self.coordinates.shape != (len(self.atomic_numbers), 3):
+            raise ValueError("coordinates must have shape ({}, 3), not {}".format(len(self.atomic_numbers), self.coordinates.shape))
+
+        if self.bond_orders is not None and (self.bonds is None or len(self.bond_orders) != len(self.bonds)):
+            raise ValueError("bond_orders must have the same length as bonds")
+
+        if self.bonds is not None and len(self.bonds) > 0 and (self.bonds.min() < 0 or self.bonds.max() >= len(self.atomic_numbers)):
+            raise ValueError("bonds refer to atoms that do not exist")
+
+    def __len__(self):
+        return len(self.atomic_numbers)
+
+    def __repr__(self):
+        return "<{} {} atoms, {} bonds, charge {}, multiplicity {}>".format(
+            type(self).__name__,
+            len(self),
+            len(self.bonds) if self.bonds is not None else "unknown",
+            self.charge,
+            self.multiplicity
+        )
+
+    @classmethod
+    def from_obmol(self, obmol):
+        """
+        Get the arrays describing an openbabel OBMol object.
+
+        Coordinates are copied directly from the molecule's coordinate buffer, rather than one atom at a time.
+        """
+        numpy = import_numpy()
+        atom_count = obmol.NumAtoms()
+
+        if atom_count > 0:
+            buffer = (ctypes.c_double * (atom_count * 3)).from_address(int(obmol.GetCoordinates()))
+            coordinates = numpy.frombuffer(buffer, dtype = numpy.float64).reshape(atom_count, 3).copy()
+
+        else:
+            coordinates = numpy.zeros((0, 3), dtype = numpy.float64)
+
+        atomic_numbers = numpy.fromiter((atom.GetAtomicNum() for atom in pybel.ob.OBMolAtomIter(obmol)), dtype = numpy.int64, count = atom_count)
+
+        bonds = numpy.fromiter(
+            (index for bond in pybel.ob.OBMolBondIter(obmol) for index in (bond.GetBeginAtomIdx() -1, bond.GetEndAtomIdx() -1, bond.GetBondOrder())),
+            dtype = numpy.int64,
+            count = obmol.NumBonds() * 3
+        ).reshape(-1, 3)
+
+        return self(
+            atomic_numbers,
+            coordinates,
+            bonds = bonds[:, :2],
+            bond_orders = bonds[:, 2],
+            charge = obmol.GetTotalCharge(),
+            multiplicity = obmol.GetTotalSpinMultiplicity(),
+            title = obmol.GetTitle()
+        )
+
+    def to_obmol(self):
+        """
+        Build an openbabel OBMol object from these arrays.
+
+        Coordinates are copied to the molecule in a single block, rather than one atom at a time.
+        """
+        numpy = import_numpy()
+        obmol = pybel.ob.OBMol()
+
+        obmol.BeginModify()
+        obmol.ReserveAtoms(len(self))
+        for atomic_number in self.atomic_numbers.tolist():
+            obmol.NewAtom().SetAtomicNum(atomic_number)
+
+        if self.bonds is not None:
+            bond_orders = self.bond_orders.tolist() if self.bond_orders is not None else [1] * len(self.bonds)
+            for (start, end), order in zip(self.bonds.tolist(), bond_orders):
+                obmol.AddBond(start +1, end +1, order)
+
+        obmol.EndModify()
+
+        if self.coordinates is not None and len(self) > 0:
+            coordinates = numpy.ascontiguousarray(self.coordinates, dtype = numpy.float64)
+            buffer = pybel.ob.doubleArray(coordinates.size)
+            ctypes.memmove(int(buffer.cast()), coordinates.ctypes.data, coordinates.nbytes)
+            # The coordinates are copied, so the buffer can be freed afterwards.
+            obmol.SetCoordinates(buffer.cast())
+            obmol.SetDimension(3)
+
+            if self.bonds is None:
+                # The same perception openbabel performs when reading an xyz file.
+                obmol.ConnectTheDots()
+                obmol.PerceiveBondOrders()
+
+        else:
+            obmol.SetDimension(0)
+
+        obmol.SetTotalCharge(self.charge)
+        if self.multiplicity is not None:
+            obmol.SetTotalSpinMultiplicity(self.multiplicity)
+
+        obmol.SetTitle(self.title)
+        return obmol
+
+
+if FOUND_PYBEL:
+
+    class Array_converter(Pybel_converter):
+        """
+        A converter for a molecule given as arrays (see Molecule_arrays), rather than as a file.
+
+        The molecule is built directly, so no file needs to be written or parsed. Because there is no input file,
+        these converters cannot be used with a Worker_pool or Conversion_cache.
+        """
+
+        def __init__(self, arrays, **kwargs):
+            """
+            :param arrays: The Molecule_arrays object to convert.
+            :param kwargs: Other arguments to the Openbabel_converter constructor.
+            """
+            if kwargs.get("pool") is not None or kwargs.get("cache") is not None:
+                raise ValueError("Molecules given as arrays cannot be converted with a pool or cache")
+
+            super().__init__(input_file_type = "arrays", **kwargs)
+            self.arrays = arrays
+
+        @property
+        def input_name(self):
+            """
+            A descriptive name of the molecule we are converting.
+            """
+            return "(molecule loaded from arrays)"
+
+        def to_job(self, *args, **kwargs):
+            raise ValueError("Molecules given as arrays cannot be sent to another process")
+
+        def read_molecules(self):
+            """
+            Build the molecule wrapped by this class.
+
+            A new molecule is built each time, because conversions modify the molecule they are given.
+
+            :return: An iterator of one pybel Molecule object.
+            """
+            yield pybel.Molecule(self.arrays.to_obmol())
@@ -4,28 +4,114 @@ from subprocess import CalledProcessError
 import re
 import sys
 import os
+import signal
 import copy
+import contextlib
+import time
+import shutil
+import tempfile
 from pathlib import Path
 import logging
+import importlib
+import importlib.util
+import importlib.machinery
+import json
+import hashlib
+import io
+import threading
+import functools
 
 import openprattle.log
 
-# Try and load openbabel bindings.
-HAVE_PYBEL = False
+class Lazy_module():
+    """
+    A stand-in for a module that is only imported when one of its attributes is first accessed.
+    
+    Importing the pybel bindings loads the openbabel library and all of its plugins, which is slow.
+    Many uses of openprattle (printing the version, checking for the bindings, using obabel) never need them.
+    """
+    
+    def __init__(self, name):
+        """
+        :param name: The full name of the module to import.
+        """
+        self._name = name
+        self._module = None
+        self._error = None
+    
+    def load(self):
+        """
+        Import the wrapped module, if it has not been already.
+        
+        :return: True if the module was imported successfully, False otherwise.
+        """
+        if self._module is None and self._error is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            
+            except Exception as e:
+                # Some error occurred; print an error but continue.
+                self._error = e
+                openprattle.log.ensure_logger()
+                logging.getLogger("openprattle").error("Found but could not load python pybel bindings; falling back to obabel executable", exc_info = True)
+        
+        return self._module is not None
+    
+    def __getattr__(self, name):
+        if not self.load():
+            raise ImportError("Could not import module '{}'".format(self._name)) from self._error
+        
+        # Remember the attribute, so later lookups don't come through here.
+        value = getattr(self._module, name)
+        setattr(self, name, value)
+        return value
+
+
+class Lazy_flag():
+    """
+    A boolean that is only determined when it is first tested (with bool(), 'if' etc).
+    """
+    
+    def __init__(self, function):
+        """
+        :param function: A function that determines the value of the flag.
+        """
+        self._function = function
+        self._value = None
+    
+    def __bool__(self):
+        if self._value is None:
+            self._value = bool(self._function())
+        
+        return self._value
+    
+    def __repr__(self):
+        return repr(bool(self))
+
+
+def find_pybel():
+    """
+    Determine whether the pybel bindings are installed, without importing them.
+    
+    The bindings may still fail to load (if the openbabel library is broken, for example); use HAVE_PYBEL to check that they work.
+    """
+    openbabel_spec = importlib.util.find_spec("openbabel")
+    if openbabel_spec is None or openbabel_spec.submodule_search_locations is None:
+        return False
+    
+    # Don't use find_spec("openbabel.pybel"), because that imports the parent package (which loads the openbabel library).
+    return importlib.machinery.PathFinder.find_spec("pybel", openbabel_spec.submodule_search_locations) is not None
 
-try:
-    from openbabel import pybel
-    HAVE_PYBEL = True
 
-except ModuleNotFoundError:
-    # No bindings, carry on.
-    # TODO: This message is unreachable. Logging is not set to debug by default, and this module is imported before the user can ever change it.
-    logging.getLogger("openprattle").debug("Could not load python pybel bindings; falling back to obabel executable", exc_info = True)
+# The environment variables that control where openbabel looks for its plugins and data.
+# These are recorded now because importing the openbabel bindings can change them.
+BABEL_ENVIRONMENT = {name: os.environ.get(name) for name in ("BABEL_LIBDIR", "BABEL_DATADIR")}
 
-except Exception:
-    # Some other error occurred; print an error but continue.
-    # TODO: Should we catch this?
-    logging.getLogger("openprattle").error("Found but could not load python pybel bindings; falling back to obabel executable", exc_info = True)
+# Check for the openbabel bindings (these are loaded on first use).
+FOUND_PYBEL = find_pybel()
+pybel = Lazy_module("openbabel.pybel")
+# Whether the bindings can actually be used; testing this loads them.
+HAVE_PYBEL = Lazy_flag(lambda: FOUND_PYBEL and pybel.load())
 
 # Formats that are broken with either pybel or obabel.
 # TODO: We should try and record which versions of obabel these are broken with; they may get fixed in the future. 
@@ -41,6 +127,101 @@ FORBIDDEN = {
     )
 }
 
+# Formats that can be read by the pure-python Native_converter, which from_file() uses for them automatically.
+NATIVE_FORMATS = (
+    "xyz",
+    "tmol"
+)
+
+# The size of the chunks (in bytes or characters) used when copying files.
+CHUNK_SIZE = 65536
+
+# The ways a conversion that timed out can be retried (see Openbabel_converter.convert()).
+TIMEOUT_STRATEGIES = (
+    "other_backend",
+    "without_gen3D"
+)
+
+# The maximum total length (in characters) of the input file paths given to a single obabel command by Obabel_converter.convert_batch().
+# This is well within the limits of every platform (the smallest being Windows, at 32767 characters for the whole command).
+BATCH_ARGUMENT_LENGTH = 24000
+
+# Formats that are binary rather than text; conversions to these formats are returned as bytes.
+BINARY_FORMATS = (
+    "cdx",
+    "png"
+)
+
+def decode_output(data, output_file_type):
+    """
+    Decode the raw bytes of a converted file.
+    
+    :param data: The converted file, as bytes.
+    :param output_file_type: The format of the converted file.
+    :return: The converted file as bytes if it is in a binary format, or as a string (with universal newlines) otherwise.
+    """
+    if output_file_type.lower() in BINARY_FORMATS:
+        return bytes(data)
+    
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+def write_output(output_stream, data):
+    """
+    Write a converted file to an output stream.
+    
+    :param output_stream: A binary file object, or a file descriptor, to write to.
+    :param data: The converted file (string or bytes).
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    
+    if isinstance(output_stream, int):
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(output_stream, view[:CHUNK_SIZE]):]
+    
+    else:
+        output_stream.write(data)
+
+def output_fileno(output_stream):
+    """
+    Get the file descriptor underlying an output stream, flushing any data it has buffered.
+    
+    :param output_stream: A binary file object, or a file descriptor.
+    :return: The file descriptor, or None if output_stream is not backed by one.
+    """
+    if isinstance(output_stream, int):
+        return output_stream
+    
+    try:
+        fileno = output_stream.fileno()
+    
+    except (AttributeError, OSError, ValueError):
+        return None
+    
+    output_stream.flush()
+    return fileno
+
+class Conversion_timeout(TimeoutError):
+    """
+    Exception raised when a conversion takes longer than its timeout, and so was stopped.
+    """
+    
+    # A short description of why the conversion failed, as reported in JSON output.
+    reason = "timeout"
+    
+    def __init__(self, message, timeout = None):
+        """
+        :param message: Description of the conversion that timed out.
+        :param timeout: The timeout (in seconds) that expired.
+        """
+        super().__init__(message)
+        self.timeout = timeout
+    
+    def __reduce__(self):
+        # So the timeout survives being sent back from a worker process.
+        return (type(self), (str(self), self.timeout))
+
 class Openbabel_converter():
     """
     Top level class for openbabel wrappers.
@@ -48,7 +229,13 @@ class Openbabel_converter():
     We support both the python interface (pybel) and running obabel directly.
     """
     
-    def __init__(self, *, input_file = None, input_file_buffer = None, input_file_path = None, input_file_type = None):
+    # The name of the backend implemented by this class, as accepted by from_file().
+    BACKEND = "Auto"
+    
+    # The executor used by aconvert() to run blocking conversions (None for asyncio's default executor).
+    executor = None
+    
+    def __init__(self, *, input_file = None, input_file_buffer = None, input_file_path = None, input_file_type = None, pool = None, cache = None, hooks = None, geometry_cache = None, seed = None):
         """
         Constructor for the OpenBabel converter.
 
@@ -61,12 +248,24 @@ class Openbabel_converter():
         :param input_file_buffer: Alternatively, a buffer (unicode string or bytes) in the format given by input_file_type that should be converted.
         :param input_file_path: Alternatively, a path to a file that should be converted.
         :param input_file_type: A shortcode identifying the format of the input file. If not given but input_file_path is given, then this will be determined automatically.
+        :param pool: Optional Worker_pool object; if given, conversions will be performed by one of the pool's worker processes.
+        :param cache: Optional Conversion_cache object; if given, conversion results will be stored in (and retrieved from) the cache.
+        :param hooks: Optional list of callables that will be called with the time taken by each stage of each conversion (see stage()).
+        :param geometry_cache: Optional Geometry_cache object; if given, generated 3D coordinates will be stored in (and retrieved from) the cache. Requires the pybel bindings, and is not used by conversions performed by a pool.
+        :param seed: Optional seed for the random number generator used when generating 3D coordinates, so that the same input always gives the same coordinates. Requires the pybel bindings.
         """
+        # Logging is setup the first time a converter is used.
+        openprattle.log.ensure_logger()
         
         self.input_file = input_file
         self.input_file_buffer = input_file_buffer
         self.input_file_path = input_file_path
         self.input_file_type = input_file_type
+        self.pool = pool
+        self.cache = cache
+        self.hooks = list(hooks) if hooks is not None else []
+        self.geometry_cache = geometry_cache
+        self.seed = seed
         # Currently, we always use add H because certain formats (xyz) cannot have H added.
         self.add_H = True
         
@@ -93,6 +292,15 @@ class Openbabel_converter():
         elif backend == "Obabel":
             cls = Obabel_converter
         
+        elif backend == "Adaptive":
+            from openprattle.adaptive import Adaptive_converter
+            cls = Adaptive_converter
+        
+        elif backend == "Native" or (input_file_type is not None and input_file_type.lower() in NATIVE_FORMATS):
+            # Simple coordinate-only formats can be converted without openbabel (falling back to it when needed).
+            from openprattle.native import Native_converter
+            cls = Native_converter
+        
         else:
             cls = self.get_cls(input_file_type)
         
@@ -162,7 +370,36 @@ class Openbabel_converter():
         
         else:
             return Pybel_converter
-        
+
+    @classmethod
+    def convert_many(self, jobs, workers = None, **kwargs):
+        """
+        Convert many files, spread across a pool of worker processes.
+
+        Errors raised by individual jobs do not abort the batch; they are instead reported in the corresponding result.
+        See openprattle.batch.convert_many() for the full list of options.
+
+        :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+        :param workers: The number of worker processes to use. If None, one per CPU is used.
+        :return: An iterator of Conversion_result objects, in the same order as jobs.
+        """
+        from openprattle.batch import convert_many
+        return convert_many(jobs, workers, **kwargs)
+
+    @classmethod
+    async def aconvert_many(self, jobs, concurrency = None):
+        """
+        Convert many files concurrently from within an asyncio event loop.
+
+        See openprattle.batch.aconvert_many() for details.
+
+        :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+        :param concurrency: The maximum number of conversions to run at once. If None, one per CPU is used.
+        :return: A list of Conversion_result objects, in the same order as jobs.
+        """
+        from openprattle.batch import aconvert_many
+        return await aconvert_many(jobs, concurrency)
+
     @property
     def input_name(self):
         """
@@ -173,237 +410,1214 @@ class Openbabel_converter():
         else:
             return "(file loaded from memory)"
 
-    def convert(self, output_file_type = None, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
+    def to_job(self, output_file_type = None, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
         """
-        Convert the input file wrapped by this class to the designated output_file_type.
+        Get a Conversion_job object that describes converting the input file wrapped by this class.
         
-        Inheriting classes should write their own implementation.
+        If this converter wraps an open file, it is read into memory (because open files cannot be sent to other processes).
         
         :param output_file_type: The file type to convert to.
-        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param output_file: Optional file name to write to.
         :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
         :param charge: Optional charge of the output format.
         :param multiplicity: Optional multiplicity of the output format.
-        :return: The converted file, or None if output_file is not None.
         """
-        raise NotImplementedError("Abstract class Babel_converter does not have a convert() method defined (inheriting classes should write their own)")
-
-
-if HAVE_PYBEL:
+        from openprattle.batch import Conversion_job
+        return Conversion_job(
+            input_file_path = self.input_file_path,
+            input_file_buffer = self.input_file.read() if self.input_file is not None else self.input_file_buffer,
+            input_file_type = self.input_file_type,
+            output_file_type = output_file_type,
+            output_file = str(output_file) if output_file is not None else None,
+            gen3D = gen3D,
+            charge = charge,
+            multiplicity = multiplicity,
+            backend = self.BACKEND,
+            seed = self.seed
+        )
 
-    class ObErrorLog_wrapper():
-        """
-        Class for wrapping the logging behaviour of openbabel and pybel.
+    def spool_input(self, path):
         """
+        Write the input file wrapped by this class to a file on disk.
 
-        def __init__(self, warnings_as_errors = False):
-            """
-            :param stream: The output stream to wrap.
-            :param warnings_as_errors: Whether to raise an exception on obabel warnings (normally a good idea)
-            """
-            self.stream = sys.stderr
-            self.stream_no = self.stream.fileno()
-            self.pre_logs = {}
-            self.warnings_as_errors = warnings_as_errors
-
-        def __enter__(self):
-            """
-            Wrap logging output.
-            """
-            # Clear logs.
-            errors = pybel.ob.obErrorLog.ClearLog()
-
-            self.stream_back = os.dup(self.stream_no)
-            self.devnull = open(os.devnull, "w")
-            os.dup2(self.devnull.fileno(), self.stream_no)
+        Open files are copied in chunks, so the input is never held in memory all at once.
 
-            return self
+        :param path: The path to write to.
+        :return: The path that was written to.
+        """
+        if self.input_file is None and self.input_file_buffer is None:
+            # Already on disk.
+            shutil.copyfile(self.input_file_path, path)
+            return path
         
-        def __exit__(self, type, value, traceback):
-            """
-            Stop wrapping.
-            """
-            self.devnull.close()
-            os.dup2(self.stream_back, self.stream_no)
-
-            log_levels = [
-                (pybel.ob.obDebug, logging.DEBUG),
-                (pybel.ob.obAuditMsg, logging.DEBUG),
-                (pybel.ob.obInfo, logging.INFO),
-            ]
-
-            error_levels = [
-                pybel.ob.obError
-            ]
-
-            if self.warnings_as_errors:
-                error_levels.append(pybel.ob.obWarning)
+        with open(path, "wb") as spool_file:
+            if self.input_file is not None:
+                while True:
+                    chunk = self.input_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    
+                    spool_file.write(chunk.encode() if isinstance(chunk, str) else chunk)
             
             else:
-                log_levels.append((pybel.ob.obWarning, logging.WARNING))
-
-            # Print any messages.
-            for oblevel, level in log_levels:
-                for log in pybel.ob.obErrorLog.GetMessagesOfLevel(oblevel):
-                    logging.getLogger("openprattle").log(level, log)
-
-            # Generate exceptions.
-            exceptions = []
-            for oblevel in error_levels:
-                exceptions.extend([Exception("OpenBabel error:\n{}".format(log)) for log in pybel.ob.obErrorLog.GetMessagesOfLevel(oblevel)])
-            
-            # Chain them together.
-            for index, exception in enumerate(exceptions[:-1]):
-                exception.__cause__ = exceptions[index +1]
-
-            # Raise the first.
-            if len(exceptions) > 0:
-                raise exceptions[0]
-
+                spool_file.write(self.input_file_buffer.encode() if isinstance(self.input_file_buffer, str) else self.input_file_buffer)
+        
+        return path
 
-    class Pybel_converter(Openbabel_converter):
+    @classmethod
+    def version(self):
         """
-        Wrapper class for pybel
-        """            
+        Get the version of openbabel used by this class.
         
-        def convert(self, output_file_type = None, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
-            """
-            Convert the input file wrapped by this class to the designated output_file_type.
-            
-            :param output_file_type: The file type to convert to.
-            :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
-            :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
-            :param charge: Optional charge of the output format.
-            :param multiplicity: Optional multiplicity of the output format.
-            :return: The converted file, or None if output_file is not None.
-            """
-            output_file = str(output_file) if output_file is not None else None
-
-            if not output_file_type:
-                output_file_type = self.type_from_file_name(output_file)
+        Inheriting classes should write their own implementation.
+        """
+        raise NotImplementedError("Abstract class Babel_converter does not have a version() method defined (inheriting classes should write their own)")
 
-            # Check the formats are allowed.
-            if self.input_file_type in FORBIDDEN['PYBEL']:
-                raise ValueError("The '{}' format is not supported by pybel, try obabel instead".format(self.input_file_type))
+    def convert(self, output_file_type = None, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None, timeout = None, on_timeout = ()):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type.
         
-            #if output_file_type in FORBIDDEN['PYBEL']:
-            #    raise ValueError("The '{}' format is not supported by pybel, try obabel instead".format(output_file_type))
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param output_stream: Optional binary file object (such as sys.stdout.buffer) or file descriptor to write the converted file to, instead of returning it. Ignored if output_file is given.
+        :param timeout: Optional time limit (in seconds) for the conversion. If the conversion takes longer, it is stopped (by killing the process performing it) and Conversion_timeout is raised.
+        :param on_timeout: The ways to retry a conversion that timed out, in order (see TIMEOUT_STRATEGIES): 'other_backend' retries with the other openbabel backend, 'without_gen3D' retries without generating 3D coordinates. Each retry has the same timeout, and keeps the changes of the retries before it.
+        :return: The converted file, or None if output_file or output_stream is not None.
+        """
+        output_file = str(output_file) if output_file is not None else None
+        output_stream = output_stream if output_file is None else None
 
-            if output_file is None and output_file_type == "png":
-                raise ValueError("output_file must not be None if format is png")
-            
-            # In general, Openbabel logging from python is mess.
-            # Some pybel function calls don't correctly indicate error status, instead relying on message logging.
-            # From python, we have no way to redirect the openbabel logger, so we need to hack it.
-            # The ObErrorLog_wrapper() handles this.
+        if not output_file_type:
+            output_file_type = self.type_from_file_name(output_file)
+        
+        for strategy in on_timeout:
+            if strategy not in TIMEOUT_STRATEGIES:
+                raise ValueError("Unknown timeout strategy '{}'; options are: {}".format(strategy, ", ".join(TIMEOUT_STRATEGIES)))
+        
+        with self.stage("convert", input_name = self.input_name, input_file_type = self.input_file_type, output_file_type = output_file_type, backend = self.BACKEND):
+            if self.cache is not None:
+                with self.stage("cache_load") as details:
+                    key = self.cache.key(self, output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                    hit, result = self.cache.load(key, output_file)
+                    details['hit'] = hit
+                
+                if not hit:
+                    # The result needs to be in memory to store it in the cache.
+                    result = self.timed_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, timeout = timeout, on_timeout = on_timeout)
+                    
+                    with self.stage("cache_save"):
+                        self.cache.save(key, result, output_file)
             
-            # Get upset if input_file_type is empty (because openbabel acts weird when it is).
-            if self.input_file_type is None or self.input_file_type == "":
-                raise TypeError("Cannot convert file; input_file_type '{}' is None or empty".format(self.input_file_type))
+            else:
+                result = self.timed_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, output_stream = output_stream, timeout = timeout, on_timeout = on_timeout)
             
-            # Pybel doesn't provide a method to read from an open file, weirdly.
-            # This means we need to load the whole file into memory first.
-            # TODO: Investigate the pybel/openbabel lib to see if there's a better workaround.
-            if self.input_file:
-                buffer = self.input_file.read()
+            if output_stream is not None and result is not None:
+                # The backend couldn't write to the stream itself.
+                with self.stage("write_stream"):
+                    write_output(output_stream, result)
+                
+                return None
             
-            elif self.input_file_buffer:
-                buffer = self.input_file_buffer
+            return result
+    
+    def timed_convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None, timeout = None, on_timeout = ()):
+        """
+        Perform a conversion (with this converter's pool, if it has one), retrying it if it times out.
+        
+        See convert() for a description of the arguments.
+        """
+        if timeout is None:
+            return self.attempt_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, output_stream = output_stream)
+        
+        if self.input_file is not None:
+            # The input is sent to another process, and might need to be read more than once.
+            self.input_file_buffer = self.input_file.read()
+            self.input_file = None
+        
+        converter = self
+        for attempt, strategy in enumerate((None, *on_timeout)):
+            if strategy == "other_backend":
+                converter = converter.other_backend()
             
-            else:
-                buffer = None
+            elif strategy == "without_gen3D":
+                gen3D = False
             
-            # Read in the molecule(s) in the given file.
             try:
-                # This is a generator.
-                # Use a different func depending on whether we're reading from file or memory.
-                if buffer:
-                    # Reading from memory.
-                    # TODO: Why str()?
-                    with ObErrorLog_wrapper():
-                        molecule = pybel.readstring(self.input_file_type, str(buffer))
-                
-                else: 
-                    # Readfile gives us an iterator of molecules...
-                    with ObErrorLog_wrapper():
-                        molecules = pybel.readfile(self.input_file_type, str(self.input_file_path))
-                    
-                        # ...but we're only ever interested in one.
-                        # Try and get the first molecule.
-                        try:
-                            molecule = next(molecules)
-                        
-                        except StopIteration:
-                            raise ValueError("Cannot read file '{}'; file does not contain any molecules".format(self.input_name)) from None
-                    
-                    
-            except Exception as e:
-                raise Exception("Failed to parse file '{}'".format(self.input_name)) from e
+                with self.stage("attempt", attempt = attempt, strategy = strategy, backend = converter.BACKEND):
+                    # Output is never streamed, because a conversion that is killed part way through could leave partial output in the stream.
+                    return converter.attempt_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, timeout = timeout)
             
-            if charge is not None:
-                with ObErrorLog_wrapper(False):
-                    molecule.OBMol.SetTotalCharge(charge)
+            except Conversion_timeout:
+                if attempt == len(on_timeout):
+                    raise
+                
+                logging.getLogger("openprattle").warning("Conversion of file '{}' timed out after {} s; retrying ({})".format(self.input_name, timeout, on_timeout[attempt]))
+    
+    def attempt_convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None, timeout = None):
+        """
+        Perform a single conversion attempt, with this converter's pool if it has one.
+        
+        :param timeout: Optional time limit (in seconds). If the conversion takes longer, the process performing it is killed and Conversion_timeout is raised.
+        """
+        if self.pool is not None:
+            return self.pool_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, timeout = timeout)
+        
+        elif timeout is None:
+            return self._convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, output_stream = output_stream)
+        
+        else:
+            return self.timeout_convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, timeout = timeout)
+    
+    def timeout_convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, timeout):
+        """
+        Perform a conversion that can be stopped if it takes longer than timeout.
+        
+        Conversions performed by the pybel bindings cannot be interrupted, so the default implementation performs the conversion
+        in a new child process, which is killed if it does not finish in time. Inheriting classes can provide a cheaper implementation.
+        
+        :raises Conversion_timeout: If the conversion did not finish in time.
+        """
+        # Imported here to avoid a circular import.
+        from openprattle.pool import run_with_timeout
+        
+        with self.stage("child"):
+            return run_with_timeout(self.to_job(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity), timeout)
+    
+    def other_backend(self):
+        """
+        Get a converter for the same input file that uses the other openbabel backend (used to retry conversions that timed out).
+        
+        The default implementation uses the Obabel backend.
+        """
+        return self.with_backend(Obabel_converter)
+    
+    def with_backend(self, cls):
+        """
+        Get a converter of a different class for the same input file, with the same options (except the cache).
+        """
+        return cls(
+            input_file = self.input_file,
+            input_file_buffer = self.input_file_buffer,
+            input_file_path = self.input_file_path,
+            input_file_type = self.input_file_type,
+            pool = self.pool,
+            hooks = self.hooks,
+            geometry_cache = self.geometry_cache,
+            seed = self.seed
+        )
+    
+    def convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to several formats at once.
+        
+        Where possible, the input file is read (and 3D coordinates generated, hydrogens added etc) only once, and then written in each format.
+        
+        :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output formats.
+        :param multiplicity: Optional multiplicity of the output formats.
+        :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+        """
+        outputs = {output_file_type: str(output_file) if output_file is not None else None for output_file_type, output_file in outputs.items()}
+        
+        with self.stage("convert_multi", input_name = self.input_name, input_file_type = self.input_file_type, output_file_types = list(outputs), backend = self.BACKEND):
+            if self.cache is not None or self.pool is not None:
+                # Each format is cached (or converted by the pool) separately.
+                if self.input_file is not None:
+                    self.input_file_buffer = self.input_file.read()
+                    self.input_file = None
+                
+                return {
+                    output_file_type: self.convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                        for output_file_type, output_file in outputs.items()
+                }
+            
+            return self._convert_multi(outputs, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+    
+    def _convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to several formats at once.
+        
+        The default implementation simply converts to each format in turn; inheriting classes can provide a more efficient implementation.
+        
+        :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output formats.
+        :param multiplicity: Optional multiplicity of the output formats.
+        :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+        """
+        if self.input_file is not None:
+            # We need to read the input more than once.
+            self.input_file_buffer = self.input_file.read()
+            self.input_file = None
+        
+        return {
+            output_file_type: self._convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                for output_file_type, output_file in outputs.items()
+        }
+    
+    def pool_convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, timeout = None):
+        """
+        Perform a conversion with one of the worker processes of this converter's pool.
+        
+        :param timeout: Optional time limit (in seconds). If the conversion takes longer, the worker is killed (and replaced) and Conversion_timeout is raised.
+        """
+        with self.stage("pool"):
+            return self.pool.convert(self.to_job(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity), timeout = timeout)
+    
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        """
+        Time a stage of a conversion, reporting it to each of this converter's hooks.
+        
+        Hooks are called with four arguments: the converter object, the name of the stage, the time the stage took (in seconds),
+        and a dictionary of further details (which the timed block can add to).
+        
+        :param name: The name of the stage.
+        :param details: Initial details of the stage.
+        :return: A context manager, which yields the details dictionary.
+        """
+        start = time.perf_counter()
+        try:
+            yield details
+        
+        except BaseException:
+            details['failed'] = True
+            raise
+        
+        finally:
+            if len(self.hooks) > 0:
+                duration = time.perf_counter() - start
+                for hook in self.hooks:
+                    hook(self, name, duration, details)
+    
+    async def aconvert(self, output_file_type = None, output_file = None, *, gen3D = None, charge = None, multiplicity = None, timeout = None, on_timeout = ()):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, without blocking the event loop.
+        
+        This is the asyncio equivalent of convert().
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param timeout: Optional time limit (in seconds) for the conversion (see convert()).
+        :param on_timeout: The ways to retry a conversion that timed out (see convert()).
+        :return: The converted file, or None if output_file is not None.
+        """
+        # Imported here because it's relatively slow to load.
+        import asyncio
+        
+        if self.cache is not None or self.pool is not None or timeout is not None:
+            # Caches, pools and timeouts are blocking, so run the whole conversion in a thread.
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(self.convert, output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, timeout = timeout, on_timeout = on_timeout)
+            )
+        
+        output_file = str(output_file) if output_file is not None else None
+
+        if not output_file_type:
+            output_file_type = self.type_from_file_name(output_file)
+        
+        return await self._aconvert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+    
+    async def _aconvert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, without blocking the event loop.
+        
+        The default implementation runs _convert() in an executor; inheriting classes can provide a native implementation instead.
+        """
+        # Imported here because it's relatively slow to load.
+        import asyncio
+        
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            functools.partial(self._convert, output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        )
+    
+    def _convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type.
+        
+        Inheriting classes should write their own implementation.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param output_stream: Optional binary file object or file descriptor to write the converted file to. Implementations that cannot write to the stream directly may return the converted file instead.
+        :return: The converted file, or None if output_file is not None (or the file was written to output_stream).
+        """
+        raise NotImplementedError("Abstract class Babel_converter does not have a _convert() method defined (inheriting classes should write their own)")
+
+    @classmethod
+    def from_arrays(self, arrays, **kwargs):
+        """
+        Get a converter for a molecule given as arrays, rather than as a file. Requires numpy and the pybel bindings.
+        
+        :param arrays: A Molecule_arrays object describing the molecule.
+        :param kwargs: Other arguments to the constructor (hooks etc).
+        """
+        if not HAVE_PYBEL:
+            raise ImportError("The pybel bindings are required to convert molecules given as arrays")
+        
+        from openprattle.arrays import Array_converter
+        return Array_converter(arrays, **kwargs)
+    
+    def to_arrays(self, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Get the arrays (atomic numbers, coordinates, bonds etc) describing the first molecule in the input file wrapped by this class.
+        
+        Requires numpy and the pybel bindings. The default implementation converts to an intermediate cml file, which pybel then reads;
+        inheriting classes can provide a more efficient implementation.
+        
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the molecule.
+        :param multiplicity: Optional multiplicity of the molecule.
+        :return: A Molecule_arrays object.
+        """
+        if not HAVE_PYBEL:
+            raise ImportError("The pybel bindings are required to convert molecules to arrays")
+        
+        intermediate = self.convert("cml", gen3D = gen3D)
+        return Pybel_converter(input_file_buffer = intermediate, input_file_type = "cml", hooks = self.hooks).to_arrays(gen3D = False, charge = charge, multiplicity = multiplicity)
+    
+    def iter_convert(self, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert each of the molecules in the input file wrapped by this class to the designated output_file_type.
+
+        Unlike convert(), which only converts the first molecule in the input file, this method is a generator that yields each converted molecule in turn.
+        
+        Inheriting classes should write their own implementation.
+        
+        :param output_file_type: The file type to convert to.
+        :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :return: An iterator of converted molecules, each as a string.
+        """
+        raise NotImplementedError("Abstract class Babel_converter does not have an iter_convert() method defined (inheriting classes should write their own)")
+
+
+if FOUND_PYBEL:
+
+    class ObErrorLog_wrapper():
+        """
+        Class for wrapping the logging behaviour of openbabel and pybel.
+        
+        Openbabel's message log (obErrorLog) is shared by the whole process, so only one thread can use it at a time.
+        The outermost wrapper on each thread holds a process-wide lock, clears the log and stops openbabel from echoing
+        messages to stderr; wrappers nested inside it only act as checkpoints, reporting (and clearing) the messages
+        logged since the last checkpoint. Wrap an entire conversion in one wrapper so that its messages are not mixed up
+        with those of conversions running in other threads.
+        """
+        
+        # Held by the thread that is currently using openbabel's log.
+        lock = threading.RLock()
+        
+        # The currently active wrappers of each thread.
+        local = threading.local()
+
+        def __init__(self, warnings_as_errors = False, name = None):
+            """
+            :param warnings_as_errors: Whether to raise an exception on obabel warnings (normally a good idea)
+            :param name: Optional name of the file being converted, used to attribute messages. If not given, the name of the enclosing wrapper is used.
+            """
+            self.warnings_as_errors = warnings_as_errors
+            self.name = name
+        
+        @classmethod
+        def active(self):
+            """
+            Get the stack of wrappers currently active in this thread.
+            """
+            try:
+                return self.local.stack
+            
+            except AttributeError:
+                self.local.stack = []
+                return self.local.stack
+
+        def __enter__(self):
+            """
+            Wrap logging output.
+            """
+            self.lock.acquire()
+            stack = self.active()
+            
+            if len(stack) == 0:
+                # Clear logs (any messages here were logged outside of a wrapper, and so don't belong to us).
+                pybel.ob.obErrorLog.ClearLog()
+                
+                # Openbabel normally prints messages to stderr as well as logging them.
+                # We report them ourselves, so turn this off (rather than redirecting the process-wide stderr, which would also swallow other threads' output).
+                self.output_level = pybel.ob.obErrorLog.GetOutputLevel()
+                pybel.ob.obErrorLog.SetOutputLevel(-1)
+            
+            elif self.name is None:
+                self.name = stack[-1].name
+            
+            stack.append(self)
+            return self
+        
+        def __exit__(self, type, value, traceback):
+            """
+            Stop wrapping.
+            """
+            stack = self.active()
+            stack.pop()
+            
+            try:
+                if len(stack) == 0:
+                    pybel.ob.obErrorLog.SetOutputLevel(self.output_level)
+                
+                self.checkpoint()
+            
+            finally:
+                self.lock.release()
+        
+        def checkpoint(self):
+            """
+            Report the messages openbabel has logged since the last checkpoint, and then clear them.
+            
+            :raises Exception: If an error (or warning, if warnings_as_errors is True) was logged.
+            """
+            log_levels = [
+                (pybel.ob.obDebug, logging.DEBUG),
+                (pybel.ob.obAuditMsg, logging.DEBUG),
+                (pybel.ob.obInfo, logging.INFO),
+            ]
+
+            error_levels = [
+                pybel.ob.obError
+            ]
+
+            if self.warnings_as_errors:
+                error_levels.append(pybel.ob.obWarning)
+            
+            else:
+                log_levels.append((pybel.ob.obWarning, logging.WARNING))
+            
+            # Print any messages.
+            for oblevel, level in log_levels:
+                for log in pybel.ob.obErrorLog.GetMessagesOfLevel(oblevel):
+                    logging.getLogger("openprattle").log(level, log, extra = {"input_name": self.name})
+
+            # Generate exceptions.
+            exceptions = []
+            for oblevel in error_levels:
+                exceptions.extend([Exception("OpenBabel error{}:\n{}".format(" in file '{}'".format(self.name) if self.name is not None else "", log)) for log in pybel.ob.obErrorLog.GetMessagesOfLevel(oblevel)])
+            
+            pybel.ob.obErrorLog.ClearLog()
+
+            # Chain them together.
+            for index, exception in enumerate(exceptions[:-1]):
+                exception.__cause__ = exceptions[index +1]
+
+            # Raise the first.
+            if len(exceptions) > 0:
+                raise exceptions[0]
+
+
+    # The C library, whose random number generator is used by openbabel; loaded by seed_openbabel().
+    _libc = None
+
+    def seed_openbabel(seed):
+        """
+        Seed the random number generator openbabel uses to generate 3D coordinates, so the same molecule always gives the same coordinates.
+
+        :param seed: The seed (an integer).
+        """
+        global _libc
+
+        if _libc is None:
+            # The first time openbabel generates coordinates in a process, it re-seeds the generator from the clock.
+            # Get that out of the way first, so it can't overwrite our seed.
+            with ObErrorLog_wrapper(False):
+                pybel.readstring("smi", "C").localopt()
+
+            import ctypes
+            import ctypes.util
+            _libc = ctypes.CDLL(ctypes.util.find_library("c"))
+
+        _libc.srand(seed)
+
+
+    class Pybel_converter(Openbabel_converter):
+        """
+        Wrapper class for pybel
+        """            
+        
+        BACKEND = "Pybel"
+        
+        # The force-field (and number of steps) used to optimise generated 3D coordinates.
+        forcefield = "mmff94"
+        optimisation_steps = 500
+        
+        @classmethod
+        def version(self):
+            """
+            Get the version of openbabel used by this class.
+            """
+            return pybel.ob.OBReleaseVersion()
+        
+        def _convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None):
+            """
+            Convert the input file wrapped by this class to the designated output_file_type.
+            
+            :param output_file_type: The file type to convert to.
+            :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+            :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+            :param charge: Optional charge of the output format.
+            :param multiplicity: Optional multiplicity of the output format.
+            :param output_stream: Pybel cannot write to streams, so if this is given the converted file is returned for the caller to write.
+            :return: The converted file, or None if output_file is not None.
+            """
+            if output_file is None and output_file_type == "png":
+                if output_stream is None:
+                    raise ValueError("output_file must not be None if format is png")
+                
+                # Pybel can only draw to files.
+                with tempfile.TemporaryDirectory() as tempdir:
+                    output_file = str(Path(tempdir, "output.png"))
+                    self._convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                    return Path(output_file).read_bytes()
+            
+            # Capture openbabel's messages once for the entire conversion.
+            with ObErrorLog_wrapper(False, name = self.input_name):
+                # We're only ever interested in the first molecule.
+                molecule = self.read_molecule()
+                self.prepare_molecule(molecule, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                return self.write_molecule(molecule, output_file_type, output_file)
+
+        def _convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+            """
+            Convert the input file wrapped by this class to several formats at once.
+            
+            The input file is read (and 3D coordinates generated, hydrogens added etc) once, and then written in each format.
+            
+            :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+            :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+            :param charge: Optional charge of the output formats.
+            :param multiplicity: Optional multiplicity of the output formats.
+            :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+            """
+            with ObErrorLog_wrapper(False, name = self.input_name), tempfile.TemporaryDirectory() as tempdir:
+                molecule = self.read_molecule()
+                self.prepare_molecule(molecule, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                
+                results = {}
+                for output_file_type, output_file in outputs.items():
+                    if output_file is None and output_file_type == "png":
+                        # Pybel can only draw to files.
+                        output_file = str(Path(tempdir, "output.png"))
+                        self.write_molecule(molecule, output_file_type, output_file)
+                        results[output_file_type] = Path(output_file).read_bytes()
+                    
+                    else:
+                        results[output_file_type] = self.write_molecule(molecule, output_file_type, output_file)
+                
+                return results
+
+        def iter_convert(self, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+            """
+            Convert each of the molecules in the input file wrapped by this class to the designated output_file_type.
+
+            Molecules are read, converted and yielded one at a time, so memory use does not depend on the number of molecules in the input.
+            
+            :param output_file_type: The file type to convert to.
+            :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+            :param charge: Optional charge of the output format.
+            :param multiplicity: Optional multiplicity of the output format.
+            :return: An iterator of converted molecules, each as a string.
+            """
+            if output_file_type == "png":
+                raise ValueError("Cannot iteratively convert to the png format")
+            
+            with contextlib.closing(self.read_molecules()) as molecules:
+                while True:
+                    # Capture openbabel's messages once per molecule (but not while the caller has control, so other threads can convert in the meantime).
+                    with ObErrorLog_wrapper(False, name = self.input_name):
+                        with self.stage("read"):
+                            molecule = next(molecules, None)
+                        
+                        if molecule is None:
+                            return
+                        
+                        self.prepare_molecule(molecule, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                        output = self.write_molecule(molecule, output_file_type)
+                    
+                    yield output
+        
+        def to_arrays(self, *, gen3D = None, charge = None, multiplicity = None):
+            """
+            Get the arrays (atomic numbers, coordinates, bonds etc) describing the first molecule in the input file wrapped by this class.
+            
+            :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+            :param charge: Optional charge of the molecule.
+            :param multiplicity: Optional multiplicity of the molecule.
+            :return: A Molecule_arrays object.
+            """
+            from openprattle.arrays import Molecule_arrays
+            
+            with ObErrorLog_wrapper(False, name = self.input_name):
+                molecule = self.read_molecule()
+                self.prepare_molecule(molecule, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+                
+                with self.stage("arrays"):
+                    return Molecule_arrays.from_obmol(molecule.OBMol)
+        
+        def read_molecule(self):
+            """
+            Read the first molecule in the input file wrapped by this class.
+            
+            :return: A pybel Molecule object.
+            """
+            with contextlib.closing(self.read_molecules()) as molecules:
+                try:
+                    with self.stage("read"):
+                        return next(molecules)
+                
+                except StopIteration:
+                    raise ValueError("Cannot read file '{}'; file does not contain any molecules".format(self.input_name)) from None
+        
+        def read_molecules(self):
+            """
+            Read each of the molecules in the input file wrapped by this class.
+            
+            :return: An iterator of pybel Molecule objects.
+            """
+            # Check the formats are allowed.
+            if self.input_file_type in FORBIDDEN['PYBEL']:
+                raise ValueError("The '{}' format is not supported by pybel, try obabel instead".format(self.input_file_type))
+            
+            # In general, Openbabel logging from python is mess.
+            # Some pybel function calls don't correctly indicate error status, instead relying on message logging.
+            # From python, we have no way to redirect the openbabel logger, so we need to hack it.
+            # The ObErrorLog_wrapper() handles this.
+            
+            # Get upset if input_file_type is empty (because openbabel acts weird when it is).
+            if self.input_file_type is None or self.input_file_type == "":
+                raise TypeError("Cannot convert file; input_file_type '{}' is None or empty".format(self.input_file_type))
+            
+            # Pybel's readstring() only ever reads the first molecule, so we use the underlying OBConversion object instead.
+            conversion = pybel.ob.OBConversion()
+            obmol = pybel.ob.OBMol()
+            
+            # Pybel (and OBConversion) can't read from a python file object.
+            # Rather than reading the whole file into memory, we copy it to disk in chunks, from where openbabel reads one molecule at a time.
+            with tempfile.TemporaryDirectory() if self.input_file is not None else contextlib.nullcontext() as tempdir:
+                # Read in the first molecule in the given file.
+                try:
+                    if not conversion.SetInFormat(self.input_file_type):
+                        raise ValueError("{} is not a recognised Open Babel format".format(self.input_file_type))
+                    
+                    # Use a different func depending on whether we're reading from file or memory.
+                    if self.input_file is None and self.input_file_buffer:
+                        # Reading from memory.
+                        # ReadString() only accepts strings, so decode bytes-like buffers.
+                        buffer = self.input_file_buffer
+                        buffer = str(buffer, "utf-8") if isinstance(buffer, (bytes, bytearray, memoryview)) else str(buffer)
+                        with ObErrorLog_wrapper():
+                            notatend = conversion.ReadString(obmol, buffer)
+                        
+                        # The decoded copy is no longer needed.
+                        del buffer
+                    
+                    else:
+                        if self.input_file is not None:
+                            input_file_path = self.spool_input(str(Path(tempdir, "input")))
+                        
+                        else:
+                            input_file_path = self.input_file_path
+                        
+                        if not os.path.isfile(input_file_path):
+                            raise IOError("No such file: '{}'".format(input_file_path))
+                        
+                        with ObErrorLog_wrapper():
+                            notatend = conversion.ReadFile(obmol, str(input_file_path))
+                
+                    # This is a generator; read (and yield) the remaining molecules one at a time.
+                    while notatend:
+                        yield pybel.Molecule(obmol)
+                        
+                        obmol = pybel.ob.OBMol()
+                        with ObErrorLog_wrapper():
+                            notatend = conversion.Read(obmol)
+                
+                except Exception as e:
+                    raise Exception("Failed to parse file '{}'".format(self.input_name)) from e
+
+        def prepare_molecule(self, molecule, *, gen3D = None, charge = None, multiplicity = None):
+            """
+            Set the charge and multiplicity of a loaded molecule, generate 3D coordinates and add hydrogens, as appropriate.
+
+            :param molecule: The pybel Molecule object to modify (in place).
+            :param gen3D: If True and the molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+            :param charge: Optional charge of the molecule.
+            :param multiplicity: Optional multiplicity of the molecule.
+            """
+            if charge is not None:
+                with ObErrorLog_wrapper(False), self.stage("charge"):
+                    molecule.OBMol.SetTotalCharge(charge)
+                
+            if multiplicity is not None:
+                with ObErrorLog_wrapper(False), self.stage("multiplicity"):
+                    molecule.OBMol.SetTotalSpinMultiplicity(multiplicity)
+            
+            # If we got a 2D (or 1D) format, convert to 3D (but warn that we are doing so.)
+            if (molecule.dim != 3 and gen3D is None) or gen3D:
+                # We're missing 3D coords.
+                with ObErrorLog_wrapper(False):
+                    dim = molecule.dim
+
+                logging.getLogger("openprattle").warning("Generating 3D coordinates from {}D file '{}'; this will scramble atom coordinates".format(dim, self.input_name))
+                
+                with ObErrorLog_wrapper(False), self.stage("gen3D", atoms = molecule.OBMol.NumAtoms()) as details:
+                    self.generate_3D(molecule, details)
+                
+            if self.add_H:
+                # Add hydrogens.
+                with ObErrorLog_wrapper(False), self.stage("addh"):
+                    molecule.addh()
+
+        def generate_3D(self, molecule, details = None):
+            """
+            Generate (and optimise) 3D coordinates for a loaded molecule, using the geometry cache if we have one.
+
+            :param molecule: The pybel Molecule object to modify (in place).
+            :param details: Optional dictionary of stage details, to which whether the geometry cache was hit is added.
+            """
+            details = details if details is not None else {}
+            
+            # Coordinates optimised from existing 3D coordinates depend on those coordinates, so they aren't cached.
+            geometry_cache = self.geometry_cache if molecule.dim != 3 else None
+            
+            if geometry_cache is not None:
+                key, labels = geometry_cache.key(molecule, forcefield = self.forcefield, steps = self.optimisation_steps, seed = self.seed)
+                details['hit'] = geometry_cache.load(key, labels, molecule)
+                if details['hit']:
+                    return
+            
+            if self.seed is not None:
+                seed_openbabel(self.seed)
+            
+            molecule.localopt(self.forcefield, self.optimisation_steps)
+            
+            if geometry_cache is not None:
+                geometry_cache.save(key, labels, molecule)
+
+        def write_molecule(self, molecule, output_file_type, output_file = None):
+            """
+            Write a loaded molecule in the designated output_file_type.
+
+            :param molecule: The pybel Molecule object to write.
+            :param output_file_type: The file type to convert to.
+            :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string.
+            :return: The converted file, or None if output_file is not None.
+            """
+            # Now convert and return
+            # If the format is png, use the draw() method instead because write() is bugged.
+            with ObErrorLog_wrapper(), self.stage("write"):
+                if output_file_type == "png":
+                    molecule.draw(False, output_file)
+                
+                else:
+                    return molecule.write(output_file_type, output_file, overwrite = True)
+
+
+class Obabel_converter(Openbabel_converter):
+    """
+    Wrapper class for openbabel.
+    
+    Unlike Babel_converter (which wraps the openbabel python interface), Openbabel_wrapper uses subprocess.run() 
+    """
+    
+    # The regex we'll use to check obabel converted successfully.
+    #obabel_success = re.compile(r"\b(?!0\b)\d*\b molecules? converted")
+    obabel_fail = re.compile(r"\b0 molecules converted")
+    
+    BACKEND = "Obabel"
+    
+    # 'Path' to the obabel executable.
+    obabel_execuable = "obabel"
+    
+    # Whether to perform conversions with the openbabel library in the current process, rather than by running obabel.
+    # This is set by warm worker processes (see openprattle.pool), which have the openbabel plugins pre-loaded.
+    in_process = False
+    
+    # The versions of each of the obabel executables we've used.
+    _versions = {}
+    
+    @classmethod
+    def version(self):
+        """
+        Get the version of openbabel used by this class (the version reported by the obabel executable).
+        """
+        try:
+            return self._versions[self.obabel_execuable]
+        
+        except KeyError:
+            pass
+        
+        done_process = subprocess.run(
+            [self.obabel_execuable, "-V"],
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+            universal_newlines = True,
+            check = True
+        )
+        
+        # The output should look like this:
+        # Open Babel 3.1.0 -- Oct 20 2020 -- 12:14:07
+        match = re.search(r"Open Babel (\S+)", done_process.stdout)
+        version = match.group(1) if match else done_process.stdout.strip()
+        self._versions[self.obabel_execuable] = version
+        return version
+    
+    def _convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type.
+         
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).        
+        :param charge:  Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param output_stream: Optional binary file object or file descriptor to stream the converted file to.
+        :return: The converted file, or None if output_file or output_stream is not None.
+        """
+        gen3D = self.prepare_options(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        return self.run(output_file_type, output_file, gen3D = gen3D, output_stream = output_stream)
+    
+    def _convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to several formats at once.
+        
+        obabel can only write one format at a time, so the input file is first converted (generating 3D coordinates and adding hydrogens)
+        to an intermediate cml file (which, unlike sdf, keeps the full precision of coordinates), which is then written in each format. When the pybel bindings are available, this is done
+        in the current process (for single molecules); otherwise obabel is run (without repeating gen3D) for each format.
+        The cml writer shortens molecule titles (to valid ids), so the original titles are read separately and restored in the intermediate file.
+        If they can't be, the input file is converted to each format directly instead.
+        
+        :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output formats (unsupported by obabel).
+        :param multiplicity: Optional multiplicity of the output formats (unsupported by obabel).
+        :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+        """
+        gen3D = self.prepare_options(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        
+        if len(outputs) == 1:
+            # Nothing to gain.
+            return {output_file_type: self.run(output_file_type, output_file, gen3D = gen3D) for output_file_type, output_file in outputs.items()}
+        
+        intermediate = self.restore_titles(self.run("cml", None, gen3D = gen3D))
+        
+        if intermediate is None:
+            return {output_file_type: self.run(output_file_type, output_file, gen3D = gen3D) for output_file_type, output_file in outputs.items()}
+        
+        if HAVE_PYBEL and len(re.findall(r"<molecule\b", intermediate)) == 1:
+            # Pybel converters only convert the first molecule.
+            converter = Pybel_converter(input_file_buffer = intermediate, input_file_type = "cml", hooks = self.hooks)
+            return converter._convert_multi(outputs, gen3D = False)
+        
+        with tempfile.TemporaryDirectory() as tempdir:
+            # obabel can't reliably read several cml molecules from a pipe.
+            intermediate_path = Path(tempdir, "intermediate.cml")
+            intermediate_path.write_text(intermediate)
+            
+            converter = Obabel_converter(input_file_path = intermediate_path, input_file_type = "cml", hooks = self.hooks)
+            return {output_file_type: converter.run(output_file_type, output_file, gen3D = False) for output_file_type, output_file in outputs.items()}
+    
+    def restore_titles(self, intermediate):
+        """
+        Set the title of each molecule in an intermediate cml file to the title of the same molecule in the input file.
+        
+        :param intermediate: The intermediate cml file (converted from the input file wrapped by this class).
+        :return: The intermediate cml file with the original titles, or None if the molecules of the two files could not be matched up.
+        """
+        # Imported here because it's relatively slow to load.
+        import html
+        
+        # obabel's title format writes the title of each molecule on its own line.
+        titles = self.run("txt", None, gen3D = False).split("\n")[:-1]
+        molecules = list(re.finditer(r"<molecule\b[^>]*>", intermediate))
+        
+        if len(titles) != len(molecules):
+            return None
+        
+        parts = []
+        position = 0
+        for title, molecule in zip(titles, molecules):
+            parts.append(intermediate[position:molecule.start()])
+            tag = re.sub(r'\s(id|title)="[^"]*"', "", molecule.group())
+            if title != "":
+                tag = tag.replace("<molecule", '<molecule title="{}"'.format(html.escape(title)), 1)
+            
+            parts.append(tag)
+            position = molecule.end()
+        
+        parts.append(intermediate[position:])
+        return "".join(parts)
+    
+    def timeout_convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, timeout):
+        """
+        Perform a conversion that can be stopped if it takes longer than timeout.
+        
+        When obabel is run as a separate process, that process is simply killed if it does not finish in time.
+        
+        :raises Conversion_timeout: If the conversion did not finish in time.
+        """
+        gen3D = self.prepare_options(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        
+        if self.in_process or (gen3D and (self.geometry_cache is not None or self.seed is not None) and HAVE_PYBEL):
+            # Part of the conversion would be performed by the openbabel library in this process.
+            return super().timeout_convert(output_file_type, output_file, gen3D = gen3D, timeout = timeout)
+        
+        return self.run_obabel(output_file_type, output_file, gen3D = gen3D, timeout = timeout)
+    
+    def other_backend(self):
+        """
+        Get a converter for the same input file that uses the Pybel backend (used to retry conversions that timed out).
+        """
+        if not HAVE_PYBEL:
+            logging.getLogger("openprattle").warning("Cannot retry conversion of file '{}' with the Pybel backend; the pybel bindings are not available".format(self.input_name))
+            return self
+        
+        return self.with_backend(Pybel_converter)
+    
+    def run(self, output_file_type, output_file, *, gen3D, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, with whichever method is most appropriate.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param output_stream: Optional binary file object or file descriptor to stream the converted file to.
+        :return: The converted file, or None if output_file or output_stream is not None.
+        """
+        if gen3D and (self.geometry_cache is not None or self.seed is not None) and HAVE_PYBEL:
+            return self.run_pybel_gen3D(output_file_type, output_file, output_stream = output_stream)
+        
+        elif self.in_process and HAVE_PYBEL and self.input_file_type.lower() not in FORBIDDEN['PYBEL']:
+            return self.run_library(output_file_type, output_file, gen3D = gen3D)
+        
+        else:
+            return self.run_obabel(output_file_type, output_file, gen3D = gen3D, output_stream = output_stream)
+    
+    async def _aconvert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, running obabel asynchronously.
+         
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string.
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).        
+        :param charge:  Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :return: The converted file, or None if output_file is not None.
+        """
+        if self.in_process:
+            return await super()._aconvert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        
+        gen3D = self.prepare_options(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        return await self.arun_obabel(output_file_type, output_file, gen3D = gen3D)
+
+    def iter_convert(self, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert each of the molecules in the input file wrapped by this class to the designated output_file_type.
+
+        obabel splits the converted molecules into separate files in a temporary directory, which are then yielded one at a time.
+        
+        :param output_file_type: The file type to convert to.
+        :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :return: An iterator of converted molecules, each as a string.
+        """
+        gen3D = self.prepare_options(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+        
+        with tempfile.TemporaryDirectory() as tempdir:
+            converter = copy.copy(self)
+            
+            # obabel refuses to split its output unless it's reading from a file.
+            if self.input_file_path is None:
+                converter.input_file_path = self.spool_input(Path(tempdir, "input"))
+                converter.input_file = None
+                converter.input_file_buffer = None
+            
+            output_dir = Path(tempdir, "output")
+            output_dir.mkdir()
+            converter.run_obabel(output_file_type, str(Path(output_dir, "molecule." + output_file_type)), gen3D = gen3D, split = True)
+            
+            # Output files are numbered from 1, in the same order as the input.
+            output_files = sorted(output_dir.iterdir(), key = lambda output_file: int(re.search(r"(\d*)$", output_file.stem).group(1) or 0))
+            for output_file in output_files:
+                with open(output_file) as output:
+                    yield output.read()
+                
+                output_file.unlink()
+
+    @classmethod
+    def convert_batch(self, jobs, *, max_length = BATCH_ARGUMENT_LENGTH):
+        """
+        Convert many files with as few obabel processes as possible, spreading the cost of starting obabel over many files.
+        
+        Jobs that share input and output formats and options are grouped into a single run of obabel (with as many input
+        files as fit in max_length), which writes the converted version of each input file to a temporary directory, named after the input file.
+        Each job succeeds if its converted file was written, or otherwise fails with the errors obabel reported for its input file.
+        
+        Jobs that can't be grouped (because they read from memory, have a timeout or a seed, or would be alone in their group)
+        are converted one at a time. Every job is converted with obabel, whatever its backend.
+        
+        :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+        :param max_length: The maximum total length (in characters) of the input file paths given to each obabel command.
+        :return: A list of Conversion_result objects, in the same order as jobs.
+        """
+        # Imported here to avoid a circular import.
+        from openprattle.batch import Conversion_job, Conversion_result, failed_result
+        import glob
+        
+        jobs = [Conversion_job.from_dict(job) for job in jobs]
+        results = [None] * len(jobs)
+        
+        def convert_job(index):
+            """
+            Convert a single job with its own obabel process.
+            """
+            job = jobs[index]
+            try:
+                converter = self.from_file(input_file_path = job.input_file_path, input_file_buffer = job.input_file_buffer, input_file_type = job.input_file_type, backend = self.BACKEND, seed = job.seed)
+                output = converter.convert(job.output_file_type, job.output_file, gen3D = job.gen3D, charge = job.charge, multiplicity = job.multiplicity, timeout = job.timeout, on_timeout = job.on_timeout)
+                return Conversion_result(job, index, output = output)
+            
+            except Exception as e:
+                return failed_result(index, job, e)
+        
+        # Group jobs by their formats and options.
+        groups = {}
+        for index, job in enumerate(jobs):
+            if job.input_file_path is None or job.timeout is not None or job.seed is not None or glob.has_magic(str(job.input_file_path)):
+                # obabel can only read files (and would expand wildcards in their names).
+                results[index] = convert_job(index)
+                continue
+            
+            try:
+                converter = self(input_file_path = job.input_file_path, input_file_type = job.input_file_type if job.input_file_type is not None else self.type_from_file_name(job.input_file_path))
+                output_file_type = job.output_file_type if job.output_file_type else self.type_from_file_name(job.output_file)
+                gen3D = converter.prepare_options(gen3D = job.gen3D, charge = job.charge, multiplicity = job.multiplicity)
+            
+            except Exception as e:
+                results[index] = failed_result(index, job, e)
+                continue
+            
+            if gen3D:
+                logging.getLogger("openprattle").warning("Generating 3D coordinates from file '{}'; this will scramble atom coordinates".format(job.input_name))
+            
+            groups.setdefault((converter.input_file_type, output_file_type, gen3D), []).append(index)
+        
+        for (input_file_type, output_file_type, gen3D), indices in groups.items():
+            # Split each group into batches that fit in max_length.
+            # Output files are named after their input file, so input files with the same name must be in different batches.
+            batches = []
+            for index in indices:
+                path = str(jobs[index].input_file_path)
+                batch = next((batch for batch in batches if batch['length'] + len(path) +1 <= max_length and Path(path).stem not in batch['stems']), None)
+                if batch is None:
+                    batch = {"indices": [], "length": 0, "stems": set()}
+                    batches.append(batch)
+                
+                batch['indices'].append(index)
+                batch['length'] += len(path) +1
+                batch['stems'].add(Path(path).stem)
+            
+            for batch in batches:
+                if len(batch['indices']) == 1:
+                    # obabel only names output files after their input files when given more than one.
+                    results[batch['indices'][0]] = convert_job(batch['indices'][0])
+                    continue
+                
+                for index, result in self.run_batch([jobs[index] for index in batch['indices']], batch['indices'], input_file_type, output_file_type, gen3D = gen3D):
+                    results[index] = result if result is not None else convert_job(index)
+        
+        return results
+    
+    @classmethod
+    def run_batch(self, jobs, indices, input_file_type, output_file_type, *, gen3D):
+        """
+        Run obabel once to convert a batch of jobs (see convert_batch()).
+        
+        :param jobs: The Conversion_job objects to convert, all of which read from a file.
+        :param indices: The position of each job in its batch.
+        :param input_file_type: The format of every input file.
+        :param output_file_type: The format to convert to.
+        :param gen3D: Whether to generate 3D coordinates.
+        :return: An iterator of (index, Conversion_result) pairs, where the result is None if the job should be converted again on its own.
+        """
+        from openprattle.batch import Conversion_result, failed_result
+        
+        with tempfile.TemporaryDirectory() as output_dir:
+            sig = [self.obabel_execuable, *(str(job.input_file_path) for job in jobs), "-i", input_file_type, "-o", output_file_type]
+            if gen3D:
+                sig.append("--gen3D")
+            
+            # Add H, as for single conversions.
+            sig.extend(["-h", "-O", str(Path(output_dir, "*." + output_file_type))])
+            
+            done_process = subprocess.run(sig, stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = copy.copy(os.environ))
+            stderr = io.TextIOWrapper(io.BytesIO(done_process.stderr)).read()
+            
+            if done_process.returncode != 0:
+                # obabel stopped part way through, so we can't tell which of its output files are complete.
+                logging.getLogger("openprattle").debug("obabel command '{}' failed with exit code {}; converting each file on its own. STDERR:\n{}".format(" ".join(sig), done_process.returncode, stderr))
+                for index in indices:
+                    yield index, None
                 
-            if multiplicity is not None:
-                with ObErrorLog_wrapper(False):
-                    molecule.OBMol.SetTotalSpinMultiplicity(multiplicity)
+                return
             
-            # If we got a 2D (or 1D) format, convert to 3D (but warn that we are doing so.)
-            if (molecule.dim != 3 and gen3D is None) or gen3D:
-                # We're missing 3D coords.
-                with ObErrorLog_wrapper(False):
-                    dim = molecule.dim
-
-                logging.getLogger("openprattle").warning("Generating 3D coordinates from {}D file '{}'; this will scramble atom coordinates".format(dim, self.input_name))
+            # obabel reports each problem in its own block, which names the input file, followed by a summary of the whole batch.
+            stderr = re.sub(r"^(\d+ molecules? converted|\d+ files? output.*)$", "", stderr, flags = re.MULTILINE)
+            blocks = [block.strip() for block in stderr.split("==============================") if block.strip() != ""]
+            
+            for job, index in zip(jobs, indices):
+                path = str(job.input_file_path)
+                messages = [block for block in blocks if re.search(r"(^|\s){}(\s|$)".format(re.escape(path)), block)]
+                output_path = Path(output_dir, Path(path).stem + "." + output_file_type)
                 
-                with ObErrorLog_wrapper(False):
-                    molecule.localopt()
+                if not output_path.exists() or output_path.stat().st_size == 0:
+                    yield index, failed_result(index, job, Exception("obabel failed to convert file '{}'{}".format(
+                        job.input_name,
+                        ":\n" + "\n".join(messages) if len(messages) > 0 else "; no molecules were converted"
+                    )))
+                    continue
                 
-            if self.add_H:
-                # Add hydrogens.
-                with ObErrorLog_wrapper(False):
-                    molecule.addh()
-            
-            # Now convert and return
-            # If the format is png, use the draw() method instead because write() is bugged.
-            with ObErrorLog_wrapper():
-                if output_file_type == "png":
-                    molecule.draw(False, output_file)
+                for message in messages:
+                    logging.getLogger("openprattle").warning(message, extra = {"input_name": job.input_name})
+                
+                if job.output_file is not None:
+                    shutil.move(output_path, job.output_file)
+                    output = None
                 
                 else:
-                    return molecule.write(output_file_type, output_file, overwrite = True)
-
-
-class Obabel_converter(Openbabel_converter):
-    """
-    Wrapper class for openbabel.
-    
-    Unlike Babel_converter (which wraps the openbabel python interface), Openbabel_wrapper uses subprocess.run() 
-    """
-    
-    # The regex we'll use to check obabel converted successfully.
-    #obabel_success = re.compile(r"\b(?!0\b)\d*\b molecules? converted")
-    obabel_fail = re.compile(r"\b0 molecules converted")
-    
-    # 'Path' to the obabel executable.
-    obabel_execuable = "obabel"        
+                    output = decode_output(output_path.read_bytes(), output_file_type)
+                
+                yield index, Conversion_result(job, index, output = output)
     
-    def convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None):
-        """
-        Convert the input file wrapped by this class to the designated output_file_type.
-         
-        :param output_file_type: The file type to convert to.
-        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
-        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).        
-        :param charge:  Optional charge of the output format.
-        :param multiplicity: Optional multiplicity of the output format.
-        :return: The converted file, or None if output_file is not None.
+    def prepare_options(self, *, gen3D = None, charge = None, multiplicity = None):
         """
-        output_file = str(output_file) if output_file is not None else None
-
-        if not output_file_type:
-            output_file_type = self.type_from_file_name(output_file)
+        Check the input format and conversion options are supported by obabel.
 
+        :param gen3D: Whether to generate 3D coordinates, or None to decide automatically.
+        :param charge: Optional charge of the output format (unsupported by obabel).
+        :param multiplicity: Optional multiplicity of the output format (unsupported by obabel).
+        :return: Whether to generate 3D coordinates.
+        """
         # Check the formats are allowed.
         if self.input_file_type in FORBIDDEN['OBABEL']:
             raise ValueError("The '{}' format is not supported by obabel, try pybel instead".format(self.input_file_type))
@@ -426,17 +1640,17 @@ class Obabel_converter(Openbabel_converter):
             # We can't set charge with obabel sadly.
             logging.getLogger("openprattle").warning("Unable to set multiplicity '{}' of molecule loaded from file '{}' with obabel converter".format(multiplicity, self.input_name))
         
-        # Run
-        return self.run_obabel(output_file_type, output_file, gen3D = gen3D)
+        return gen3D
         
-    def run_obabel(self, output_file_type, output_file, *, gen3D):
+    def obabel_signature(self, output_file_type, output_file, *, gen3D, split = False):
         """
-        Run obabel, converting the input file wrapped by this class to the designated output_file_type.
+        Get the command (and environment) used to run obabel.
         
         :param output_file_type: The file type to convert to.
-        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param output_file: Optional file name to write to.
         :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
-        :return: The converted file.
+        :param split: If True, each molecule is written to a separate, numbered file based on output_file.
+        :return: A tuple of (signature, environment).
         """
         # The signature we'll use to run obabel.
         sig = [self.obabel_execuable]
@@ -464,6 +1678,9 @@ class Obabel_converter(Openbabel_converter):
         if output_file is not None:
             sig.extend(['-O', output_file])
         
+        if split:
+            sig.append("-m")
+        
         # There are several openbabel bugs re. the chem draw format; one of them occurs when we are frozen and have set the BABEL_LIBDIR env variable.
         # The workaround is to temp unset BABEL_LIBDIR.
         # Get our current environment.
@@ -479,42 +1696,324 @@ class Obabel_converter(Openbabel_converter):
                 # The BABEL_LIBDIR isn't set.
                 pass
         
-        # GO.
-        done_process = subprocess.run(
-             sig,
-             # If we're reading from buffer, specify here:
-             input = self.input_file_buffer,
-             # If we're reading from an open file, specify that here:
-             stdin = self.input_file,
-             stdout = subprocess.PIPE,
-             stderr = subprocess.PIPE,
-             # TODO: Using universal newlines is probably not safe here; some formats are binary (.cdx etc...)
-             universal_newlines = True,
-             check = True,
-             env = env
-         )
+        return sig, env
+    
+    def check_obabel(self, sig, stdout, stderr):
+        """
+        Check the output of obabel for signs of failure.
         
+        :param sig: The signature that was used to run obabel.
+        :param stdout: The stdout of obabel.
+        :param stderr: The stderr of obabel.
+        """
         # Sadly, openbabel doesn't appear to make use of return codes all the time.
         # We'll do basic error checking on whether our output contains a certain string.
-        #if not self.obabel_success.search(done_process.stderr):
-        if self.obabel_fail.search(done_process.stderr):
+        #if not self.obabel_success.search(stderr):
+        if self.obabel_fail.search(stderr):
             raise Exception("obabel command '{}' did not output an expected value; instead got:\nSTDOUT:\n{}\nSTDERR:\n{}".format(
-                " ".join(done_process.args), done_process.stdout, done_process.stderr)
+                " ".join(sig), stdout, stderr)
+            )
+    
+    def input_bytes(self):
+        """
+        Get the in-memory buffer wrapped by this class as a bytes-like object.
+        
+        Bytes and memoryview buffers are returned unchanged (without copying), while strings are encoded.
+        
+        :return: The buffer, or None if this converter is not reading from memory.
+        """
+        if isinstance(self.input_file_buffer, str):
+            return self.input_file_buffer.encode()
+        
+        return self.input_file_buffer
+    
+    def run_obabel(self, output_file_type, output_file, *, gen3D, split = False, output_stream = None, timeout = None):
+        """
+        Run obabel, converting the input file wrapped by this class to the designated output_file_type.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param split: If True, each molecule is written to a separate, numbered file based on output_file.
+        :param output_stream: Optional binary file object or file descriptor to stream the converted file to, instead of returning it.
+        :param timeout: Optional time limit (in seconds); if obabel takes longer, it is killed and Conversion_timeout is raised.
+        :return: The converted file (as bytes if output_file_type is a binary format), or None if output_file or output_stream is not None.
+        """
+        sig, env = self.obabel_signature(output_file_type, output_file, gen3D = gen3D, split = split)
+        buffer = self.input_bytes()
+        
+        # If the stream is backed by a real file, obabel can write to it directly.
+        fileno = output_fileno(output_stream) if output_stream is not None and output_file is None else None
+        
+        # Stderr is collected in a temporary file so we don't have to read it at the same time as stdout.
+        with tempfile.TemporaryFile() as stderr_file:
+            # GO.
+            with self.stage("spawn"):
+                process = subprocess.Popen(
+                     sig,
+                     # If we're reading from buffer (or an open file), specify here:
+                     stdin = subprocess.PIPE if buffer is not None else self.input_file,
+                     stdout = fileno if fileno is not None else subprocess.PIPE,
+                     stderr = stderr_file,
+                     env = env,
+                     # So that a timeout can kill obabel along with anything it (or a wrapper script) started.
+                     start_new_session = timeout is not None and hasattr(os, "killpg")
+                )
+            
+            writer = None
+            if buffer is not None:
+                # Feed the input in the background, so obabel never blocks writing its output while we're still writing its input.
+                writer = threading.Thread(target = self.feed_input, args = (process.stdin, buffer), daemon = True)
+                writer.start()
+            
+            expired = threading.Event()
+            timer = None
+            if timeout is not None:
+                # Killing obabel closes its output, so reading (and waiting) below stops too.
+                timer = threading.Timer(timeout, self.kill_process, args = (process, expired))
+                timer.start()
+            
+            chunks = []
+            try:
+                with self.stage("obabel") as details:
+                    if fileno is None:
+                        while True:
+                            chunk = process.stdout.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            
+                            if output_stream is not None:
+                                write_output(output_stream, chunk)
+                            
+                            else:
+                                chunks.append(chunk)
+                        
+                        process.stdout.close()
+                    
+                    rusage = self.wait_process(process)
+                    if rusage is not None:
+                        # CPU time and memory of the obabel process itself.
+                        details.update(user_time = rusage.ru_utime, system_time = rusage.ru_stime, max_rss_kb = rusage.ru_maxrss)
+            
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                
+                if process.returncode is None:
+                    process.kill()
+                    process.wait()
+                
+                if writer is not None:
+                    writer.join()
+            
+            stdout = decode_output(b"".join(chunks), output_file_type)
+            stderr_file.seek(0)
+            stderr = io.TextIOWrapper(stderr_file).read()
+        
+        if expired.is_set() and process.returncode != 0:
+            raise Conversion_timeout("obabel did not finish converting file '{}' within {} s, so was killed".format(self.input_name, timeout), timeout)
+        
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, sig, stdout, stderr)
+        
+        self.check_obabel(sig, stdout, stderr)
+        
+        # Return our output.
+        return stdout if output_file is None and output_stream is None else None
+    
+    @staticmethod
+    def wait_process(process):
+        """
+        Wait for a child process to finish.
+        
+        :param process: The Popen object of the child process.
+        :return: The resource usage of the child (as returned by os.wait4()), or None if not supported on this platform.
+        """
+        if not hasattr(os, "wait4"):
+            process.wait()
+            return None
+        
+        pid, status, rusage = os.wait4(process.pid, 0)
+        # Decoded by hand because os.waitstatus_to_exitcode() needs python 3.9.
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        return rusage
+    
+    @staticmethod
+    def kill_process(process, expired):
+        """
+        Kill a child process that has run out of time.
+        
+        :param process: The Popen object of the child process.
+        :param expired: A threading.Event that is set to show the process was killed.
+        """
+        expired.set()
+        try:
+            if hasattr(os, "killpg"):
+                # The process leads its own process group.
+                os.killpg(process.pid, signal.SIGKILL)
+            
+            else:
+                process.kill()
+        
+        except ProcessLookupError:
+            # Already finished.
+            pass
+    
+    @staticmethod
+    def feed_input(stdin, buffer):
+        """
+        Write an input buffer to obabel's stdin.
+        """
+        try:
+            stdin.write(buffer)
+        
+        except BrokenPipeError:
+            # Obabel stopped early; the error will be reported from its output.
+            pass
+        
+        finally:
+            try:
+                stdin.close()
+            
+            except BrokenPipeError:
+                pass
+    
+    async def arun_obabel(self, output_file_type, output_file, *, gen3D):
+        """
+        Run obabel asynchronously, converting the input file wrapped by this class to the designated output_file_type.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :return: The converted file.
+        """
+        # Imported here because it's relatively slow to load.
+        import asyncio
+        
+        sig, env = self.obabel_signature(output_file_type, output_file, gen3D = gen3D)
+        
+        buffer = self.input_bytes()
+        
+        with self.stage("spawn"):
+            process = await asyncio.create_subprocess_exec(
+                *sig,
+                stdin = subprocess.PIPE if buffer is not None else self.input_file,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE,
+                env = env
             )
         
+        with self.stage("obabel"):
+            stdout, stderr = await process.communicate(buffer)
+        
+        stdout = decode_output(stdout, output_file_type)
+        stderr = io.TextIOWrapper(io.BytesIO(stderr)).read()
+        
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, sig, stdout, stderr)
+        
+        self.check_obabel(sig, stdout, stderr)
+        
         # Return our output.
-        return done_process.stdout if output_file is None else None
+        return stdout if output_file is None else None
+    
+    def run_pybel_gen3D(self, output_file_type, output_file, *, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type, generating 3D coordinates with pybel.
+        
+        obabel's own 3D coordinate generation can be neither seeded nor cached, so instead the input file is read by obabel
+        (which supports formats that pybel does not, such as cdx) and passed to pybel (as a cml file) to generate coordinates and write the output.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param output_stream: Optional binary file object or file descriptor to stream the converted file to.
+        :return: The converted file, or None if output_file is not None.
+        """
+        if self.in_process and self.input_file_type.lower() not in FORBIDDEN['PYBEL']:
+            molecule = self.run_library("cml", None, gen3D = False)
+        
+        else:
+            molecule = self.run_obabel("cml", None, gen3D = False)
+        
+        converter = Pybel_converter(
+            input_file_buffer = molecule,
+            input_file_type = "cml",
+            hooks = self.hooks,
+            geometry_cache = self.geometry_cache,
+            seed = self.seed
+        )
+        return converter._convert(output_file_type, output_file, gen3D = True, output_stream = output_stream)
+    
+    def run_library(self, output_file_type, output_file, *, gen3D):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type with the openbabel library, in the current process.
+        
+        The same options are used as for run_obabel(), so the result should be identical.
+        This requires the pybel bindings to be available.
+        
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string (or binary string depending on format).
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :return: The converted file.
+        """
+        conversion = pybel.ob.OBConversion()
+        if not conversion.SetInAndOutFormats(self.input_file_type, output_file_type):
+            raise ValueError("Cannot convert from '{}' to '{}'; one of the formats is not recognised by Open Babel".format(self.input_file_type, output_file_type))
+        
+        # These general options are handled by openbabel in the same way as the obabel command-line switches.
+        if gen3D:
+            logging.getLogger("openprattle").warning("Generating 3D coordinates from file '{}'; this will scramble atom coordinates".format(self.input_name))
+            conversion.AddOption("gen3D", conversion.GENOPTIONS)
+        
+        if self.add_H:
+            conversion.AddOption("h", conversion.GENOPTIONS)
+        
+        with tempfile.TemporaryDirectory() as tempdir:
+            # OBConversion's Convert() (which applies the general options) only works with files.
+            input_file_path = str(self.input_file_path) if self.input_file_path is not None else self.spool_input(str(Path(tempdir, "input")))
+            output_path = output_file if output_file is not None else str(Path(tempdir, "output"))
+            
+            with ObErrorLog_wrapper():
+                if not conversion.OpenInAndOutFiles(input_file_path, output_path):
+                    raise Exception("Failed to open input file '{}' or output file '{}'".format(self.input_name, output_path))
+                
+                try:
+                    with self.stage("obabel", in_process = True):
+                        count = conversion.Convert()
+                
+                finally:
+                    conversion.CloseOutFile()
+            
+            if count == 0:
+                raise Exception("Failed to convert file '{}'; 0 molecules converted".format(self.input_name))
+            
+            if output_file is None:
+                return decode_output(Path(output_path).read_bytes(), output_file_type)
 
 
 class Openbabel_formats():
     """
     ABC for classes that retrieve available formats.
+    
+    Retrieving the supported formats is relatively slow (it requires loading every openbabel plugin, or running obabel twice),
+    so the tables of formats are cached in memory and on disk. Cached tables are keyed by a fingerprint of the openbabel
+    installation (see fingerprint()), and so are automatically refreshed whenever openbabel changes.
     """
 
     TYPE_NAME = "GENERIC"
+    
+    # Tables of formats that we've already retrieved in this process, keyed by fingerprint.
+    _tables = {}
+
+    def read(self, refresh = False):
+        """
+        Retrieve supported input (read) formats.
 
-    def read(self, *args, **kwargs):
-        forms = self._read(*args, **kwargs)
+        The return value is a dictionary of formats. Each key is the format shortcode (which can be used as input_file_type). Each value is a description of the format.
+        
+        :param refresh: If True, ignore any cached formats.
+        """
+        forms = self.table(refresh)["read"]
         
         # Remove any exclusions.
         return {key: value for key, value in forms.items() if key not in FORBIDDEN[self.TYPE_NAME]}
@@ -527,8 +2026,15 @@ class Openbabel_formats():
         """
         raise NotImplementedError("Implement in subclass")
     
-    def write(self, *args, **kwargs):
-        return self._write(*args, **kwargs)
+    def write(self, refresh = False):
+        """
+        Retrieve supported write (output) formats.
+
+        The return value is a dictionary of formats. Each key is the format shortcode (which can be used as output_file_type elsewhere in this module). Each value is a description of the format.
+        
+        :param refresh: If True, ignore any cached formats.
+        """
+        return self.table(refresh)["write"]
 
     def _write(self):
         """
@@ -537,8 +2043,113 @@ class Openbabel_formats():
         The return value is a dictionary of formats. Each key is the format shortcode (which can be used as output_file_type elsewhere in this module). Each value is a description of the format.
         """
         raise NotImplementedError("Implement in subclass")
+    
+    def fingerprint(self):
+        """
+        Get a dictionary that identifies the openbabel installation used by this class, without loading it.
+        
+        If the installation cannot be identified, None is returned (and the formats will not be cached on disk).
+        """
+        return None
+    
+    def table(self, refresh = False):
+        """
+        Retrieve both the supported input and output formats, using the cached tables if possible.
+        
+        :param refresh: If True, ignore any cached formats.
+        :return: A dictionary with two keys, 'read' and 'write', each of which is a dictionary of formats.
+        """
+        fingerprint = self.fingerprint()
+        memory_key = (self.TYPE_NAME, json.dumps(fingerprint, sort_keys = True))
+        cache_file = self.cache_file(fingerprint) if fingerprint is not None else None
+        
+        if not refresh:
+            # First, check memory.
+            try:
+                return self._tables[memory_key]
+            
+            except KeyError:
+                pass
+            
+            # Next, check the tables we were frozen with.
+            table = self.frozen_table()
+            
+            # Then check disk.
+            if table is None and cache_file is not None:
+                try:
+                    with open(cache_file) as cache:
+                        cached = json.load(cache)
+                    
+                    if cached['fingerprint'] == fingerprint:
+                        table = {"read": cached['read'], "write": cached['write']}
+                
+                except Exception:
+                    # Missing or bad cache file.
+                    pass
+            
+            if table is not None:
+                self._tables[memory_key] = table
+                return table
+        
+        # Cache miss.
+        table = {"read": dict(self._read()), "write": dict(self._write())}
+        self._tables[memory_key] = table
+        
+        if cache_file is not None:
+            try:
+                cache_file.parent.mkdir(parents = True, exist_ok = True)
+                # Write to a temporary file first, so other processes never see a partial table.
+                descriptor, temp_path = tempfile.mkstemp(dir = cache_file.parent, prefix = ".")
+                with os.fdopen(descriptor, "w") as temp_file:
+                    json.dump(dict(table, fingerprint = fingerprint), temp_file)
+                
+                os.replace(temp_path, cache_file)
+            
+            except Exception:
+                logging.getLogger("openprattle").debug("Failed to write format cache file '{}'".format(cache_file), exc_info = True)
+        
+        return table
+    
+    def cache_file(self, fingerprint):
+        """
+        The path to the file used to cache the formats of a given openbabel installation.
+        """
+        from openprattle.cache import cache_dir
+        digest = hashlib.sha256(json.dumps(fingerprint, sort_keys = True).encode()).hexdigest()
+        return Path(cache_dir(), "formats", "{}-{}.json".format(self.TYPE_NAME.lower(), digest[:16]))
+    
+    def frozen_table(self):
+        """
+        Retrieve the table of formats that was computed when we were frozen, if there is one.
+        """
+        if not openprattle.frozen:
+            return None
+        
+        try:
+            with open(Path(sys._MEIPASS, "openprattle", "formats.json")) as table_file:
+                return json.load(table_file).get(self.TYPE_NAME)
+        
+        except FileNotFoundError:
+            return None
+
+
+def installed_versions(prefix):
+    """
+    Guess which version(s) of openbabel are installed under a prefix, based on the names of the plugin directories.
+    
+    Openbabel installs its plugins to <prefix>/lib/openbabel/<version>.
+    
+    :param prefix: The installation prefix (for example, /usr).
+    :return: A list of versions (which may be empty).
+    """
+    try:
+        return sorted(path.name for path in Path(prefix, "lib", "openbabel").iterdir() if path.is_dir())
+    
+    except OSError:
+        return []
+
 
-if HAVE_PYBEL:
+if FOUND_PYBEL:
     class Pybel_formats(Openbabel_formats):
         """
         Class for retrieving the supported file formats from pybel.
@@ -561,6 +2172,34 @@ if HAVE_PYBEL:
             The return value is a dictionary of formats. Each key is the format shortcode (which can be used as output_file_type elsewhere in this module). Each value is a description of the format.
             """
             return pybel.outformats
+        
+        def fingerprint(self):
+            """
+            Get a dictionary that identifies the openbabel installation used by this class, without loading it.
+            
+            The python bindings are identified by the location and modification time of the compiled extension module.
+            """
+            spec = importlib.util.find_spec("openbabel")
+            package_dir = Path(spec.submodule_search_locations[0])
+            extensions = sorted(package_dir.glob("_openbabel*"))
+            
+            if len(extensions) == 0:
+                return None
+            
+            # The version is recorded in the package's __init__.py (at least for the pip and conda versions).
+            try:
+                match = re.search(r"""__version__\s*=\s*["']([^"']+)["']""", Path(package_dir, "__init__.py").read_text())
+                version = match.group(1) if match else None
+            
+            except OSError:
+                version = None
+            
+            return dict(
+                module = str(extensions[0].resolve()),
+                mtime = extensions[0].stat().st_mtime_ns,
+                version = version,
+                **BABEL_ENVIRONMENT
+            )
             
 
 class Obabel_formats(Openbabel_formats):
@@ -614,50 +2253,46 @@ class Obabel_formats(Openbabel_formats):
         return formats
 
     
-    def _read(self, refresh = False):
+    def _read(self):
         """
         Retrieve supported input (read) formats.
 
         The return value is a dictionary of formats. Each key is the format shortcode (which can be used as input_file_type). Each value is a description of the format.
         """
-        if refresh:
-            try:
-                del self.__class__._read_formats
-            
-            except AttributeError:
-                pass
-        
-        try:
-            return self.__class__._read_formats
+        return self.run("read")
         
-        except AttributeError:
-            # Cache miss.
-            self.__class__._read_formats = self.run("read")
-            return self.__class__._read_formats
-        
-    def _write(self, refresh = False):
+    def _write(self):
         """
         Retrieve supported write (output) formats.
 
         The return value is a dictionary of formats. Each key is the format shortcode (which can be used as output_file_type elsewhere in this module). Each value is a description of the format.
         """
-        if refresh:
-            try:
-                del self.__class__._write_formats
-            
-            except AttributeError:
-                pass
+        return self.run("write")
+    
+    def fingerprint(self):
+        """
+        Get a dictionary that identifies the openbabel installation used by this class, without running it.
         
-        try:
-            return self.__class__._write_formats
+        The obabel executable is identified by its resolved path and modification time, along with the version of its plugins.
+        """
+        executable = shutil.which(self.obabel_execuable)
+        if executable is None:
+            return None
         
-        except AttributeError:
-            # Cache miss.
-            self.__class__._write_formats = self.run("write")
-            return self.__class__._write_formats
+        executable = Path(executable).resolve()
+        stat = executable.stat()
+        
+        return dict(
+            executable = str(executable),
+            mtime = stat.st_mtime_ns,
+            size = stat.st_size,
+            version = installed_versions(executable.parent.parent),
+            **BABEL_ENVIRONMENT
+        )
 
 def formats(backend = "Auto"):
-    if backend != "Obabel" and HAVE_PYBEL:
+    # Don't load the bindings here (by testing HAVE_PYBEL); the table of formats is normally cached.
+    if backend != "Obabel" and FOUND_PYBEL:
         return Pybel_formats()
     
     else:
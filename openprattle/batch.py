@@ -0,0 +1,297 @@
+"""Classes and functions for converting many files at once."""
+
+import os
+import pickle
+import traceback
+import itertools
+from collections import deque
+
+from openprattle.babel import Openbabel_converter
+from openprattle.log import Log_listener, init_worker_logger, job_context
+
+
+class Conversion_job():
+    """
+    A single conversion request, as used by the batch conversion API.
+
+    Jobs are sent to worker processes, so unlike the converter classes they cannot wrap an open file descriptor;
+    the input must be given either as a path or as an in-memory buffer.
+    """
+
+    def __init__(self, *,
+        input_file_path = None,
+        input_file_buffer = None,
+        input_file_type = None,
+        output_file_type = None,
+        output_file = None,
+        gen3D = None,
+        charge = None,
+        multiplicity = None,
+        backend = "Auto",
+        name = None,
+        seed = None,
+        timeout = None,
+        on_timeout = ()
+    ):
+        """
+        :param input_file_path: A path to a file that should be converted.
+        :param input_file_buffer: Alternatively, a buffer (unicode string or bytes) in the format given by input_file_type that should be converted.
+        :param input_file_type: A shortcode identifying the format of the input file. If not given but input_file_path is given, then this will be determined automatically.
+        :param output_file_type: The file type to convert to. If not given, this is determined from output_file.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned in the job's result.
+        :param gen3D: If True and the loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param backend: The backend to convert with, one of 'Auto', 'Pybel', 'Obabel', 'Adaptive' or 'Native'.
+        :param name: Optional descriptive name of this job. If not given, the input file path is used.
+        :param seed: Optional seed for the random number generator used when generating 3D coordinates.
+        :param timeout: Optional time limit (in seconds) for the conversion; if it takes longer, it is stopped and fails with Conversion_timeout.
+        :param on_timeout: The ways to retry the conversion if it times out, in order ('other_backend' and/or 'without_gen3D').
+        """
+        if input_file_path is None and input_file_buffer is None:
+            raise ValueError("One of input_file_path or input_file_buffer must be given")
+
+        self.input_file_path = input_file_path
+        self.input_file_buffer = input_file_buffer
+        self.input_file_type = input_file_type
+        self.output_file_type = output_file_type
+        self.output_file = output_file
+        self.gen3D = gen3D
+        self.charge = charge
+        self.multiplicity = multiplicity
+        self.backend = backend
+        self.name = name
+        self.seed = seed
+        self.timeout = timeout
+        self.on_timeout = tuple(on_timeout)
+
+    @classmethod
+    def from_dict(self, job):
+        """
+        Get a Conversion_job object from a dictionary of options.
+
+        :param job: A dictionary of keyword arguments to the Conversion_job constructor, or an existing Conversion_job object (which is returned unchanged).
+        """
+        if isinstance(job, Conversion_job):
+            return job
+
+        return self(**job)
+
+    @property
+    def input_name(self):
+        """
+        A descriptive name of the file we are converting. Works even if converting from memory.
+        """
+        if self.name is not None:
+            return self.name
+
+        elif self.input_file_path is not None:
+            return str(self.input_file_path)
+
+        else:
+            return "(file loaded from memory)"
+
+    def converter(self, pool = None):
+        """
+        Get a converter object that can be used to perform this job.
+
+        :param pool: Optional Worker_pool for the converter to perform conversions with.
+        """
+        return Openbabel_converter.from_file(
+            input_file_path = self.input_file_path,
+            input_file_buffer = self.input_file_buffer,
+            input_file_type = self.input_file_type,
+            backend = self.backend,
+            seed = self.seed,
+            pool = pool
+        )
+
+    def run(self, pool = None):
+        """
+        Perform this conversion job in the current process.
+
+        :param pool: Optional Worker_pool to perform the conversion (and any retries) with.
+        :return: The converted file, or None if output_file is not None.
+        """
+        return self.converter(pool).convert(
+            self.output_file_type,
+            self.output_file,
+            gen3D = self.gen3D,
+            charge = self.charge,
+            multiplicity = self.multiplicity,
+            timeout = self.timeout,
+            on_timeout = self.on_timeout
+        )
+    
+    async def arun(self):
+        """
+        Perform this conversion job in the current process, without blocking the event loop.
+
+        :return: The converted file, or None if output_file is not None.
+        """
+        return await self.converter().aconvert(
+            self.output_file_type,
+            self.output_file,
+            gen3D = self.gen3D,
+            charge = self.charge,
+            multiplicity = self.multiplicity,
+            timeout = self.timeout,
+            on_timeout = self.on_timeout
+        )
+
+
+class Conversion_result():
+    """
+    The outcome of a single Conversion_job.
+    """
+
+    def __init__(self, job, index, output = None, error = None, traceback = None):
+        """
+        :param job: The job that was run.
+        :param index: The position of the job in the original batch.
+        :param output: The converted file (if the job did not specify an output_file).
+        :param error: If the job failed, the exception that was raised.
+        :param traceback: If the job failed, the formatted traceback of the exception.
+        """
+        self.job = job
+        self.index = index
+        self.output = output
+        self.error = error
+        self.traceback = traceback
+
+    @property
+    def success(self):
+        """
+        Whether the job completed successfully.
+        """
+        return self.error is None
+
+    def __repr__(self):
+        return "<{} {} '{}': {}>".format(type(self).__name__, self.index, self.job.input_name, "success" if self.success else "failed")
+
+
+def run_job(index, job):
+    """
+    Run a single job, catching any errors.
+
+    This function is the entry point used by worker processes.
+
+    :param index: The position of the job in the batch.
+    :param job: The Conversion_job to run.
+    :return: A Conversion_result object.
+    """
+    # Log records are tagged with the job (if they are being sent to a Log_listener).
+    with job_context(index, job.input_name):
+        try:
+            return Conversion_result(job, index, output = job.run())
+
+        except Exception as e:
+            return failed_result(index, job, e)
+
+
+def failed_result(index, job, error):
+    """
+    Get a Conversion_result object describing a job that failed.
+
+    :param index: The position of the job in the batch.
+    :param job: The Conversion_job that failed.
+    :param error: The exception that was raised.
+    :return: A Conversion_result object.
+    """
+    formatted_traceback = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+
+    # Make sure we can send the exception to another process.
+    try:
+        pickle.dumps(error)
+
+    except Exception:
+        error = Exception(str(error))
+
+    return Conversion_result(job, index, error = error, traceback = formatted_traceback)
+
+
+def ordered_results(executor, function, jobs, window):
+    """
+    Submit jobs to an executor, yielding their results in order.
+
+    Only a limited number of jobs are submitted at once, so the entire batch is never held in memory.
+
+    :param executor: A concurrent.futures Executor to submit jobs to.
+    :param function: The function to run; it will be called with the index of each job and the job itself.
+    :param jobs: An iterable of jobs. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+    :param window: The maximum number of jobs that are submitted at once.
+    :return: An iterator of results, in the same order as jobs.
+    """
+    jobs = enumerate(Conversion_job.from_dict(job) for job in jobs)
+    pending = deque(executor.submit(function, index, job) for index, job in itertools.islice(jobs, window))
+
+    while len(pending) > 0:
+        result = pending.popleft().result()
+
+        for index, job in itertools.islice(jobs, 1):
+            pending.append(executor.submit(function, index, job))
+
+        yield result
+
+
+def convert_many(jobs, workers = None, *, backlog = 4):
+    """
+    Convert many files, spread across a pool of worker processes.
+
+    Errors raised by individual jobs do not abort the batch; they are instead reported in the corresponding Conversion_result.
+    Messages logged by the workers are sent to this process and written by a single Log_listener, tagged with their job.
+
+    :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+    :param workers: The number of worker processes to use. If None, one per CPU is used. If 1, jobs are run serially in the current process.
+    :param backlog: The number of jobs per worker to submit ahead of the result currently being waited on.
+    :return: An iterator of Conversion_result objects, in the same order as jobs.
+    """
+    workers = workers if workers is not None else os.cpu_count() or 1
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    elif workers == 1:
+        # No need for a pool.
+        for index, job in enumerate(jobs):
+            yield run_job(index, Conversion_job.from_dict(job))
+
+        return
+
+    # Imported here because it's relatively slow to load.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with Log_listener() as listener, ProcessPoolExecutor(workers, initializer = init_worker_logger, initargs = (listener.queue,)) as executor:
+        yield from ordered_results(executor, run_job, jobs, workers * backlog)
+
+
+async def aconvert_many(jobs, concurrency = None):
+    """
+    Convert many files concurrently from within an asyncio event loop.
+
+    Obabel conversions run as asynchronous subprocesses, while Pybel conversions run in an executor.
+    Errors raised by individual jobs do not abort the batch; they are instead reported in the corresponding Conversion_result.
+
+    :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+    :param concurrency: The maximum number of conversions to run at once. If None, one per CPU is used.
+    :return: A list of Conversion_result objects, in the same order as jobs.
+    """
+    # Imported here because it's relatively slow to load.
+    import asyncio
+
+    concurrency = concurrency if concurrency is not None else os.cpu_count() or 1
+
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, job):
+        async with semaphore:
+            try:
+                return Conversion_result(job, index, output = await job.arun())
+
+            except Exception as e:
+                return failed_result(index, job, e)
+
+    return await asyncio.gather(*(run(index, Conversion_job.from_dict(job)) for index, job in enumerate(jobs)))
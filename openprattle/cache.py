@@ -0,0 +1,497 @@
+"""Caching of conversion results."""
+
+import os
+import hashlib
+import threading
+import tempfile
+import json
+from collections import OrderedDict
+from pathlib import Path
+
+from openprattle.babel import CHUNK_SIZE, pybel
+
+
+def cache_dir():
+    """
+    Get the default directory in which openprattle stores persistent cache files.
+
+    This is $XDG_CACHE_HOME/openprattle if XDG_CACHE_HOME is set, and ~/.cache/openprattle otherwise.
+    """
+    base = os.environ.get("XDG_CACHE_HOME")
+    return Path(base if base else Path("~", ".cache").expanduser(), "openprattle")
+
+
+class Cache():
+    """
+    A two-tier key-value store, with a bounded in-memory LRU tier in front of an (optional) size-capped on-disk tier.
+
+    Keys are strings (normally a hash) and values are bytes.
+    The cache is safe to use from multiple threads, and several processes can share the same disk tier.
+    """
+
+    def __init__(self, memory_size = 128, disk_path = None, disk_size = 256 * 1024 * 1024):
+        """
+        :param memory_size: The maximum number of entries to keep in memory. If 0, the memory tier is disabled.
+        :param disk_path: Optional path to a directory to store cache entries in. If None, the disk tier is disabled.
+        :param disk_size: The maximum total size (in bytes) of the entries stored on disk. Once exceeded, the least recently used entries are removed.
+        """
+        self.memory_size = memory_size
+        self.disk_path = Path(disk_path) if disk_path is not None else None
+        self.disk_size = disk_size
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # The (approximate) total size of the disk tier.
+        self.disk_total = 0
+        if self.disk_path is not None:
+            self.disk_path.mkdir(parents = True, exist_ok = True)
+            self.disk_total = sum(size for entry_path, size, mtime in self.disk_entries())
+
+    @property
+    def hits(self):
+        """
+        The total number of cache hits (from either tier).
+        """
+        return self.memory_hits + self.disk_hits
+
+    def entry_path(self, key):
+        """
+        The path to the file in the disk tier that stores a given key.
+        """
+        return Path(self.disk_path, key[:2], key)
+
+    def get(self, key):
+        """
+        Retrieve a value from the cache.
+
+        :param key: The key to look up.
+        :return: The stored value, or None if the key is not in the cache.
+        """
+        with self.lock:
+            try:
+                value = self.memory[key]
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+
+            except KeyError:
+                pass
+
+        value = None
+        if self.disk_path is not None:
+            entry_path = self.entry_path(key)
+            try:
+                value = entry_path.read_bytes()
+                # Mark the entry as recently used.
+                os.utime(entry_path)
+
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+
+            else:
+                self.disk_hits += 1
+                self.remember(key, value)
+
+        return value
+
+    def put(self, key, value):
+        """
+        Store a value in the cache.
+
+        :param key: The key to store the value under.
+        :param value: The value to store (bytes).
+        """
+        with self.lock:
+            self.remember(key, value)
+
+        if self.disk_path is not None and len(value) <= self.disk_size:
+            entry_path = self.entry_path(key)
+            entry_path.parent.mkdir(exist_ok = True)
+
+            # Write to a temporary file first, so other processes never see a partial entry.
+            descriptor, temp_path = tempfile.mkstemp(dir = entry_path.parent, prefix = ".")
+            with os.fdopen(descriptor, "wb") as temp_file:
+                temp_file.write(value)
+
+            os.replace(temp_path, entry_path)
+            
+            with self.lock:
+                self.disk_total += len(value)
+                full = self.disk_total > self.disk_size
+            
+            if full:
+                self.trim()
+
+    def remember(self, key, value):
+        """
+        Add a value to the memory tier, evicting the least recently used entry if necessary.
+
+        The cache lock must be held when calling this method.
+        """
+        if self.memory_size <= 0:
+            return
+
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last = False)
+
+    def disk_entries(self):
+        """
+        Get a list of the entries in the disk tier.
+
+        :return: A list of (path, size, last-used time) tuples.
+        """
+        entries = []
+        if self.disk_path is None:
+            return entries
+
+        for entry_path in self.disk_path.glob("??/*"):
+            if entry_path.name.startswith("."):
+                # Partially written entry.
+                continue
+
+            try:
+                stat = entry_path.stat()
+
+            except FileNotFoundError:
+                # Removed by someone else.
+                continue
+
+            entries.append((entry_path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def trim(self):
+        """
+        Remove the least recently used entries from the disk tier until its total size is below disk_size.
+        """
+        # Other processes may be sharing the disk tier, so check what's actually there.
+        entries = self.disk_entries()
+        total = sum(size for entry_path, size, mtime in entries)
+
+        if total > self.disk_size:
+            for entry_path, size, mtime in sorted(entries, key = lambda entry: entry[2]):
+                try:
+                    entry_path.unlink()
+
+                except FileNotFoundError:
+                    pass
+
+                with self.lock:
+                    self.evictions += 1
+
+                total -= size
+                if total <= self.disk_size:
+                    break
+
+        with self.lock:
+            self.disk_total = total
+
+    def clear(self):
+        """
+        Remove all entries from the cache (in both tiers).
+        """
+        with self.lock:
+            self.memory.clear()
+            self.disk_total = 0
+
+        for entry_path, size, mtime in self.disk_entries():
+            try:
+                entry_path.unlink()
+
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """
+        Get statistics on the performance of the cache.
+
+        :return: A dictionary of statistics.
+        """
+        entries = self.disk_entries()
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(entries),
+            "disk_bytes": sum(size for entry_path, size, mtime in entries)
+        }
+
+
+class Conversion_cache(Cache):
+    """
+    A cache of conversion results.
+
+    Results are addressed by a hash of the input file contents (and name), the input and output formats, the conversion options,
+    the backend and the version of openbabel, so the same input converted in the same way will only ever be converted once.
+
+    Pass a Conversion_cache to any converter object as the 'cache' argument to use it:
+
+        cache = Conversion_cache(disk_path = cache_dir() / "results")
+        converter = Openbabel_converter.from_file(input_file_path = "Benzene.cml", cache = cache)
+        converter.convert("xyz")
+        print(cache.stats())
+    """
+
+    # Prefixes used to record whether a cached value was returned as a string or as bytes.
+    TEXT = b"s"
+    BINARY = b"b"
+
+    def key(self, converter, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Get the key that identifies a conversion.
+
+        If the converter wraps an open file, it is read into memory (and the converter updated to use the buffer instead).
+
+        :param converter: The converter object that is performing the conversion.
+        :param output_file_type: The file type to convert to.
+        :param gen3D: Whether 3D coordinates are being generated.
+        :param charge: The charge of the output format.
+        :param multiplicity: The multiplicity of the output format.
+        :return: The key (a hex digest).
+        """
+        digest = hashlib.sha256()
+
+        if converter.input_file is not None:
+            # We need to consume the file to hash it, so keep hold of its contents.
+            converter.input_file_buffer = converter.input_file.read()
+            converter.input_file = None
+
+        digest.update(json.dumps({
+            # Openbabel uses the name of the input file as the title of molecules that don't have one.
+            "input_file_path": str(converter.input_file_path) if converter.input_file_buffer is None else None,
+            "input_file_type": converter.input_file_type,
+            "output_file_type": output_file_type,
+            "gen3D": gen3D,
+            "charge": charge,
+            "multiplicity": multiplicity,
+            "add_H": converter.add_H,
+            "backend": converter.BACKEND,
+            "seed": converter.seed,
+            "version": converter.version()
+        }, sort_keys = True).encode())
+
+        if converter.input_file_buffer is not None:
+            buffer = converter.input_file_buffer
+            digest.update(buffer.encode() if isinstance(buffer, str) else buffer)
+
+        else:
+            with open(converter.input_file_path, "rb") as input_file:
+                while True:
+                    chunk = input_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def load(self, key, output_file = None):
+        """
+        Retrieve a conversion result from the cache.
+
+        :param key: The key identifying the conversion.
+        :param output_file: Optional file name to write the result to.
+        :return: A tuple of (hit, result), where hit is True if the conversion was found in the cache and result is the converted file (or None if output_file is not None).
+        """
+        value = self.get(key)
+
+        if value is None:
+            return False, None
+
+        prefix, value = value[:1], value[1:]
+
+        if output_file is not None:
+            Path(output_file).write_bytes(value)
+            return True, None
+
+        return True, value.decode() if prefix == self.TEXT else value
+
+    def save(self, key, result, output_file = None):
+        """
+        Store a conversion result in the cache.
+
+        :param key: The key identifying the conversion.
+        :param result: The converted file, as returned by convert().
+        :param output_file: If the conversion was written to a file, the name of that file.
+        """
+        if output_file is not None:
+            value = self.BINARY + Path(output_file).read_bytes()
+
+        elif isinstance(result, str):
+            value = self.TEXT + result.encode()
+
+        else:
+            value = self.BINARY + bytes(result)
+
+        self.put(key, value)
+
+
+class Geometry_cache(Cache):
+    """
+    A cache of generated 3D coordinates.
+
+    Generating 3D coordinates (with a force-field optimisation) is normally the most expensive step of a conversion.
+    Coordinates are stored under a canonical identifier of the molecule (its canonical SMILES or InChIKey), its charge
+    and multiplicity, the force-field settings, the random seed and the version of openbabel, so the same structure
+    only ever has its coordinates generated once, however its input file is written (atom order, format etc).
+
+    Pass a Geometry_cache to any converter object as the 'geometry_cache' argument to use it (this requires the pybel bindings):
+
+        geometry_cache = Geometry_cache(disk_path = cache_dir() / "geometries")
+        converter = Openbabel_converter.from_file(input_file_path = "Benzene.cdx", geometry_cache = geometry_cache, seed = 1)
+        converter.convert("xyz", gen3D = True)
+
+    Coordinates generated with a seed are reproducible, so a cached result is the same as a freshly generated one.
+    """
+
+    def __init__(self, *args, identifier = "smiles", **kwargs):
+        """
+        See Cache for the full list of arguments.
+
+        :param identifier: The canonical identifier to store molecules under, either 'smiles' (canonical isomeric SMILES) or 'inchikey'.
+            Note that openbabel determines the stereochemistry in an InChI from atom coordinates, so molecules read from formats without coordinates (such as SMILES) can lose their stereochemistry.
+        """
+        if identifier not in ("inchikey", "smiles"):
+            raise ValueError("Unknown identifier '{}'; must be either 'inchikey' or 'smiles'".format(identifier))
+
+        super().__init__(*args, **kwargs)
+        self.identifier = identifier
+
+    @staticmethod
+    def symmetry_classes(molecule):
+        """
+        Get the symmetry class of each atom of a molecule; atoms that are topologically equivalent share a class.
+
+        :param molecule: A pybel Molecule object.
+        :return: A list of classes, in the same order as the atoms of the molecule.
+        """
+        symmetry = pybel.ob.vectorUnsignedInt()
+        pybel.ob.OBGraphSym(molecule.OBMol).GetSymmetry(symmetry)
+        return list(symmetry)
+
+    @classmethod
+    def canonical_labels(self, molecule):
+        """
+        Get the canonical label of each atom of a molecule.
+
+        Equivalent atoms can be labelled differently each time, so labels are only used to match atoms between molecules with a different atom order.
+
+        :param molecule: A pybel Molecule object.
+        :return: A list of labels (starting at 1), in the same order as the atoms of the molecule.
+        """
+        symmetry = pybel.ob.vectorUnsignedInt(self.symmetry_classes(molecule))
+        labels = pybel.ob.vectorUnsignedInt()
+        pybel.ob.CanonicalLabels(molecule.OBMol, symmetry, labels)
+        return list(labels)
+
+    def key(self, molecule, *, forcefield, steps, seed = None):
+        """
+        Get the key that identifies the 3D coordinates of a molecule.
+
+        The key includes a signature of the molecule's topology (its atoms and bonds, by symmetry class), so that
+        different structures which share an identifier (tautomers, for example, have the same standard InChIKey) are not confused.
+
+        :param molecule: The pybel Molecule object that 3D coordinates are being generated for (before hydrogens are added).
+        :param forcefield: The name of the force-field used to optimise the coordinates.
+        :param steps: The number of optimisation steps.
+        :param seed: The random seed used to generate the coordinates.
+        :return: A tuple of the key (a hex digest) and a copy of the molecule with hydrogens added, to pass to load() and save().
+        """
+        # Hydrogens are added when coordinates are generated, so that's what we're storing coordinates for.
+        template = pybel.Molecule(pybel.ob.OBMol(molecule.OBMol))
+        template.addh()
+
+        symmetry = self.symmetry_classes(template)
+        atoms = sorted((symmetry[atom.GetIdx() -1], atom.GetAtomicNum(), atom.GetFormalCharge()) for atom in pybel.ob.OBMolAtomIter(template.OBMol))
+        bonds = sorted(
+            tuple(sorted((symmetry[bond.GetBeginAtomIdx() -1], symmetry[bond.GetEndAtomIdx() -1]))) + ("aromatic" if bond.IsAromatic() else bond.GetBondOrder(),)
+                for bond in pybel.ob.OBMolBondIter(template.OBMol)
+        )
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            # Don't echo InChI warnings (about undefined stereochemistry etc) to stderr.
+            "identifier": (template.write("inchikey", opt = {"w": None}) if self.identifier == "inchikey" else template.write("can")).split()[0],
+            "atoms": atoms,
+            "bonds": bonds,
+            "charge": template.OBMol.GetTotalCharge(),
+            "multiplicity": template.OBMol.GetTotalSpinMultiplicity(),
+            "forcefield": forcefield,
+            "steps": steps,
+            "seed": seed,
+            "version": pybel.ob.OBReleaseVersion()
+        }, sort_keys = True).encode())
+
+        return digest.hexdigest(), template
+
+    def load(self, key, template, molecule):
+        """
+        Apply cached 3D coordinates to a molecule.
+
+        :param key: The key identifying the coordinates, from key().
+        :param template: The molecule (with hydrogens) returned by key().
+        :param molecule: The pybel Molecule object to modify (in place). On a hit, hydrogens are added and the cached coordinates applied.
+        :return: True if the coordinates were found in the cache, False otherwise (in which case the molecule is not modified).
+        """
+        value = self.get(key)
+
+        if value is None:
+            return False
+
+        value = json.loads(value)
+        if len(value['coordinates']) != template.OBMol.NumAtoms():
+            # Shouldn't happen.
+            return False
+
+        if value['symmetry'] == self.symmetry_classes(template):
+            # Atoms are (almost certainly) in the same order as when the coordinates were stored.
+            coordinates = value['coordinates']
+
+        else:
+            # Match up atoms by their canonical labels.
+            stored = dict(zip(value['labels'], value['coordinates']))
+            coordinates = [stored[label] for label in self.canonical_labels(template)]
+
+        molecule.addh()
+        for atom, (x, y, z) in zip(pybel.ob.OBMolAtomIter(molecule.OBMol), coordinates):
+            atom.SetVector(x, y, z)
+
+        molecule.OBMol.SetDimension(3)
+        return True
+
+    def save(self, key, template, molecule):
+        """
+        Store the 3D coordinates of a molecule in the cache.
+
+        :param key: The key identifying the coordinates, from key().
+        :param template: The molecule (with hydrogens) returned by key().
+        :param molecule: The pybel Molecule object, with newly generated coordinates.
+        """
+        if molecule.OBMol.NumAtoms() != template.OBMol.NumAtoms():
+            # Not the structure we expected (the force-field might have failed); don't remember it.
+            return
+
+        self.put(key, json.dumps({
+            "symmetry": self.symmetry_classes(template),
+            "labels": self.canonical_labels(template),
+            "coordinates": [(atom.GetX(), atom.GetY(), atom.GetZ()) for atom in pybel.ob.OBMolAtomIter(molecule.OBMol)]
+        }).encode())
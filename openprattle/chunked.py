@@ -0,0 +1,303 @@
+"""Parallel conversion of very large multi-structure files, split into chunks of whole records."""
+
+import os
+import mmap
+import itertools
+from collections import deque
+from pathlib import Path
+
+from openprattle.babel import Openbabel_converter
+
+
+# The approximate size (in bytes) of each chunk of the input file sent to a worker.
+CHUNK_BYTES = 1024 * 1024
+
+
+def line_end(mapped, position):
+    """
+    Get the position just after the end of the line starting at position (or the end of the file).
+    """
+    end = mapped.find(b"\n", position)
+    return end +1 if end != -1 else len(mapped)
+
+def xyz_records(mapped):
+    """
+    Find the records (frames) in an xyz file.
+
+    Only the atom count line of each frame is parsed; the rest of the frame is skipped by counting newlines.
+
+    :param mapped: The memory-mapped file.
+    :return: An iterator of (start, end) byte offsets of each record.
+    """
+    position = 0
+    while position < len(mapped):
+        end = line_end(mapped, position)
+        count_line = mapped[position:end].strip()
+
+        if count_line == b"":
+            # Blank lines at the end of the file.
+            position = end
+            continue
+
+        try:
+            count = int(count_line)
+
+        except ValueError:
+            raise ValueError("Could not find the atom count of the xyz frame at byte {}".format(position)) from None
+
+        # The comment line, then one line per atom.
+        for line in range(count +1):
+            end = line_end(mapped, end)
+
+        yield position, end
+        position = end
+
+def sdf_records(mapped):
+    """
+    Find the records in an sdf file, each of which is terminated by a '$$$$' line.
+
+    :param mapped: The memory-mapped file.
+    :return: An iterator of (start, end) byte offsets of each record.
+    """
+    position = 0
+    search = 0
+    while position < len(mapped):
+        delimiter = mapped.find(b"$$$$", search)
+
+        if delimiter == -1:
+            # A final record without a delimiter (if it's not just whitespace).
+            if mapped[position:].strip() != b"":
+                yield position, len(mapped)
+
+            return
+
+        elif delimiter != 0 and mapped[delimiter -1] not in b"\r\n":
+            # Not at the start of a line, so part of a data item.
+            search = delimiter +4
+            continue
+
+        end = line_end(mapped, delimiter)
+        yield position, end
+        position = search = end
+
+def line_records(mapped):
+    """
+    Find the records in a file with one record per line (such as SMILES).
+
+    :param mapped: The memory-mapped file.
+    :return: An iterator of (start, end) byte offsets of each record.
+    """
+    position = 0
+    while position < len(mapped):
+        end = line_end(mapped, position)
+        if mapped[position:end].strip() != b"":
+            yield position, end
+
+        position = end
+
+
+# The functions that find the records in each format that can be split into chunks.
+RECORD_SCANNERS = {
+    "xyz": xyz_records,
+    "sdf": sdf_records,
+    "sd": sdf_records,
+    "smi": line_records,
+    "smiles": line_records,
+}
+
+def can_chunk(input_file_type):
+    """
+    Determine whether files of a given format can be split into chunks.
+    """
+    return input_file_type is not None and input_file_type.lower() in RECORD_SCANNERS
+
+def find_chunks(input_file_path, input_file_type, chunk_bytes = CHUNK_BYTES):
+    """
+    Split a file into chunks of whole records, by scanning the memory-mapped file for record boundaries.
+
+    :param input_file_path: The file to split.
+    :param input_file_type: The format of the file.
+    :param chunk_bytes: The approximate size of each chunk (chunks always contain at least one whole record).
+    :return: A list of (start, end) byte offsets of each chunk.
+    """
+    if not can_chunk(input_file_type):
+        raise ValueError("Files in the '{}' format cannot be split into chunks; supported formats are: {}".format(input_file_type, ", ".join(RECORD_SCANNERS)))
+
+    chunks = []
+    with open(input_file_path, "rb") as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            return chunks
+
+        with mmap.mmap(input_file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            chunk_start = None
+            for start, end in RECORD_SCANNERS[input_file_type.lower()](mapped):
+                chunk_start = chunk_start if chunk_start is not None else start
+
+                if end - chunk_start >= chunk_bytes:
+                    chunks.append((chunk_start, end))
+                    chunk_start = None
+
+            if chunk_start is not None:
+                chunks.append((chunk_start, end))
+
+    return chunks
+
+
+class Chunk_job():
+    """
+    The conversion of a single chunk of an input file. Only the location of the chunk is sent to the worker, which reads the chunk itself.
+    """
+
+    def __init__(self, input_file_path, start, end, *, input_file_type, output_file_type, gen3D = None, charge = None, multiplicity = None, backend = "Auto"):
+        """
+        :param input_file_path: The file the chunk belongs to.
+        :param start: The byte offset of the start of the chunk.
+        :param end: The byte offset of the end of the chunk.
+        :param input_file_type: The format of the input file.
+        :param output_file_type: The file type to convert to.
+        :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param backend: The backend to convert with.
+        """
+        self.input_file_path = str(input_file_path)
+        self.start = start
+        self.end = end
+        self.input_file_type = input_file_type
+        self.output_file_type = output_file_type
+        self.gen3D = gen3D
+        self.charge = charge
+        self.multiplicity = multiplicity
+        self.backend = backend
+
+    def read(self):
+        """
+        Read the chunk from the input file.
+        """
+        with open(self.input_file_path, "rb") as input_file, mmap.mmap(input_file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            return mapped[self.start:self.end]
+
+    def run(self):
+        """
+        Convert each of the molecules in this chunk.
+
+        :return: A list of the converted molecules, each as a string.
+        """
+        try:
+            converter = Openbabel_converter.from_file(input_file_buffer = self.read(), input_file_type = self.input_file_type, backend = self.backend)
+            return list(converter.iter_convert(self.output_file_type, gen3D = self.gen3D, charge = self.charge, multiplicity = self.multiplicity))
+
+        except Exception as e:
+            raise Exception("Failed to convert bytes {} to {} of file '{}'".format(self.start, self.end, self.input_file_path)) from e
+
+
+def run_chunk(job):
+    """
+    Convert a chunk; the entry point used by worker processes.
+    """
+    return job.run()
+
+
+def iter_convert_chunked(input_file_path, output_file_type, *,
+    input_file_type = None,
+    workers = None,
+    chunk_bytes = CHUNK_BYTES,
+    backlog = 2,
+    backend = "Auto",
+    gen3D = None,
+    charge = None,
+    multiplicity = None
+):
+    """
+    Convert each of the molecules in a large multi-structure file, with chunks of the file converted in parallel by a pool of worker processes.
+
+    The file is memory-mapped and split into chunks of whole records (by scanning for record boundaries, without parsing),
+    so only the chunks currently being converted are held in memory. Supported input formats are xyz (including multi-frame trajectories), sdf and smi.
+    Because each chunk is converted from memory, molecules without a title are not given the name of the file as their title (as openbabel otherwise does).
+
+    :param input_file_path: The file to convert.
+    :param output_file_type: The file type to convert to.
+    :param input_file_type: The format of the input file. If not given, this is determined from the file name.
+    :param workers: The number of worker processes to use. If None, one per CPU is used. If 1, chunks are converted in the current process.
+    :param chunk_bytes: The approximate size of each chunk.
+    :param backlog: The number of chunks per worker to submit ahead of the chunk currently being waited on.
+    :param backend: The backend each worker converts with.
+    :param gen3D: If True and a loaded molecule does not have 3D coordinates, these will be generated (this will scramble atom coordinates).
+    :param charge: Optional charge of the output format.
+    :param multiplicity: Optional multiplicity of the output format.
+    :return: An iterator of the converted molecules, each as a string, in the same order as the input file.
+    """
+    input_file_type = input_file_type if input_file_type is not None else Openbabel_converter.type_from_file_name(input_file_path)
+    workers = workers if workers is not None else os.cpu_count() or 1
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    jobs = (
+        Chunk_job(
+            input_file_path,
+            start,
+            end,
+            input_file_type = input_file_type,
+            output_file_type = output_file_type,
+            gen3D = gen3D,
+            charge = charge,
+            multiplicity = multiplicity,
+            backend = backend
+        ) for start, end in find_chunks(input_file_path, input_file_type, chunk_bytes)
+    )
+
+    if workers == 1:
+        for job in jobs:
+            yield from job.run()
+
+        return
+
+    # Imported here because it's relatively slow to load.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers) as executor:
+        # Keep a limited number of chunks in flight, collecting their results in order.
+        pending = deque(executor.submit(run_chunk, job) for job in itertools.islice(jobs, workers * backlog))
+
+        while len(pending) > 0:
+            molecules = pending.popleft().result()
+
+            for job in itertools.islice(jobs, 1):
+                pending.append(executor.submit(run_chunk, job))
+
+            yield from molecules
+
+def split_file_name(output_file, number):
+    """
+    Get the name of one of the numbered files written when splitting the output, in the same style as obabel -m (Molecules.xyz becomes Molecules1.xyz, Molecules2.xyz etc).
+    """
+    output_file = Path(output_file)
+    return output_file.with_name("{}{}{}".format(output_file.stem, number, output_file.suffix))
+
+def convert_chunked(input_file_path, output_file, *, output_file_type = None, split = False, **kwargs):
+    """
+    Convert each of the molecules in a large multi-structure file in parallel, writing them to a single file or to one file each.
+
+    See iter_convert_chunked() for the full list of options.
+
+    :param input_file_path: The file to convert.
+    :param output_file: The file to write to. If split is True, this is the template for the name of each file (see split_file_name()).
+    :param output_file_type: The file type to convert to. If not given, this is determined from output_file.
+    :param split: Whether to write each molecule to its own file, numbered from 1, rather than to a single file.
+    :return: The number of molecules written.
+    """
+    output_file_type = output_file_type if output_file_type else Openbabel_converter.type_from_file_name(output_file)
+    molecules = iter_convert_chunked(input_file_path, output_file_type, **kwargs)
+
+    count = 0
+    if split:
+        for count, molecule in enumerate(molecules, 1):
+            split_file_name(output_file, count).write_text(molecule)
+
+    else:
+        with open(output_file, "w") as output:
+            for count, molecule in enumerate(molecules, 1):
+                output.write(molecule)
+
+    return count
@@ -1,13 +1,16 @@
 """Setup logging for oprattle."""
 
-import warnings
-import logging.handlers
+import logging
 import sys
-import textwrap
-from subprocess import CalledProcessError
+import copy
+import contextlib
+import contextvars
 
 LOGGING_HANDLER = None
 
+# The (index, input name) of the job being converted by the current worker process, used to tag its log records.
+CURRENT_JOB = contextvars.ContextVar("CURRENT_JOB", default = None)
+
 def filter_kekulize(record):
     return not "Failed to kekulize aromatic bonds" in record.getMessage()
 
@@ -21,9 +24,6 @@ def init_logger(json = False):
     
     logging.captureWarnings(True)
     
-    logger = logging.getLogger("openprattle")
-    warnings_logger = logging.getLogger("py.warnings")
-    
     # Choose our handler.
     LOGGING_HANDLER = logging.StreamHandler(sys.stderr)
         
@@ -38,10 +38,38 @@ def init_logger(json = False):
         formatter = JSON_formatter()
 
     LOGGING_HANDLER.setFormatter(formatter)
+    
+    install_handler(LOGGING_HANDLER)
 
+def init_worker_logger(log_queue):
+    """
+    Init the package wide logger of a worker process, so that log records are sent to a Log_listener in the parent process rather than written directly.
+    
+    Records logged while a job is being converted (see job_context()) are tagged with the job and the name of its input file.
+    
+    :param log_queue: The queue of the Log_listener to send records to.
+    """
+    global LOGGING_HANDLER
+    
+    logging.captureWarnings(True)
+    
+    LOGGING_HANDLER = Queue_handler(log_queue)
+    LOGGING_HANDLER.setLevel(logging.DEBUG)
+    LOGGING_HANDLER.addFilter(Job_filter())
+    
+    install_handler(LOGGING_HANDLER)
+
+def install_handler(handler):
+    """
+    Make a handler the only handler of the package wide logger (and of warnings).
+    """
+    logger = logging.getLogger("openprattle")
+    warnings_logger = logging.getLogger("py.warnings")
+    
     # Setup filters.
     # TODO: This should be optional.
-    logger.addFilter(filter_kekulize)
+    if filter_kekulize not in logger.filters:
+        logger.addFilter(filter_kekulize)
     
     # Remove old handlers.
     loggers = (logger, warnings_logger)
@@ -49,7 +77,17 @@ def init_logger(json = False):
         while len(log.handlers) > 0:
             log.removeHandler(log.handlers[0])
             
-        log.addHandler(LOGGING_HANDLER)
+        log.addHandler(handler)
+    
+    
+def ensure_logger():
+    """
+    Init the package wide logger with default options, unless it has already been setup.
+    
+    Logging is setup lazily (rather than on import) so that importing openprattle remains fast.
+    """
+    if LOGGING_HANDLER is None:
+        init_logger()
     
     
 class JSON_formatter(logging.Formatter):
@@ -59,11 +97,193 @@ class JSON_formatter(logging.Formatter):
 
     def format(self, record):
         import json
-        return json.dumps({
+        message = {
             'logger': record.name,
             'levelno': record.levelno,
             'message': record.getMessage(),
-            'exception': self.formatException(record.exc_info) if record.exc_info else ""
-        })
+            'exception': self.formatException(record.exc_info) if record.exc_info else getattr(record, "exc_text", None) or ""
+        }
+        
+        # Records from worker processes are tagged with the job they belong to (see Job_filter).
+        if getattr(record, "job", None) is not None:
+            message['job'] = record.job
+        
+        if getattr(record, "input_name", None) is not None:
+            message['input_name'] = record.input_name
+        
+        # Exceptions that describe why a conversion failed (such as Conversion_timeout) have a short reason, which can also be given explicitly.
+        reason = getattr(record, "reason", None)
+        if reason is None and record.exc_info:
+            reason = getattr(record.exc_info[1], "reason", None)
+        
+        if reason is not None:
+            message['reason'] = reason
+        
+        # Conversion profiles (see Profile_hook) are included as structured data.
+        if hasattr(record, "profile"):
+            message['profile'] = record.profile
+        
+        return json.dumps(message)
+    
+    
+@contextlib.contextmanager
+def job_context(index, input_name):
+    """
+    A context manager that tags the log records of the current process (when sent to a Log_listener) with a job.
+    
+    :param index: The position of the job in its batch.
+    :param input_name: The name of the job's input file.
+    """
+    token = CURRENT_JOB.set((index, input_name))
+    try:
+        yield
+    
+    finally:
+        CURRENT_JOB.reset(token)
+
+
+class Job_filter(logging.Filter):
+    """
+    A logging filter that tags each record with the job currently being converted (see job_context()).
+    
+    Records that already name their input file (such as the openbabel messages reported by ObErrorLog_wrapper) keep that name.
+    """
+    
+    def filter(self, record):
+        job = CURRENT_JOB.get()
+        if job is not None:
+            record.job = job[0]
+            if getattr(record, "input_name", None) is None:
+                record.input_name = job[1]
+        
+        return True
+
+
+class Queue_handler(logging.Handler):
+    """
+    A logging handler that sends records to a queue (without blocking), to be written by a Log_listener in another process.
+    """
+    
+    def __init__(self, log_queue):
+        """
+        :param log_queue: The queue to send records to.
+        """
+        super().__init__()
+        self.queue = log_queue
+    
+    def prepare(self, record):
+        """
+        Get a copy of a record that can be sent to another process.
+        
+        Arguments are merged into the message and exceptions are formatted (because neither can necessarily be pickled),
+        but the exception's reason (see JSON_formatter) is kept.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        
+        if record.exc_info:
+            if getattr(record, "reason", None) is None:
+                record.reason = getattr(record.exc_info[1], "reason", None)
+            
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        
+        return record
+    
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        
+        except Exception:
+            self.handleError(record)
+
+
+class Log_listener():
+    """
+    Writes the log records of worker processes (which use init_worker_logger()) from a single background thread in this process.
+    
+    Workers only put records on a queue, so logging never blocks their conversions, and each record is written whole
+    by one handler, so output from different workers does not interleave:
+    
+        with Log_listener() as listener:
+            # In each worker process:
+            init_worker_logger(listener.queue)
+    """
+    
+    def __init__(self, handler = None, *, context = None):
+        """
+        :param handler: The handler to write records with. If not given, the package wide handler of this process is used (which writes JSON if init_logger() was called with json = True).
+        :param context: Optional multiprocessing context (or start method name) to create the queue with.
+        """
+        # Imported here because they're relatively slow to load.
+        import multiprocessing
+        import logging.handlers
+        
+        ensure_logger()
+        context = multiprocessing.get_context(context) if not isinstance(context, multiprocessing.context.BaseContext) else context
+        
+        self.queue = context.Queue()
+        self.listener = logging.handlers.QueueListener(self.queue, handler if handler is not None else LOGGING_HANDLER, respect_handler_level = True)
+        self.listener.start()
+        self.closed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+    
+    def close(self):
+        """
+        Write any remaining records and stop listening.
+        """
+        if not self.closed:
+            self.closed = True
+            self.listener.stop()
+            self.queue.close()
+            self.queue.join_thread()
+
+
+class Profile_hook():
+    """
+    A converter hook that records the time taken by each stage of a conversion, so it can be logged.
+    
+    Pass an instance as one of a converter's hooks, and then call emit() once the conversion is done:
+    
+        profile = Profile_hook()
+        converter = Openbabel_converter.from_file(input_file_path = "Benzene.cml", hooks = [profile])
+        converter.convert("xyz")
+        profile.emit()
+    """
+    
+    def __init__(self):
+        self.stages = []
+    
+    def __call__(self, converter, stage, duration, details):
+        self.stages.append(dict(details, stage = stage, duration = duration))
+    
+    def report(self):
+        """
+        Get the recorded stages.
+        
+        :return: A dictionary with the total time of each stage (in seconds), and the list of stages in the order they finished.
+        """
+        totals = {}
+        for stage in self.stages:
+            totals[stage['stage']] = totals.get(stage['stage'], 0) + stage['duration']
+        
+        return {"totals": totals, "stages": self.stages}
+    
+    def emit(self, logger = "openprattle.profile"):
+        """
+        Log the recorded stages (at INFO level), and then forget them.
+        
+        The full report is attached to the log record, and is included by JSON_formatter.
+        
+        :param logger: The name of the logger to use.
+        """
+        report = self.report()
+        logging.getLogger(logger).info("Conversion profile: {}".format(", ".join("{} {:.2f} ms".format(stage, duration * 1000) for stage, duration in report['totals'].items())), extra = {"profile": report})
+        self.stages = []
     
-init_logger()
\ No newline at end of file
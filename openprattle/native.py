@@ -0,0 +1,354 @@
+"""A pure-python converter for simple, coordinate-only formats, which avoids the cost of openbabel altogether."""
+
+import io
+import itertools
+import logging
+from pathlib import Path
+
+from openprattle.babel import Openbabel_converter
+
+
+# Element symbols, indexed by atomic number (as written by openbabel).
+ELEMENTS = (
+    "*",
+    "H", "He",
+    "Li", "Be", "B", "C", "N", "O", "F", "Ne",
+    "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar",
+    "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr",
+    "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe",
+    "Cs", "Ba",
+    "La", "Ce", "Pr", "Nd", "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu",
+    "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn",
+    "Fr", "Ra",
+    "Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr",
+    "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og"
+)
+
+SYMBOLS = frozenset(ELEMENTS[1:])
+
+# The size of a bohr (in angstrom), as used by openbabel's tmol format.
+BOHR = 0.5291772108
+
+
+class Unsupported_input(Exception):
+    """
+    Raised when an input file is not in the strict subset of a format that the native converter reads; openbabel is used instead.
+    """
+
+
+class Native_molecule():
+    """
+    A molecule as read by the native converter: a title, and the element and cartesian coordinates (in angstrom) of each atom.
+    """
+
+    __slots__ = ("title", "symbols", "coordinates")
+
+    def __init__(self, title, symbols, coordinates):
+        """
+        :param title: The title of the molecule.
+        :param symbols: A list of the element symbol of each atom.
+        :param coordinates: A list of the (x, y, z) coordinates of each atom.
+        """
+        self.title = title
+        self.symbols = symbols
+        self.coordinates = coordinates
+
+
+def xyz_symbol(symbol):
+    """
+    Get the element symbol of an atom in an xyz file, which can also be given as an atomic number.
+    """
+    if symbol in SYMBOLS:
+        return symbol
+
+    elif symbol.isdigit() and 0 < int(symbol) < len(ELEMENTS):
+        return ELEMENTS[int(symbol)]
+
+    else:
+        raise Unsupported_input("Unrecognised element '{}'".format(symbol))
+
+def read_xyz(lines, title = ""):
+    """
+    Read each of the molecules (frames) in an xyz file.
+
+    :param lines: An iterator of the lines of the file.
+    :param title: The title given to molecules with a blank comment line (openbabel uses the file name).
+    :return: An iterator of Native_molecule objects.
+    """
+    for line in lines:
+        if line.strip() == "":
+            # Trailing blank lines at the end of the file.
+            continue
+
+        try:
+            count = int(line)
+            comment = next(lines).strip()
+            atoms = [next(lines).split() for index in range(count)]
+            symbols = [xyz_symbol(atom[0]) for atom in atoms]
+            coordinates = [(float(atom[1]), float(atom[2]), float(atom[3])) for atom in atoms]
+
+        except (ValueError, IndexError, StopIteration) as e:
+            raise Unsupported_input("Malformed xyz file") from e
+
+        if count < 1:
+            raise Unsupported_input("xyz frame has no atoms")
+
+        yield Native_molecule(comment if comment != "" else title, symbols, coordinates)
+
+def read_tmol(lines, title = ""):
+    """
+    Read the molecule in a turbomole coord file.
+
+    Only files that consist of a $coord group alone (in bohr) are supported.
+
+    :param lines: An iterator of the lines of the file.
+    :param title: Ignored; turbomole files do not have a title.
+    :return: An iterator of Native_molecule objects.
+    """
+    lines = (line for line in lines if line.strip() != "")
+
+    if next(lines, "").strip() != "$coord":
+        raise Unsupported_input("Turbomole file does not start with a $coord group")
+
+    symbols = []
+    coordinates = []
+    for line in lines:
+        if line.startswith("$"):
+            break
+
+        try:
+            x, y, z, symbol = line.split()
+            coordinates.append((float(x) * BOHR, float(y) * BOHR, float(z) * BOHR))
+
+        except ValueError as e:
+            raise Unsupported_input("Malformed turbomole file") from e
+
+        symbol = symbol.capitalize()
+        if symbol not in SYMBOLS:
+            raise Unsupported_input("Unrecognised element '{}'".format(symbol))
+
+        symbols.append(symbol)
+
+    else:
+        raise Unsupported_input("Turbomole $coord group is not terminated")
+
+    if line.strip() != "$end" or next(lines, None) is not None or len(symbols) == 0:
+        # Other groups could change the meaning of the coordinates.
+        raise Unsupported_input("Turbomole file contains more than a $coord group")
+
+    yield Native_molecule("", symbols, coordinates)
+
+
+def write_xyz(molecule, charge = None, multiplicity = None):
+    """
+    Write a molecule in the xyz format.
+    """
+    return "{}\n{}\n".format(len(molecule.symbols), molecule.title) + "".join([
+        "%-3s%15.5f%15.5f%15.5f\n" % (symbol, x, y, z) for symbol, (x, y, z) in zip(molecule.symbols, molecule.coordinates)
+    ])
+
+def write_tmol(molecule, charge = None, multiplicity = None):
+    """
+    Write a molecule in the turbomole coord format.
+    """
+    return "$coord\n" + "".join([
+        "%20.14f  %20.14f  %20.14f      %s\n" % (x / BOHR, y / BOHR, z / BOHR, symbol.lower()) for symbol, (x, y, z) in zip(molecule.symbols, molecule.coordinates)
+    ]) + "$end\n"
+
+def write_gaussian(molecule, charge, multiplicity):
+    """
+    Write a molecule as the geometry of a gaussian input file.
+    """
+    return "!Put Keywords Here, check Charge and Multiplicity.\n#\n\n {}\n\n{}  {}\n".format(molecule.title, charge, multiplicity) + "".join([
+        "%-3s      %10.5f      %10.5f      %10.5f\n" % (symbol, x, y, z) for symbol, (x, y, z) in zip(molecule.symbols, molecule.coordinates)
+    ]) + "\n"
+
+
+READERS = {
+    "xyz": read_xyz,
+    "tmol": read_tmol,
+}
+
+WRITERS = {
+    "xyz": write_xyz,
+    "tmol": write_tmol,
+    "com": write_gaussian,
+    "gau": write_gaussian,
+    "gjc": write_gaussian,
+    "gjf": write_gaussian,
+}
+
+# Writers that need the charge and multiplicity of the molecule, which openbabel would otherwise perceive from its bonding.
+NEEDS_CHARGE = ("com", "gau", "gjc", "gjf")
+
+
+class Native_converter(Openbabel_converter):
+    """
+    A converter for simple coordinate-only formats (xyz and turbomole coord files, written as xyz, turbomole or gaussian input) that is implemented in python.
+
+    No bonds are perceived, so these conversions are much faster than with openbabel, especially for large multi-frame trajectories.
+    Conversions that need openbabel (generating 3D coordinates, other formats, gaussian input without an explicit charge and multiplicity,
+    or input files that are not in the strict subset of each format that we read) are passed to the backend that would otherwise have been used.
+    """
+
+    BACKEND = "Native"
+
+    @classmethod
+    def version(self):
+        """
+        Get the version of openbabel used by this class (for conversions it can't perform itself).
+        """
+        return Openbabel_converter.get_cls(None).version()
+
+    @classmethod
+    def supports(self, input_file_type, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Determine whether a conversion can be performed natively.
+
+        :param input_file_type: The format to convert from.
+        :param output_file_type: The format to convert to.
+        :param gen3D: Whether 3D coordinates are to be generated (the formats we read are always 3D, so None means no).
+        :param charge: The charge of the output format.
+        :param multiplicity: The multiplicity of the output format.
+        """
+        output_file_type = output_file_type.lower() if output_file_type else ""
+
+        return str(input_file_type).lower() in READERS and \
+            output_file_type in WRITERS and \
+            not gen3D and \
+            (output_file_type not in NEEDS_CHARGE or (charge is not None and multiplicity is not None))
+
+    def fallback(self):
+        """
+        Get a converter of the backend that would otherwise have been used, which wraps the same input file as this one.
+        """
+        return Openbabel_converter.get_cls(self.input_file_type)(
+            input_file = self.input_file if self.input_file_buffer is None else None,
+            input_file_buffer = self.input_file_buffer,
+            input_file_path = self.input_file_path,
+            input_file_type = self.input_file_type,
+            hooks = self.hooks,
+            geometry_cache = self.geometry_cache,
+            seed = self.seed
+        )
+
+    def read_lines(self):
+        """
+        Get the lines of the input file wrapped by this class.
+
+        :return: A context manager, which yields an iterator of lines.
+        """
+        if self.input_file is not None and self.input_file_buffer is None:
+            # We may need to read the input again (if we have to fall back to openbabel).
+            self.input_file_buffer = self.input_file.read()
+
+        if self.input_file_buffer is not None:
+            buffer = self.input_file_buffer
+            buffer = str(buffer, "utf-8") if isinstance(buffer, (bytes, bytearray, memoryview)) else str(buffer)
+            return io.StringIO(buffer)
+
+        else:
+            return open(self.input_file_path)
+
+    def read_molecules(self):
+        """
+        Read each of the molecules in the input file wrapped by this class.
+
+        :return: An iterator of Native_molecule objects.
+        """
+        # Like openbabel, molecules read from a file without a title take the file name instead.
+        title = str(self.input_file_path) if self.input_file is None and self.input_file_buffer is None else ""
+
+        with self.read_lines() as lines:
+            yield from READERS[self.input_file_type.lower()](iter(lines), title)
+
+    def _convert(self, output_file_type, output_file = None, *, gen3D = None, charge = None, multiplicity = None, output_stream = None):
+        """
+        Convert the input file wrapped by this class to the designated output_file_type.
+
+        :param output_file_type: The file type to convert to.
+        :param output_file: Optional file name to write to. If not given, the converted file will be returned as a string.
+        :param gen3D: If True, the conversion is performed by openbabel instead.
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :param output_stream: Ignored; the converted file is returned for the caller to write.
+        :return: The converted file, or None if output_file is not None.
+        """
+        if not self.supports(self.input_file_type, output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity):
+            return self.fallback()._convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, output_stream = output_stream)
+
+        try:
+            with self.stage("read"):
+                molecules = self.read_molecules()
+                molecule = next(molecules, None)
+                molecules.close()
+
+        except Unsupported_input:
+            logging.getLogger("openprattle").debug("Could not natively read file '{}'; using openbabel instead".format(self.input_name), exc_info = True)
+            return self.fallback()._convert(output_file_type, output_file, gen3D = gen3D, charge = charge, multiplicity = multiplicity, output_stream = output_stream)
+
+        if molecule is None:
+            raise ValueError("Cannot read file '{}'; file does not contain any molecules".format(self.input_name))
+
+        with self.stage("write"):
+            output = WRITERS[output_file_type.lower()](molecule, charge, multiplicity)
+
+            if output_file is not None:
+                Path(output_file).write_text(output)
+                return None
+
+            return output
+
+    def _convert_multi(self, outputs, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert the input file wrapped by this class to several formats at once.
+
+        If any of the formats can't be written natively, openbabel performs the whole conversion (so the input is only read once).
+
+        :param outputs: A dictionary of the file types to convert to, each mapped to the name of the file to write to (or None to return the converted file).
+        :param gen3D: If True, the conversion is performed by openbabel instead.
+        :param charge: Optional charge of the output formats.
+        :param multiplicity: Optional multiplicity of the output formats.
+        :return: A dictionary of each file type to the converted file (or None if it was written to a file).
+        """
+        if not all(self.supports(self.input_file_type, output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity) for output_file_type in outputs):
+            return self.fallback()._convert_multi(outputs, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+
+        return super()._convert_multi(outputs, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+
+    def to_arrays(self, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Get the arrays describing the first molecule in the input file wrapped by this class.
+
+        Bonds are needed, so the molecule is read by openbabel.
+        """
+        return self.fallback().to_arrays(gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+
+    def iter_convert(self, output_file_type, *, gen3D = None, charge = None, multiplicity = None):
+        """
+        Convert each of the molecules in the input file wrapped by this class to the designated output_file_type.
+
+        Molecules are read, converted and yielded one at a time. If a molecule cannot be read natively, the remainder of the file is converted by openbabel.
+
+        :param output_file_type: The file type to convert to.
+        :param gen3D: If True, the conversion is performed by openbabel instead.
+        :param charge: Optional charge of the output format.
+        :param multiplicity: Optional multiplicity of the output format.
+        :return: An iterator of converted molecules, each as a string.
+        """
+        if not self.supports(self.input_file_type, output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity):
+            yield from self.fallback().iter_convert(output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity)
+            return
+
+        writer = WRITERS[output_file_type.lower()]
+        converted = 0
+        try:
+            for molecule in self.read_molecules():
+                yield writer(molecule, charge, multiplicity)
+                converted += 1
+
+        except Unsupported_input:
+            logging.getLogger("openprattle").debug("Could not natively read molecule {} of file '{}'; using openbabel instead".format(converted +1, self.input_name), exc_info = True)
+
+            # Openbabel has to start from the beginning, so skip the molecules we've already converted.
+            yield from itertools.islice(self.fallback().iter_convert(output_file_type, gen3D = gen3D, charge = charge, multiplicity = multiplicity), converted, None)
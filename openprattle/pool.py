@@ -0,0 +1,331 @@
+"""A persistent pool of pre-warmed worker processes."""
+
+import os
+import queue
+import threading
+import multiprocessing
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from openprattle.babel import Obabel_converter, Conversion_timeout, HAVE_PYBEL, FOUND_PYBEL
+from openprattle.batch import Conversion_job, Conversion_result, run_job, failed_result, ordered_results
+from openprattle.log import Log_listener, init_worker_logger
+
+if FOUND_PYBEL:
+    from openprattle.babel import pybel
+
+
+def warm_up():
+    """
+    Load the openbabel plugins (formats, force-fields etc) into the current process.
+    """
+    if HAVE_PYBEL:
+        # Listing the available formats and force-fields forces openbabel to load all of its plugins.
+        pybel.informats
+        pybel.outformats
+        pybel.forcefields
+
+        # Obabel conversions can now be performed without starting a new process.
+        Obabel_converter.in_process = True
+
+
+def worker_main(connection, warm = True, log_queue = None, ready = False):
+    """
+    Entry point for each worker process.
+
+    Workers receive (index, Conversion_job) pairs over their connection and send back Conversion_result objects,
+    until None is received.
+
+    :param connection: The worker's end of a multiprocessing Pipe.
+    :param warm: Whether to load the openbabel plugins before receiving the first job.
+    :param log_queue: Optional queue of a Log_listener to send log records to.
+    :param ready: Whether to send None over the connection once the worker has started.
+    """
+    if log_queue is not None:
+        init_worker_logger(log_queue)
+
+    if warm:
+        warm_up()
+
+    if ready:
+        connection.send(None)
+
+    while True:
+        try:
+            request = connection.recv()
+
+        except EOFError:
+            # Our parent has gone away.
+            return
+
+        if request is None:
+            return
+
+        connection.send(run_job(*request))
+
+
+class Worker():
+    """
+    A single worker process, and the connection used to talk to it.
+    """
+
+    def __init__(self, context, warm = True, log_queue = None, wait = False):
+        """
+        Start a new worker process.
+
+        :param context: The multiprocessing context to start the worker with.
+        :param warm: Whether the worker should load the openbabel plugins when it starts (see warm_up()).
+        :param log_queue: Optional queue of a Log_listener for the worker to send log records to.
+        :param wait: Whether to wait until the worker has started before returning.
+        :raises EOFError: If wait is True and the worker died while starting.
+        """
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target = worker_main, args = (child_connection, warm, log_queue, wait), daemon = True)
+        self.process.start()
+        # We don't need the child's end of the pipe in this process.
+        child_connection.close()
+
+        if wait:
+            self.connection.recv()
+
+    def run(self, index, job, timeout = None):
+        """
+        Run a job in this worker.
+
+        :param timeout: Optional time (in seconds) to wait for the result. If the job takes longer, the worker is left running it (so should be killed).
+        :raises EOFError: If the worker died before returning a result.
+        :raises Conversion_timeout: If the job did not finish in time.
+        """
+        self.connection.send((index, job))
+        if timeout is not None and not self.connection.poll(timeout):
+            raise Conversion_timeout("Conversion of file '{}' did not finish within {} s, so was killed".format(job.input_name, timeout), timeout)
+
+        return self.connection.recv()
+
+    def close(self, timeout = 5):
+        """
+        Ask this worker to stop, killing it if it does not do so in time.
+        """
+        try:
+            self.connection.send(None)
+
+        except (OSError, ValueError):
+            # The worker is already dead.
+            pass
+
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.connection.close()
+
+
+def worker_context(context = None):
+    """
+    Get the multiprocessing context to start worker processes with.
+
+    By default, workers are started with the 'forkserver' method (or 'spawn' where that isn't available), never 'fork':
+    workers are started from processes that have other threads, and a forked worker could inherit a lock that one of them held (and so deadlock).
+
+    :param context: Optional multiprocessing context (or start method name) to use instead.
+    """
+    if context is None:
+        context = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+    return multiprocessing.get_context(context) if not isinstance(context, multiprocessing.context.BaseContext) else context
+
+
+def run_with_timeout(job, timeout, *, context = None):
+    """
+    Run a job in a new child process, killing the child if the job takes longer than timeout.
+
+    The time limit does not include starting the child.
+
+    :param job: The Conversion_job to run.
+    :param timeout: The time limit (in seconds).
+    :param context: Optional multiprocessing context (or start method name) to start the child with (see worker_context()).
+    :raises Conversion_timeout: If the job did not finish in time.
+    :return: The converted file, or None if the job's output_file is not None.
+    """
+    context = worker_context(context)
+
+    # The child doesn't inherit our logging configuration, so its messages are sent back to be written here.
+    with Log_listener(context = context) as listener:
+        try:
+            # Loading all the openbabel plugins isn't worth it for a single job.
+            worker = Worker(context, warm = False, log_queue = listener.queue, wait = True)
+
+        except EOFError as e:
+            raise Exception("Child process died while starting to convert file '{}'".format(job.input_name)) from e
+
+        try:
+            result = worker.run(0, job, timeout)
+
+        except EOFError as e:
+            raise Exception("Child process died while converting file '{}'".format(job.input_name)) from e
+
+        finally:
+            worker.close(0)
+
+    if not result.success:
+        raise result.error
+
+    return result.output
+
+
+class Worker_pool():
+    """
+    A pool of long-lived worker processes that perform conversions.
+
+    Each worker loads the openbabel libraries and plugins once when it starts, so conversions performed by the pool do
+    not pay the start-up cost of a new obabel process each time. When the pybel bindings are available, workers
+    perform Obabel conversions with the openbabel library directly, using the same options as the obabel command.
+
+    Workers that die (for example, because openbabel crashed) are automatically replaced. Messages logged by the
+    workers (such as openbabel warnings) are sent to this process and written by a single Log_listener, tagged with their job.
+
+    The pool can be used with any converter object by passing it as the 'pool' argument, in which case calls to convert()
+    will be performed by one of the pool's workers:
+
+        with Worker_pool(4) as pool:
+            converter = Openbabel_converter.from_file(input_file_path = "Benzene.cml", pool = pool)
+            converter.convert("xyz")
+    """
+
+    def __init__(self, workers = None, *, context = None):
+        """
+        :param workers: The number of worker processes to start. If None, one per CPU is used.
+        :param context: Optional multiprocessing context (or start method name) to start workers with (see worker_context()).
+        """
+        self.size = workers if workers is not None else os.cpu_count() or 1
+        if self.size < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.context = worker_context(context)
+        self.workers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.log_listener = Log_listener(context = self.context)
+
+        for index in range(self.size):
+            worker = Worker(self.context, log_queue = self.log_listener.queue)
+            self.workers.append(worker)
+            self.idle.put(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def replace(self, worker, reason = None):
+        """
+        Replace a dead (or stuck) worker with a new one.
+
+        :param reason: Optional description of why the worker is being replaced.
+        :return: The new worker.
+        """
+        reason = reason if reason is not None else "died (exit code {})".format(worker.process.exitcode)
+        logging.getLogger("openprattle").warning("Worker process {} {}; starting a new worker".format(worker.process.pid, reason))
+        worker.close(0)
+
+        new_worker = Worker(self.context, log_queue = self.log_listener.queue)
+        with self.lock:
+            self.workers[self.workers.index(worker)] = new_worker
+
+        return new_worker
+
+    def run(self, job, index = 0, *, timeout = None):
+        """
+        Run a job with the next available worker, waiting for one to become free if necessary.
+
+        Errors raised by the job are captured in the returned result.
+
+        If the job has a timeout, each attempt at the conversion is sent to a worker in turn (from the current thread),
+        with workers that run out of time killed and replaced.
+
+        :param job: The Conversion_job (or dictionary of its arguments) to run.
+        :param index: The position of the job in its batch.
+        :param timeout: Optional time limit (in seconds) for the job. If it takes longer, the worker is killed (and replaced) and Conversion_timeout is raised.
+        :return: A Conversion_result object.
+        """
+        if self.closed:
+            raise ValueError("Worker_pool is closed")
+
+        job = Conversion_job.from_dict(job)
+
+        if job.timeout is not None:
+            # Workers can't stop themselves, so the timeout (and any retries) are handled here.
+            try:
+                return Conversion_result(job, index, output = job.run(pool = self))
+
+            except Exception as e:
+                return failed_result(index, job, e)
+
+        worker = self.idle.get()
+
+        try:
+            if not worker.process.is_alive():
+                worker = self.replace(worker)
+
+            try:
+                return worker.run(index, job, timeout)
+
+            except Conversion_timeout:
+                worker = self.replace(worker, "timed out after {} s".format(timeout))
+                raise
+
+            except (EOFError, OSError) as e:
+                worker = self.replace(worker)
+                raise Exception("Worker process died while converting file '{}'".format(job.input_name)) from e
+
+        finally:
+            self.idle.put(worker)
+
+    def convert(self, job, *, timeout = None):
+        """
+        Perform a single conversion with the next available worker.
+
+        :param job: The Conversion_job (or dictionary of its arguments) to run.
+        :param timeout: Optional time limit (in seconds) for the conversion (see run()).
+        :return: The converted file, or None if the job's output_file is not None.
+        """
+        result = self.run(job, timeout = timeout)
+
+        if not result.success:
+            raise result.error
+
+        return result.output
+
+    def convert_many(self, jobs, *, backlog = 4):
+        """
+        Convert many files with the workers of this pool.
+
+        Errors raised by individual jobs do not abort the batch; they are instead reported in the corresponding Conversion_result.
+
+        :param jobs: An iterable of jobs to convert. Each job can be either a Conversion_job object or a dictionary of arguments to its constructor.
+        :param backlog: The number of jobs per worker to submit ahead of the result currently being waited on.
+        :return: An iterator of Conversion_result objects, in the same order as jobs.
+        """
+        def run(index, job):
+            try:
+                return self.run(job, index)
+
+            except Exception as e:
+                return failed_result(index, job, e)
+
+        with ThreadPoolExecutor(self.size) as executor:
+            yield from ordered_results(executor, run, jobs, self.size * backlog)
+
+    def close(self):
+        """
+        Stop all the workers in this pool.
+        """
+        self.closed = True
+        with self.lock:
+            for worker in self.workers:
+                worker.close()
+
+        self.log_listener.close()
@@ -1,41 +1,64 @@
 import sys
 import argparse
 import logging
+import glob
+from pathlib import Path
 
 import openprattle
 from openprattle import Openbabel_converter, HAVE_PYBEL, formats
+from openprattle.babel import TIMEOUT_STRATEGIES
 import openprattle.log
+from openprattle.cache import Geometry_cache, cache_dir
+from openprattle.chunked import can_chunk, iter_convert_chunked, split_file_name
 
 def main():
     """
     Main entry point for the program.
     """
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from openprattle.server import serve_main
+        return serve_main(sys.argv[2:])
+    
     # Get our args from the command line.
     parser = argparse.ArgumentParser(
 #        description = DESCRIPTION,
 #        epilog = EPILOG
     )
     
-    parser.add_argument("input_file", help = "Input file to read and convert from. If not given, the file will be read from stdin. ", nargs = "?", default = "-")
+    parser.add_argument("input_file", help = "Input file to read and convert from. If not given, the file will be read from stdin. If more than one file (or a glob pattern) is given, each file is converted in turn (see --output-dir)", nargs = "*")
     parser.add_argument("-i", "--input_format", help = "Input format. If not given, the input format is assumed based on the input file extension.")
-    parser.add_argument("-o", "--output_format", help = "Output format. If not given, the input format is assumed based on the output file extension.")
+    parser.add_argument("-o", "--output_format", help = "Output format. If not given, the input format is assumed based on the output file extension. Several formats can be given, separated by commas (eg, xyz,cml,png), in which case the input is read once and written in each format, to the output file (or, if not given, the input file) with the extension of each format")
     parser.add_argument("-O", "--output_file", help = "Output file to write to. If not given, the file will be written to stdout.", default = "-")
     parser.add_argument("-C", "--charge", help = "The molecular charge to set in the output format. Note that not all formats support a charge.", default = None, type = int)
     parser.add_argument("-M", "--multiplicity", help = "The multiplicity to set in the output format. Note that not all formats support a multiplicity", default = None, type = int)
     parser.add_argument("--gen3D", help = "Whether to optimise the input coordinates via a rapid force-field optimisation. This option is useful for converting 1D or 2D formats to 3D. The default (Auto) is to only optimise coordinates that are not already in 3 dimensions.", choices = ["True", "Auto", "False"])
-    parser.add_argument("--backend", help = "Force the user of a particular backend", choices = ["Auto", "Pybel", "Obabel"])
+    parser.add_argument("--seed", help = "Seed for the random number generator used when generating 3D coordinates, so the same input always gives the same coordinates", type = int)
+    parser.add_argument("--geometry-cache", help = "Store generated 3D coordinates in (and retrieve them from) a cache in the openprattle cache directory, so the same structure only has its coordinates generated once. Best combined with --seed. Only used when converting a single file in this process", action = "store_true")
+    parser.add_argument("--backend", help = "Force the user of a particular backend. 'Adaptive' chooses whichever backend has been fastest for similar conversions in the past", choices = ["Auto", "Pybel", "Obabel", "Adaptive", "Native"])
+    parser.add_argument("--timeout", help = "Stop any conversion that takes longer than this many seconds (killing the process performing it). With --json, the error is reported with the reason 'timeout'", type = float)
+    parser.add_argument("--on-timeout", help = "How to retry a conversion that timed out, tried in the order given: 'other_backend' retries with the other openbabel backend, 'without_gen3D' retries without generating 3D coordinates", nargs = "+", choices = TIMEOUT_STRATEGIES, default = [])
+    parser.add_argument("-l", "--list", help = "A file containing a list of input files to convert (one per line)", action = "append", default = [])
+    parser.add_argument("-D", "--output-dir", help = "When converting many files, the directory to write output files to. If not given, each output file is written to the same directory as its input file")
+    parser.add_argument("-N", "--output-name", help = "When converting many files, a template for the name of each output file. The template can contain {stem} (the input file name without extension), {name} (the full input file name), {index} (the position of the input file), and {format} (the output format)", default = "{stem}.{format}")
+    parser.add_argument("-j", "--jobs", help = "When converting many files, the number of worker processes to use. With -a/--all, large xyz, sdf and smi files are instead split into chunks that are converted by this many worker processes. If 0, one per CPU is used", type = int, default = 1)
+    parser.add_argument("--server", help = "Perform the conversion with a running 'oprattle serve' server listening on this address (a Unix domain socket or HOST:PORT). If no address is given, the default socket is used. If no server is running, the conversion is performed as normal. Servers don't authenticate requests, so only use a TCP server if every user who can connect to it is trusted", nargs = "?", const = "", default = None)
+    parser.add_argument("--stdio", help = "Read conversion requests from stdin (one JSON object per line, with the same options as the server) and write a JSON response to stdout for each, until stdin is closed. Implies --json", action = "store_true")
+    parser.add_argument("-a", "--all", help = "Convert every molecule in the input file, rather than only the first. Molecules are converted and written one at a time, so this option is suitable for very large multi-structure files", action = "store_true")
+    parser.add_argument("-m", "--split", help = "With -a/--all, write each molecule to its own file, numbered from 1 (-O Molecules.xyz writes Molecules1.xyz, Molecules2.xyz etc)", action = "store_true")
     
     parser.add_argument("--bindings", help = "Determine whether the pybel bindings are available", action = "store_true")
     parser.add_argument("--readable", help = "List readable (input) formats", action = "store_true")
     parser.add_argument("--writable", help = "List writable (output) formats", action = "store_true")
+    parser.add_argument("--profile", help = "Log the time taken by each stage of the conversion. Implies JSON logging output", action = "store_true")
+    parser.add_argument("--backend-stats", help = "Print the performance statistics recorded for each backend by the Adaptive backend", action = "store_true")
     parser.add_argument("--json", help = "Dump the list of readable and/or writable formats in JSON, and dump warnings and errors in JSON", action = "store_true")
     parser.add_argument("-v", "--version", action = "version", version = str(openprattle.__version__))
 
     args = parser.parse_args()
 
     # First, setup logging.
-    if args.json:
-        openprattle.log.init_logger(True)
+    # Profiles are only useful in JSON.
+    openprattle.log.init_logger(args.json or args.profile or args.stdio)
 
     if args.bindings:
         if HAVE_PYBEL:
@@ -46,6 +69,27 @@ def main():
         
         sys.exit(0)
     
+    elif args.backend_stats:
+        from openprattle.adaptive import default_stats
+        table = default_stats().table()
+        
+        if args.json:
+            import json
+            print(json.dumps(table))
+        
+        else:
+            for key, backends in table.items():
+                for backend, entry in backends.items():
+                    print("{:60} {:8} : {:6} runs, {:6.1%} failed, {}".format(
+                        key,
+                        backend,
+                        entry['count'],
+                        entry['failure_rate'],
+                        "{:.2f} ms".format(entry['latency'] * 1000) if entry['latency'] is not None else "-"
+                    ))
+        
+        return
+    
     elif args.readable or args.writable:
         format = formats(args.backend)
 
@@ -67,16 +111,13 @@ def main():
                     print("{:10} : {}".format(key, value))
         
         return
+    
+    elif args.stdio:
+        from openprattle.server import serve_stdio
+        serve_stdio()
+        return 0
 
 
-    # First, get our converter object
-    converter = Openbabel_converter.from_file(
-        input_file_path = args.input_file if args.input_file != "-" else None,
-        input_file = sys.stdin if args.input_file == "-" else None,
-        input_file_type = args.input_format,
-        backend = args.backend
-    )
-
     # Handle gen3D.
     if args.gen3D == "True":
         gen3D = True
@@ -86,17 +127,85 @@ def main():
 
     else:
         gen3D = None
+    
+    input_files = expand_inputs(args.input_file, args.list)
+    multiple_formats = args.output_format is not None and "," in args.output_format
+    
+    if len(input_files) > 1 or args.list or args.output_dir:
+        if multiple_formats:
+            parser.error("More than one output format cannot be used when converting many files")
+        
+        elif args.output_file != "-" or args.all:
+            parser.error("-O/--output_file and -a/--all cannot be used when converting many files; use --output-dir and --output-name instead")
+        
+        if args.output_format is None and "{format}" in args.output_name:
+            parser.error("-o/--output_format is required when converting many files (unless --output-name has a fixed extension)")
+        
+        return convert_batch(input_files, args, gen3D)
+    
+    elif args.split and (not args.all or args.output_file == "-"):
+        parser.error("-m/--split requires -a/--all and -O/--output_file")
+    
+    elif args.timeout is not None and (args.all or multiple_formats):
+        parser.error("--timeout cannot be used with -a/--all or more than one output format")
+    
+    elif multiple_formats:
+        if args.all:
+            parser.error("-a/--all cannot be used with more than one output format")
+        
+        elif args.output_file == "-" and input_files in ([], ["-"]):
+            parser.error("-O/--output_file is required with more than one output format when reading from stdin")
+    
+    input_file = input_files[0] if len(input_files) == 1 else "-"
+
+    if args.server is not None and not args.all and not args.profile and not multiple_formats:
+        try:
+            return convert_with_server(input_file, args, gen3D)
+        
+        except OSError:
+            logging.getLogger("openprattle").debug("Could not connect to server '{}'; converting in this process".format(args.server), exc_info = True)
+    
+    # Setup profiling.
+    hooks = []
+    if args.profile:
+        profile = openprattle.log.Profile_hook()
+        hooks.append(profile)
+        logging.getLogger("openprattle.profile").setLevel(logging.INFO)
+
+    # First, get our converter object
+    converter = Openbabel_converter.from_file(
+        input_file_path = input_file if input_file != "-" else None,
+        input_file = sys.stdin.buffer if input_file == "-" else None,
+        input_file_type = args.input_format,
+        backend = args.backend,
+        hooks = hooks,
+        geometry_cache = Geometry_cache(disk_path = Path(cache_dir(), "geometries")) if args.geometry_cache else None,
+        seed = args.seed
+    )
 
     # Then convert.
     try:
-        result = converter.convert(
+        if args.all:
+            convert_all(converter, args, gen3D)
+            return 0
+        
+        elif multiple_formats:
+            convert_multi(converter, input_file, args, gen3D)
+            return 0
+        
+        # If we're writing to stdout, the converted file is streamed straight there.
+        sys.stdout.flush()
+        converter.convert(
             output_file = args.output_file if args.output_file != "-" else None,
             output_file_type = args.output_format,
             charge = args.charge,
             multiplicity = args.multiplicity,
-            gen3D = gen3D
+            gen3D = gen3D,
+            output_stream = sys.stdout.buffer,
+            timeout = args.timeout,
+            on_timeout = args.on_timeout
         )
-    except Exception as e:
+    except Exception:
         if args.json:
             # If we've been asked nicely to play with other program, log the exception.
             logging.getLogger("openprattle").error("An error occurred during file conversion", exc_info = True)
@@ -104,10 +213,228 @@ def main():
         
         else:
             raise
+    
+    finally:
+        if args.profile:
+            profile.emit()
+
+    return 0
+
+def convert_with_server(input_file, args, gen3D):
+    """
+    Perform a conversion with a running server.
+    
+    :raises OSError: If the server could not be reached (nothing will have been converted).
+    """
+    import base64
+    from openprattle.server import Client
+    
+    client = Client(args.server if args.server != "" else None)
+    
+    # The server will have a different working directory.
+    request = {
+        "input_file_type": args.input_format,
+        "output_file_type": args.output_format,
+        "output_file": str(Path(args.output_file).absolute()) if args.output_file != "-" else None,
+        "gen3D": gen3D,
+        "charge": args.charge,
+        "multiplicity": args.multiplicity,
+        "backend": args.backend if args.backend is not None else "Auto",
+        "seed": args.seed,
+        "timeout": args.timeout,
+        "on_timeout": args.on_timeout
+    }
+    
+    if input_file != "-":
+        request['input_file_path'] = str(Path(input_file).absolute())
+    
+    else:
+        request['input_file_base64'] = base64.b64encode(sys.stdin.buffer.read()).decode("ascii")
+    
+    with client:
+        response = client.request(request)
+    
+    if not response['success']:
+        if args.json:
+            logging.getLogger("openprattle").error("An error occurred during file conversion: {}".format(response['error']), extra = {"reason": response.get("reason")})
+            return -1
+        
+        else:
+            raise Exception(response['error'])
+    
+    elif "output_base64" in response:
+        sys.stdout.buffer.write(base64.b64decode(response['output_base64']))
+    
+    elif response.get("output") is not None:
+        sys.stdout.write(response['output'])
+    
+    return 0
+
+def convert_multi(converter, input_file, args, gen3D):
+    """
+    Convert an input file to several formats at once.
+    
+    Each output file is named after the output file given (or the input file), with the extension of its format.
+    """
+    base = Path(args.output_file if args.output_file != "-" else input_file)
+    outputs = {output_format: str(base.with_suffix("." + output_format)) for output_format in args.output_format.split(",")}
+    
+    if input_file != "-" and Path(input_file).resolve() in [Path(output_file).resolve() for output_file in outputs.values()]:
+        raise ValueError("Refusing to overwrite input file '{}'; use -O/--output_file to choose a different output file name".format(input_file))
+    
+    converter.convert_multi(
+        outputs,
+        charge = args.charge,
+        multiplicity = args.multiplicity,
+        gen3D = gen3D
+    )
 
-    # If we're writing to stdout, print.
-    # TODO: See if we can write directly to stdout from pybel.
+def convert_all(converter, args, gen3D):
+    """
+    Convert and write each of the molecules in an input file in turn.
+    """
+    output_file_type = args.output_format if args.output_format else Openbabel_converter.type_from_file_name(args.output_file if args.output_file != "-" else None)
+    
+    if args.jobs != 1 and converter.input_file_path is not None and can_chunk(converter.input_file_type):
+        # Convert chunks of the file in parallel.
+        molecules = iter_convert_chunked(
+            converter.input_file_path,
+            output_file_type,
+            input_file_type = converter.input_file_type,
+            workers = args.jobs if args.jobs > 0 else None,
+            backend = args.backend if args.backend is not None else "Auto",
+            charge = args.charge,
+            multiplicity = args.multiplicity,
+            gen3D = gen3D
+        )
+    
+    else:
+        molecules = converter.iter_convert(
+            output_file_type,
+            charge = args.charge,
+            multiplicity = args.multiplicity,
+            gen3D = gen3D
+        )
+    
     if args.output_file == "-":
-        print(result, end = "")
+        for molecule in molecules:
+            sys.stdout.write(molecule)
+    
+    elif args.split:
+        for number, molecule in enumerate(molecules, 1):
+            split_file_name(args.output_file, number).write_text(molecule)
+    
+    else:
+        with open(args.output_file, "w") as output_file:
+            for molecule in molecules:
+                output_file.write(molecule)
+
 
-    return 0
\ No newline at end of file
+def expand_inputs(input_files, list_files = ()):
+    """
+    Get the full list of input files to convert.
+    
+    :param input_files: Input file names given on the command line, which may contain glob patterns.
+    :param list_files: Files that contain further input file names, one per line.
+    :return: The list of input file names.
+    """
+    names = list(input_files)
+    for list_file in list_files:
+        with open(list_file) as list_file:
+            names.extend(line.strip() for line in list_file if line.strip() != "")
+    
+    expanded = []
+    for name in names:
+        if name != "-" and glob.has_magic(name):
+            matches = sorted(glob.glob(name))
+            if len(matches) == 0:
+                # Keep the pattern, so it's reported as a failure.
+                expanded.append(name)
+            
+            expanded.extend(matches)
+        
+        else:
+            expanded.append(name)
+    
+    return expanded
+
+def output_path(input_file, index, args):
+    """
+    Get the path to write the converted version of an input file to, when converting many files.
+    """
+    input_file = Path(input_file)
+    output_format = args.output_format if args.output_format else Openbabel_converter.type_from_file_name(args.output_name)
+    name = args.output_name.format(stem = input_file.stem, name = input_file.name, index = index, format = output_format)
+    
+    return Path(args.output_dir if args.output_dir is not None else input_file.parent, name)
+
+def convert_batch(input_files, args, gen3D):
+    """
+    Convert many files, printing a summary of which succeeded.
+    
+    :return: The exit code; 0 if every file was converted successfully, 1 otherwise.
+    """
+    from openprattle.batch import Conversion_job
+    
+    if "-" in input_files:
+        raise ValueError("Cannot read from stdin when converting many files")
+    
+    if args.output_dir is not None:
+        Path(args.output_dir).mkdir(parents = True, exist_ok = True)
+    
+    outputs = [output_path(input_file, index, args) for index, input_file in enumerate(input_files)]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("More than one input file would be written to the same output file; use an --output-name containing {index}")
+    
+    jobs = (
+        Conversion_job(
+            input_file_path = input_file,
+            input_file_type = args.input_format,
+            output_file_type = args.output_format,
+            output_file = str(output_file),
+            gen3D = gen3D,
+            charge = args.charge,
+            multiplicity = args.multiplicity,
+            backend = args.backend if args.backend is not None else "Auto",
+            seed = args.seed,
+            timeout = args.timeout,
+            on_timeout = args.on_timeout
+        )
+            for input_file, output_file in zip(input_files, outputs)
+    )
+    
+    failures = 0
+    summary = []
+    if args.backend == "Obabel" and args.jobs == 1:
+        # Convert as many files as possible with each obabel process.
+        from openprattle.babel import Obabel_converter
+        results = Obabel_converter.convert_batch(jobs)
+    
+    else:
+        results = Openbabel_converter.convert_many(jobs, args.jobs if args.jobs > 0 else None)
+    
+    for result in results:
+        failures += not result.success
+        summary.append({
+            "input_file": result.job.input_file_path,
+            "output_file": result.job.output_file,
+            "success": result.success,
+            "error": str(result.error) if not result.success else None,
+            "reason": getattr(result.error, "reason", None)
+        })
+        
+        if not args.json:
+            if result.success:
+                print("{} : {} -> {}".format("Success", result.job.input_file_path, result.job.output_file))
+            
+            else:
+                print("{} : {} : {}".format("Failed ", result.job.input_file_path, result.error))
+    
+    if args.json:
+        import json
+        print(json.dumps(summary))
+    
+    else:
+        print("Converted {} of {} files ({} failed)".format(len(summary) - failures, len(summary), failures))
+    
+    return 1 if failures > 0 else 0
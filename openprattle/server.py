@@ -0,0 +1,409 @@
+"""A long-running conversion server, and a client to talk to it."""
+
+import os
+import sys
+import signal
+import json
+import base64
+import socket
+import socketserver
+import ipaddress
+import logging
+from pathlib import Path
+
+from openprattle.batch import Conversion_job, run_job, failed_result
+from openprattle.cache import cache_dir
+
+
+def default_address():
+    """
+    Get the address of the Unix domain socket a server listens on by default, which is stored in the openprattle cache directory.
+    """
+    return str(Path(cache_dir(), "oprattle.sock"))
+
+def parse_address(address):
+    """
+    Get the socket family and address from an address string.
+
+    :param address: Either a path to a Unix domain socket, or 'host:port' (or ':port', for localhost) of a TCP socket.
+    :return: A tuple of (family, address) suitable for socket.socket() and connect()/bind().
+    """
+    address = str(address)
+    host, separator, port = address.rpartition(":")
+
+    if separator != "" and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host if host != "" else "127.0.0.1", int(port))
+
+    else:
+        return socket.AF_UNIX, address
+
+
+def is_loopback(host):
+    """
+    Determine whether a host name (or address) refers only to this machine.
+
+    :param host: The host name or IPv4 address to check.
+    """
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, socket.AF_INET)}
+
+    except socket.gaierror:
+        return False
+
+    return len(addresses) > 0 and all(ipaddress.ip_address(address).is_loopback for address in addresses)
+
+
+def job_from_request(request):
+    """
+    Get a Conversion_job from a request.
+
+    :param request: A dictionary of arguments to the Conversion_job constructor. Binary input files can be given as a base64 encoded string with the 'input_file_base64' key.
+    """
+    request = dict(request)
+    request.pop("id", None)
+
+    if "input_file_base64" in request:
+        request['input_file_buffer'] = base64.b64decode(request.pop("input_file_base64"))
+
+    return Conversion_job(**request)
+
+def result_to_response(result, request_id = None):
+    """
+    Get a response to send back to a client from a Conversion_result.
+
+    :param result: The Conversion_result to describe.
+    :param request_id: The 'id' given in the request, which is echoed back so responses can be matched to requests.
+    :return: A dictionary that can be serialised to JSON.
+    """
+    response = {"id": request_id, "success": result.success}
+
+    if not result.success:
+        response['error'] = str(result.error)
+        response['error_type'] = type(result.error).__name__
+
+        if getattr(result.error, "reason", None) is not None:
+            # A short, machine readable description of the failure (eg, 'timeout').
+            response['reason'] = result.error.reason
+
+    elif isinstance(result.output, bytes):
+        # Binary formats can't be sent in JSON directly.
+        response['output_base64'] = base64.b64encode(result.output).decode("ascii")
+
+    else:
+        response['output'] = result.output
+
+    return response
+
+def handle_request(request, pool = None):
+    """
+    Perform a single conversion request.
+
+    Errors (including malformed requests) do not raise; they are instead described in the response.
+
+    :param request: A dictionary of arguments to the Conversion_job constructor (see job_from_request()), plus an optional 'id'.
+    :param pool: Optional Worker_pool to perform the conversion with. If None, the conversion is performed in the current process.
+    :return: The response, as a dictionary that can be serialised to JSON.
+    """
+    request_id = request.get("id") if isinstance(request, dict) else None
+
+    try:
+        job = job_from_request(request)
+
+    except Exception as e:
+        return result_to_response(failed_result(0, None, e), request_id)
+
+    if pool is not None:
+        try:
+            result = pool.run(job)
+
+        except Exception as e:
+            result = failed_result(0, job, e)
+
+    else:
+        result = run_job(0, job)
+
+    if not result.success:
+        logging.getLogger("openprattle").debug("Failed to convert file '{}'".format(job.input_name), exc_info = result.error)
+
+    return result_to_response(result, request_id)
+
+def handle_line(line, pool = None):
+    """
+    Perform a conversion request given as a line of JSON.
+
+    :param line: The request, as a JSON encoded string or bytes.
+    :param pool: Optional Worker_pool to perform the conversion with.
+    :return: The response, as a line of JSON (including the trailing newline).
+    """
+    try:
+        request = json.loads(line)
+
+    except ValueError as e:
+        response = result_to_response(failed_result(0, None, e))
+
+    else:
+        response = handle_request(request, pool)
+
+    return json.dumps(response) + "\n"
+
+
+class Request_handler(socketserver.StreamRequestHandler):
+    """
+    Handles a single client connection.
+
+    Clients send one JSON request per line, and receive one JSON response per line in the same order.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"":
+                continue
+
+            self.wfile.write(handle_line(line, self.server.pool).encode("utf-8"))
+            self.wfile.flush()
+
+
+class Unix_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A conversion server listening on a Unix domain socket.
+    """
+
+    daemon_threads = True
+
+    def server_bind(self):
+        # Only the current user should be able to ask us to read (and write) files.
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+
+        finally:
+            os.umask(old_umask)
+
+
+class TCP_server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A conversion server listening on a TCP socket.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address = None, pool = None, *, allow_tcp = False, allow_remote = False):
+    """
+    Create a conversion server.
+
+    Each connection is handled in its own thread, so many clients can be served at once.
+
+    Requests are not authenticated, and can read and write any file that the server can. Only the current user can connect
+    to a Unix domain socket, but any user of the machine can connect to a TCP socket (even on localhost), so TCP servers must be asked for explicitly.
+
+    :param address: The address to listen on (see parse_address()). If None, the default Unix domain socket is used.
+    :param pool: Optional Worker_pool to perform conversions with. If None, conversions are performed in the server process.
+    :param allow_tcp: Whether to allow listening on a (loopback) TCP address.
+    :param allow_remote: Whether to allow listening on a TCP address that other machines can connect to (implies allow_tcp).
+    :return: The server object; call serve_forever() to start accepting requests.
+    """
+    family, address = parse_address(address if address is not None else default_address())
+
+    if family == socket.AF_INET and not (allow_tcp or allow_remote):
+        raise Exception("Refusing to listen on TCP address '{}:{}'; requests can read and write any file the server can, and any local user can connect (allow_tcp must be set to do this)".format(*address))
+
+    if family == socket.AF_INET and not allow_remote and not is_loopback(address[0]):
+        raise Exception("Refusing to listen on non-loopback address '{}'; requests can read and write any file the server can (allow_remote must be set to do this)".format(address[0]))
+
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            if ping(address):
+                raise Exception("A server is already listening on '{}'".format(address))
+
+            # Left over from a server that did not exit cleanly.
+            os.unlink(address)
+
+        Path(address).parent.mkdir(parents = True, exist_ok = True)
+        server = Unix_server(address, Request_handler)
+
+    else:
+        server = TCP_server(address, Request_handler)
+
+    server.pool = pool
+    return server
+
+def serve(address = None, workers = None, *, allow_tcp = False, allow_remote = False):
+    """
+    Run a conversion server until interrupted.
+
+    The openbabel libraries (and plugins) are loaded once at start-up, so individual requests do not pay their start-up cost.
+
+    :param address: The address to listen on (see parse_address()). If None, the default Unix domain socket is used.
+    :param workers: The number of worker processes to perform conversions with. If None, conversions are performed in the server process.
+    :param allow_tcp: Whether to allow listening on a (loopback) TCP address (see make_server()).
+    :param allow_remote: Whether to allow listening on a TCP address that other machines can connect to (see make_server()).
+    """
+    # Imported here because it's relatively slow to load.
+    from openprattle.pool import Worker_pool, warm_up
+
+    pool = Worker_pool(workers) if workers is not None else None
+
+    if pool is None:
+        warm_up()
+
+    server = make_server(address, pool, allow_tcp = allow_tcp, allow_remote = allow_remote)
+
+    try:
+        logging.getLogger("openprattle").info("Listening on '{}'".format(server.server_address))
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+
+        if server.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(server.server_address)
+
+            except FileNotFoundError:
+                pass
+
+        if pool is not None:
+            pool.close()
+
+
+def serve_stdio(input_stream = None, output_stream = None):
+    """
+    Perform conversion requests read from a stream (one JSON request per line), writing one JSON response per line.
+
+    This is the same protocol used by the server, but without a socket; a program can start 'oprattle --stdio' once and send it many requests.
+
+    :param input_stream: The binary stream to read requests from. If None, stdin is used.
+    :param output_stream: The text stream to write responses to. If None, stdout is used.
+    """
+    from openprattle.pool import warm_up
+
+    input_stream = input_stream if input_stream is not None else sys.stdin.buffer
+    output_stream = output_stream if output_stream is not None else sys.stdout
+
+    warm_up()
+
+    for line in input_stream:
+        if line.strip() == b"":
+            continue
+
+        output_stream.write(handle_line(line))
+        # The caller is probably waiting for this response before sending the next request.
+        output_stream.flush()
+
+
+class Client():
+    """
+    A client for a conversion server.
+
+        with Client("/path/to/oprattle.sock") as client:
+            client.convert({"input_file_path": "Benzene.cml", "output_file_type": "xyz"})
+    """
+
+    def __init__(self, address = None, timeout = None):
+        """
+        Connect to a server.
+
+        :param address: The address of the server (see parse_address()). If None, the default Unix domain socket is used.
+        :param timeout: Optional timeout (in seconds) for connecting and for each request.
+        :raises OSError: If the server could not be reached.
+        """
+        family, address = parse_address(address if address is not None else default_address())
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+
+        try:
+            self.socket.settimeout(timeout)
+            self.socket.connect(address)
+
+        except Exception:
+            self.socket.close()
+            raise
+
+        self.file = self.socket.makefile("rwb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def request(self, request):
+        """
+        Send a request to the server, and wait for the response.
+
+        :param request: The request dictionary (see job_from_request()).
+        :return: The response dictionary.
+        """
+        self.file.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.file.flush()
+
+        line = self.file.readline()
+        if line == b"":
+            raise ConnectionError("The server closed the connection")
+
+        return json.loads(line)
+
+    def convert(self, request):
+        """
+        Perform a conversion with the server.
+
+        :param request: The request dictionary (see job_from_request()). Note that paths are interpreted by the server, so should be absolute.
+        :return: The converted file, or None if an output_file was given.
+        :raises Exception: If the conversion failed.
+        """
+        response = self.request(request)
+
+        if not response['success']:
+            raise Exception("Server failed to convert file: {}".format(response['error']))
+
+        elif "output_base64" in response:
+            return base64.b64decode(response['output_base64'])
+
+        else:
+            return response.get("output")
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def ping(address = None):
+    """
+    Determine whether a server is listening on an address.
+    """
+    try:
+        Client(address, timeout = 1).close()
+
+    except OSError:
+        return False
+
+    return True
+
+
+def serve_main(argv = None):
+    """
+    Entry point for 'oprattle serve'.
+    """
+    import argparse
+    import openprattle.log
+
+    parser = argparse.ArgumentParser(prog = "oprattle serve", description = "Run a server that performs conversion requests sent over a socket, so each conversion does not pay the start-up cost of openbabel")
+    parser.add_argument("address", help = "The address to listen on, either a path to a Unix domain socket, or HOST:PORT (or :PORT for localhost) for a TCP socket. If not given, a Unix domain socket in the openprattle cache directory is used", nargs = "?")
+    parser.add_argument("-j", "--jobs", help = "The number of worker processes to perform conversions with. If not given, conversions are performed in the server process", type = int)
+    parser.add_argument("--allow-tcp", help = "Allow listening on a localhost TCP address. Requests are not authenticated and can read and write any file the server can, so only use this if every user of the machine is trusted", action = "store_true")
+    parser.add_argument("--allow-remote", help = "Allow listening on a TCP address other than localhost (implies --allow-tcp). Only use this on a trusted network", action = "store_true")
+    parser.add_argument("--json", help = "Dump warnings and errors in JSON", action = "store_true")
+    args = parser.parse_args(argv)
+
+    openprattle.log.init_logger(args.json)
+    logging.getLogger("openprattle").setLevel(logging.INFO)
+
+    # Clean up (remove the socket file etc) when asked to stop.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    serve(args.address, args.jobs, allow_tcp = args.allow_tcp, allow_remote = args.allow_remote)
+    return 0
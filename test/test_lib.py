@@ -4,8 +4,25 @@ import pytest
 
 from pathlib import Path
 import copy
+import subprocess
+import sys
+import asyncio
+import io
+import re
+import logging
+import json
+import threading
 
-from openprattle import Openbabel_converter
+from openprattle import Openbabel_converter, Conversion_timeout, HAVE_PYBEL
+from openprattle.pool import Worker_pool
+from openprattle.cache import Cache, Conversion_cache, Geometry_cache
+from openprattle.babel import Openbabel_formats, Pybel_formats, Obabel_formats, Obabel_converter
+from openprattle.adaptive import Backend_stats
+from openprattle.server import make_server, Client
+from openprattle.native import Native_converter
+from openprattle.chunked import find_chunks, iter_convert_chunked, convert_chunked
+from openprattle.batch import Conversion_job, run_job
+from openprattle.log import Log_listener, JSON_formatter, init_worker_logger
 
 from test import DATA, BACKENDS, FORMAT_BACKENDS
 
@@ -35,3 +52,578 @@ def test_auto_backend(input_file_type, tmp_path):
 def test_available_read_formats(formatter, readwrite):
     """Test the ability to print supported input/output formats."""
     getattr(formatter(), readwrite)()
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_many(workers, tmp_path):
+    """Test converting a batch of files with a pool of workers."""
+    jobs = [
+        {"input_file_path": Path(DATA, "Benzene." + input_file_type), "output_file_type": "xyz"}
+            for input_file_type in ("cml", "xyz", "cdx")
+    ]
+    # A job that will fail.
+    jobs.insert(1, {"input_file_path": Path(tmp_path, "Missing.cml"), "output_file_type": "xyz"})
+
+    results = list(Openbabel_converter.convert_many(jobs, workers))
+
+    assert [result.index for result in results] == list(range(len(jobs)))
+    assert [result.success for result in results] == [True, False, True, True]
+    assert all(result.output for result in results if result.success)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_output_stream(backend, tmp_path):
+    """Test converting from bytes and streaming the output to a file object and a file descriptor."""
+    buffer = memoryview(Path(DATA, "Benzene.cml").read_bytes())
+    expected = backend(input_file_buffer = buffer, input_file_type = "cml").convert("xyz", gen3D = False)
+    
+    stream = io.BytesIO()
+    assert backend(input_file_buffer = buffer, input_file_type = "cml").convert("xyz", gen3D = False, output_stream = stream) is None
+    assert stream.getvalue().decode() == expected
+    
+    with open(Path(tmp_path, "Benzene.xyz"), "wb") as output_file:
+        backend(input_file_buffer = buffer, input_file_type = "cml").convert("xyz", gen3D = False, output_stream = output_file.fileno())
+    
+    assert Path(tmp_path, "Benzene.xyz").read_text() == expected
+
+def test_binary_output():
+    """Test that binary formats are returned as bytes."""
+    output = Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene.cml"), backend = "Obabel").convert("png")
+    assert isinstance(output, bytes)
+    assert output.startswith(b"\x89PNG\r\n")
+
+def test_threaded_conversion(caplog, monkeypatch):
+    """Test converting with pybel from many threads at once, and that openbabel's messages are attributed to the right file."""
+    from concurrent.futures import ThreadPoolExecutor
+    from openprattle.babel import Pybel_converter
+    
+    good = Path(DATA, "Benzene.xyz").read_text()
+    bad = "3\n\nC 0 0 0\nC 1 1\n"
+    expected = Pybel_converter(input_file_buffer = good, input_file_type = "xyz").convert("cml", gen3D = False)
+    
+    def convert(index):
+        buffer = bad if index % 10 == 0 else good
+        try:
+            return Pybel_converter(input_file_buffer = buffer, input_file_type = "xyz").convert("cml", gen3D = False)
+        
+        except Exception:
+            return None
+    
+    # Name each conversion after its input.
+    monkeypatch.setattr(Pybel_converter, "input_name", property(lambda self: "good" if self.input_file_buffer == good else "bad"))
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(convert, range(100)))
+    
+    assert all(output == expected for index, output in enumerate(outputs) if index % 10 != 0)
+    assert all(output is None for index, output in enumerate(outputs) if index % 10 == 0)
+    
+    openbabel_records = [record for record in caplog.records if hasattr(record, "input_name")]
+    assert len(openbabel_records) > 0
+    assert all(record.input_name == "bad" for record in openbabel_records)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("source", ["path", "buffer"])
+def test_aconvert(backend, source):
+    """Test converting asynchronously."""
+    if source == "path":
+        converter = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml")
+    
+    else:
+        converter = backend(input_file_buffer = Path(DATA, "Benzene.cml").read_text(), input_file_type = "cml")
+    
+    output = asyncio.run(converter.aconvert("xyz", gen3D = False))
+    assert output == backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml").convert("xyz", gen3D = False)
+
+def test_aconvert_many(tmp_path):
+    """Test converting a batch of files asynchronously."""
+    jobs = [
+        {"input_file_path": Path(DATA, "Benzene." + input_file_type), "output_file_type": "xyz", "backend": backend}
+            for input_file_type in ("cml", "xyz") for backend in ("Pybel", "Obabel")
+    ]
+    jobs.insert(1, {"input_file_path": Path(tmp_path, "Missing.cml"), "output_file_type": "xyz", "backend": "Obabel"})
+
+    results = asyncio.run(Openbabel_converter.aconvert_many(jobs, concurrency = 2))
+
+    assert [result.index for result in results] == list(range(len(jobs)))
+    assert [result.success for result in results] == [True, False, True, True, True]
+    assert all(result.output for result in results if result.success)
+
+@pytest.mark.parametrize("backend", BACKENDS + [Native_converter])
+@pytest.mark.parametrize("source", ["path", "buffer", "file"])
+def test_iter_convert(backend, source, tmp_path):
+    """Test converting each of the molecules in a multi-structure file."""
+    molecules = Path(DATA, "Benzene.xyz").read_text() * 3
+    Path(tmp_path, "Benzene.xyz").write_text(molecules)
+    
+    if source == "path":
+        converter = backend(input_file_path = Path(tmp_path, "Benzene.xyz"), input_file_type = "xyz")
+
+    elif source == "buffer":
+        converter = backend(input_file_buffer = molecules, input_file_type = "xyz")
+
+    else:
+        converter = backend(input_file = open(Path(tmp_path, "Benzene.xyz"), "rb"), input_file_type = "xyz")
+
+    results = list(converter.iter_convert("xyz", gen3D = False))
+    assert len(results) == 3
+    assert results[0] == results[1] == results[2]
+    
+    if source == "file":
+        converter.input_file.close()
+
+@pytest.fixture(scope = "module")
+def worker_pool():
+    with Worker_pool(2) as pool:
+        yield pool
+
+@pytest.mark.parametrize("input_file_type", ["cml", "xyz", "cdx"])
+@pytest.mark.parametrize("backend", ["Pybel", "Obabel"])
+def test_worker_pool(worker_pool, input_file_type, backend):
+    """Test conversion with a pool of warm worker processes."""
+    if input_file_type == "cdx" and backend == "Pybel":
+        pytest.skip("cdx cannot be converted with pybel")
+
+    converter = Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene." + input_file_type), backend = backend)
+    expected = converter.convert("xyz", gen3D = False)
+
+    converter = Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene." + input_file_type), backend = backend, pool = worker_pool)
+    assert converter.convert("xyz", gen3D = False) == expected
+
+def test_worker_pool_restart(worker_pool):
+    """Test that dead workers are replaced."""
+    for worker in worker_pool.workers:
+        worker.process.kill()
+        worker.process.join()
+
+    results = list(worker_pool.convert_many([{"input_file_path": Path(DATA, "Benzene.cml"), "output_file_type": "xyz"}] * 4))
+    assert all(result.success for result in results)
+    # Workers are replaced from threads, so are never forked.
+    assert worker_pool.context.get_start_method() != "fork"
+
+# A molecule that takes several seconds to generate 3D coordinates for.
+SLOW_SMILES = "CC(C)C" * 40
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_timeout(backend):
+    """Test slow conversions are stopped, and retried."""
+    converter = backend(input_file_buffer = SLOW_SMILES, input_file_type = "smi")
+    
+    with pytest.raises(Conversion_timeout) as error:
+        converter.convert("xyz", gen3D = True, timeout = 0.5)
+    
+    assert error.value.timeout == 0.5
+    assert error.value.reason == "timeout"
+    
+    expected = converter.convert("xyz", gen3D = False)
+    assert converter.convert("xyz", gen3D = True, timeout = 0.5, on_timeout = ["other_backend", "without_gen3D"]) == expected
+    assert converter.convert("xyz", gen3D = False, timeout = 30) == expected
+
+@pytest.mark.skipif(not HAVE_PYBEL, reason = "pybel is not available")
+def test_timeout_threaded():
+    """Test conversions with a timeout don't inherit locks held by other threads."""
+    from openprattle.babel import ObErrorLog_wrapper
+    
+    converter = Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene.cml"), backend = "Pybel")
+    expected = converter.convert("xyz")
+    
+    locked = threading.Event()
+    release = threading.Event()
+    
+    def hold_lock():
+        with ObErrorLog_wrapper.lock:
+            locked.set()
+            release.wait()
+    
+    thread = threading.Thread(target = hold_lock)
+    thread.start()
+    locked.wait()
+    
+    try:
+        # A forked child would inherit the held lock, and so never finish.
+        assert converter.convert("xyz", timeout = 10) == expected
+    
+    finally:
+        release.set()
+        thread.join()
+
+def test_worker_pool_timeout(worker_pool):
+    """Test workers that time out are replaced."""
+    job = {"input_file_buffer": SLOW_SMILES, "input_file_type": "smi", "output_file_type": "xyz", "gen3D": True, "timeout": 0.5}
+    results = list(worker_pool.convert_many([job, dict(job, on_timeout = ["without_gen3D"])]))
+    
+    assert isinstance(results[0].error, Conversion_timeout)
+    assert results[1].success
+    assert worker_pool.convert({"input_file_path": Path(DATA, "Benzene.cml"), "output_file_type": "xyz"})
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cache(backend, tmp_path):
+    """Test caching of conversion results."""
+    cache = Conversion_cache(disk_path = Path(tmp_path, "cache"))
+
+    converter = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml", cache = cache)
+    first = converter.convert("xyz")
+    assert converter.convert("xyz") == first
+    # Different options should not hit the cache.
+    converter.convert("xyz", charge = 1)
+
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+    # A new cache sharing the same directory should find the results on disk.
+    cache = Conversion_cache(disk_path = Path(tmp_path, "cache"))
+    converter = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml", cache = cache)
+    converter.convert("xyz", Path(tmp_path, "Benzene.xyz"))
+
+    assert cache.stats()["disk_hits"] == 1
+    assert Path(tmp_path, "Benzene.xyz").read_text() == first
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cache_file_name(backend, tmp_path):
+    """Test that cached results aren't shared between files with the same contents but different names (which can be used as titles)."""
+    cache = Conversion_cache()
+    
+    for name in ("First.xyz", "Second.xyz"):
+        input_file_path = Path(tmp_path, name)
+        input_file_path.write_bytes(Path(DATA, "Benzene.xyz").read_bytes())
+        expected = backend(input_file_path = input_file_path, input_file_type = "xyz").convert("smi")
+        assert name in expected
+        assert backend(input_file_path = input_file_path, input_file_type = "xyz", cache = cache).convert("smi") == expected
+    
+    assert cache.stats()["misses"] == 2
+
+def test_cache_eviction(tmp_path):
+    """Test that the cache stays within its size limits."""
+    cache = Cache(memory_size = 2, disk_path = tmp_path, disk_size = 25)
+
+    for key in ("aa", "bb", "cc"):
+        cache.put(key, key.encode() * 5)
+
+    assert len(cache.memory) == 2
+    assert cache.stats()["disk_bytes"] <= 25
+    assert cache.stats()["evictions"] == 1
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_hooks(backend):
+    """Test reporting the time taken by each stage of a conversion."""
+    stages = []
+    converter = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml", hooks = [lambda converter, stage, duration, details: stages.append(stage)])
+    converter.convert("xyz", charge = 0, multiplicity = 1, gen3D = True)
+    
+    assert stages[-1] == "convert"
+    if backend.BACKEND == "Pybel":
+        assert stages[:-1] == ["read", "charge", "multiplicity", "gen3D", "addh", "write"]
+    
+    else:
+        assert stages[:-1] == ["spawn", "obabel"]
+
+def test_adaptive(tmp_path):
+    """Test choosing backends by their measured performance."""
+    stats = Backend_stats(Path(tmp_path, "stats.json"))
+    
+    outputs = [
+        Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene.cml"), backend = "Adaptive", stats = stats).convert("xyz", gen3D = False)
+            for i in range(Backend_stats.MIN_SAMPLES * 2 + 1)
+    ]
+    assert outputs[0] == Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene.cml"), backend = "Pybel").convert("xyz", gen3D = False)
+    
+    # Both backends have been tried, and the fastest is now chosen.
+    table = stats.table()["cml:xyz:<16384:gen3D=False:charge=None:multiplicity=None"]
+    assert table['Pybel']['count'] + table['Obabel']['count'] == len(outputs)
+    assert min(table['Pybel']['count'], table['Obabel']['count']) == Backend_stats.MIN_SAMPLES
+    fastest = min(table, key = lambda backend: table[backend]['latency'])
+    assert stats.choose("cml", "xyz", 1000, ["Pybel", "Obabel"], gen3D = False)[0] == fastest
+    
+    # Failures make a backend more expensive.
+    for i in range(10):
+        stats.record("cml", "xyz", 1000, fastest, 0.001, False, gen3D = False)
+    assert stats.choose("cml", "xyz", 1000, ["Pybel", "Obabel"], gen3D = False)[0] != fastest
+    
+    # Statistics persist.
+    stats.save()
+    assert Backend_stats(Path(tmp_path, "stats.json")).table() == stats.table()
+
+@pytest.mark.parametrize("options", [{}, {"charge": 1, "multiplicity": 2}])
+def test_adaptive_consistent(tmp_path, options):
+    """Test that the adaptive backend gives the same result whichever backend it chooses."""
+    stats = Backend_stats(Path(tmp_path, "stats.json"))
+    
+    outputs = set()
+    for backend in ("Pybel", "Obabel"):
+        # Force the choice of backend.
+        for i in range(Backend_stats.MIN_SAMPLES * 2):
+            stats.record("smi", "cml", len("CCO\n"), backend, 0.001, True, gen3D = True, **options)
+            stats.record("smi", "cml", len("CCO\n"), "Obabel" if backend == "Pybel" else "Pybel", 1, True, gen3D = True, **options)
+        
+        output = Openbabel_converter.from_file(input_file = io.StringIO("CCO\n"), input_file_type = "smi", backend = "Adaptive", stats = stats).convert("cml", **options)
+        # 2D input, so 3D coordinates are generated.
+        assert "z3=" in output
+        
+        # Generated coordinates are not reproducible.
+        outputs.add(re.sub(r'[xyz]3="[^"]*"', "", output))
+    
+    assert len(outputs) == 1
+    # Only pybel can set the charge and multiplicity, so it is used regardless of the statistics.
+    table = stats.table()[Backend_stats.key("smi", "cml", len("CCO\n"), gen3D = True, **options)]
+    assert table['Pybel']['count'] - table['Obabel']['count'] == (2 if options else 0)
+
+def test_lazy_import():
+    """Test that the openbabel bindings are not loaded until they are needed."""
+    code = "import sys, openprattle; assert 'openbabel.pybel' not in sys.modules; openprattle.HAVE_PYBEL"
+    subprocess.run([sys.executable, "-c", code], check = True)
+    
+    # Nor is asyncio, which only the asynchronous API needs.
+    code = "import sys, openprattle.program; assert 'asyncio' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check = True)
+
+def test_broken_pybel():
+    """Test that pybel bindings that are installed but can't be loaded are reported as unavailable."""
+    code = "\n".join([
+        "import sys, openprattle, openprattle.babel",
+        # Make importing the bindings fail.
+        "sys.modules['openbabel.pybel'] = None",
+        "assert openprattle.babel.FOUND_PYBEL and not openprattle.HAVE_PYBEL",
+        "assert openprattle.Openbabel_converter.get_cls('cml').BACKEND == 'Obabel'"
+    ])
+    subprocess.run([sys.executable, "-c", code], check = True)
+
+@pytest.mark.parametrize("formatter", [Pybel_formats, Obabel_formats])
+def test_formats_cache(formatter, tmp_path, monkeypatch):
+    """Test that tables of formats are cached on disk, and refreshed when openbabel changes."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(Openbabel_formats, "_tables", {})
+    expected = formatter().read()
+
+    # Fresh process; the formats should be read from disk without asking openbabel.
+    monkeypatch.setattr(Openbabel_formats, "_tables", {})
+    def fail(self):
+        raise Exception("Cache miss")
+    
+    monkeypatch.setattr(formatter, "_read", fail)
+    assert formatter().read() == expected
+
+    # If openbabel changes, the cache should be ignored.
+    monkeypatch.setattr(Openbabel_formats, "_tables", {})
+    fingerprint = formatter.fingerprint
+    monkeypatch.setattr(formatter, "fingerprint", lambda self: dict(fingerprint(self), mtime = 0))
+    with pytest.raises(Exception, match = "Cache miss"):
+        formatter().read()
+
+def test_server(tmp_path):
+    """Test converting with a server."""
+    import threading
+    import base64
+    
+    server = make_server(str(Path(tmp_path, "oprattle.sock")))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    
+    try:
+        with Client(server.server_address) as client:
+            assert client.convert({"input_file_path": str(Path(DATA, "Benzene.cml")), "output_file_type": "xyz"}).startswith("12\n")
+            
+            # Binary files are sent in base64.
+            cdx = base64.b64encode(Path(DATA, "Benzene.cdx").read_bytes()).decode("ascii")
+            assert client.convert({"input_file_base64": cdx, "input_file_type": "cdx", "output_file_type": "png", "backend": "Obabel"})[:4] == b"\x89PNG"
+            
+            
+            response = client.request({"input_file_path": str(Path(DATA, "Missing.cml")), "output_file_type": "xyz", "id": 3})
+            assert response['id'] == 3
+            assert not response['success']
+            
+            # Malformed requests are reported, but don't close the connection.
+            assert not client.request({"not_an_option": True})['success']
+            assert client.request({"input_file_buffer": Path(DATA, "Benzene.xyz").read_text(), "input_file_type": "xyz", "output_file_type": "cml"})['success']
+    
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_server_remote():
+    """Test that servers only listen on TCP addresses (and other machines' networks) when asked to."""
+    # Any local user could connect to a TCP server.
+    with pytest.raises(Exception, match = "allow_tcp"):
+        make_server("localhost:0")
+    
+    with pytest.raises(Exception, match = "non-loopback"):
+        make_server("0.0.0.0:0", allow_tcp = True)
+    
+    for address, options in (("localhost:0", {"allow_tcp": True}), ("0.0.0.0:0", {"allow_remote": True})):
+        server = make_server(address, **options)
+        server.server_close()
+
+@pytest.mark.parametrize("backend", ["Pybel", "Obabel"])
+def test_geometry_cache(backend, tmp_path):
+    """Test that generated 3D coordinates are reproducible with a seed, and are cached."""
+    geometry_cache = Geometry_cache(disk_path = tmp_path)
+    smiles = "c1ccccc1CC(=O)N[C@@H](C)C(=O)O"
+    
+    def convert(input_file_buffer, geometry_cache = None):
+        converter = Openbabel_converter.from_file(input_file_buffer = input_file_buffer, input_file_type = "smi", backend = backend, geometry_cache = geometry_cache, seed = 1)
+        return converter.convert("xyz", gen3D = True)
+    
+    fresh = convert(smiles)
+    assert convert(smiles) == fresh
+    
+    # A miss, and then a hit.
+    assert convert(smiles, geometry_cache) == fresh
+    assert convert(smiles, geometry_cache) == fresh
+    assert geometry_cache.hits == 1
+    
+    # The same molecule, written differently.
+    assert convert("OC(=O)[C@H](C)NC(=O)Cc1ccccc1", geometry_cache).startswith("28\n")
+    assert geometry_cache.hits == 2
+    
+    # A different molecule.
+    convert("c1ccccc1CC(=O)N[C@H](C)C(=O)O", geometry_cache)
+    assert geometry_cache.hits == 2
+
+@pytest.mark.parametrize("backend", BACKENDS + [Native_converter])
+def test_convert_multi(backend, tmp_path):
+    """Test converting to several formats at once."""
+    converter = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml")
+    results = converter.convert_multi({"xyz": None, "com": None, "png": None, "cml": Path(tmp_path, "Benzene.cml")})
+    
+    for output_file_type in ("xyz", "com"):
+        assert results[output_file_type] == backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml").convert(output_file_type)
+    
+    assert results['png'][:4] == b"\x89PNG"
+    assert results['cml'] is None
+    assert Path(tmp_path, "Benzene.cml").exists()
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_convert_multi_titles(backend):
+    """Test converting to several formats at once gives the same results (including molecule titles) as converting to each in turn."""
+    converter = backend(input_file_path = Path(DATA, "Benzene.xyz"), input_file_type = "xyz")
+    results = converter.convert_multi({"xyz": None, "com": None, "smi": None, "mol2": None})
+    
+    for output_file_type, result in results.items():
+        assert result == converter.convert(output_file_type)
+    
+    # The title of an xyz file without a comment is its path.
+    assert results['smi'].split("\t")[1].strip() == str(Path(DATA, "Benzene.xyz"))
+    
+    if backend.BACKEND == "Obabel":
+        # Several molecules, with titles that aren't valid cml ids.
+        converter = backend(input_file_buffer = "C a/b.c & d\nCC\nc1ccccc1 <x>\n", input_file_type = "smi")
+        results = converter.convert_multi({"xyz": None, "smi": None})
+        assert results == {output_file_type: converter.convert(output_file_type) for output_file_type in results}
+
+@pytest.mark.parametrize("input_file_type", ["xyz", "tmol"])
+@pytest.mark.parametrize("output_file_type", ["xyz", "tmol", "com"])
+def test_native(input_file_type, output_file_type):
+    """Test the native converter gives the same results as openbabel."""
+    reference = Openbabel_converter.get_cls(input_file_type)
+    assert type(Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene." + input_file_type))) == Native_converter
+    
+    for options in ({}, {"charge": -1, "multiplicity": 2}):
+        native = Native_converter(input_file_path = Path(DATA, "Benzene." + input_file_type), input_file_type = input_file_type).convert(output_file_type, **options)
+        expected = reference(input_file_path = Path(DATA, "Benzene." + input_file_type), input_file_type = input_file_type).convert(output_file_type, **options)
+        
+        if input_file_type == "tmol":
+            # Openbabel reads turbomole coordinates at single precision, so the last digit can differ.
+            number = re.compile(r"-?\d+\.\d+$")
+            assert [value for value in native.split() if not number.match(value)] == [value for value in expected.split() if not number.match(value)]
+            assert [float(value) for value in native.split() if number.match(value)] == pytest.approx(
+                [float(value) for value in expected.split() if number.match(value)], abs = 2e-5
+            )
+        
+        else:
+            assert native == expected
+
+def test_native_fallback():
+    """Test the native converter falls back to openbabel for conversions it can't perform."""
+    molecules = "1\n\nC 0 0 0\n" + "1\n\nCL 0 0 0\n"
+    converter = Native_converter(input_file_buffer = molecules, input_file_type = "xyz")
+    assert list(converter.iter_convert("xyz")) == list(Openbabel_converter.get_cls("xyz")(input_file_buffer = molecules, input_file_type = "xyz").iter_convert("xyz"))
+    
+    converter = Native_converter(input_file_buffer = molecules, input_file_type = "xyz")
+    assert "<molecule" in converter.convert("cml")
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_arrays(backend):
+    """Test converting molecules to and from arrays."""
+    numpy = pytest.importorskip("numpy")
+    from openprattle.arrays import Molecule_arrays
+    
+    arrays = backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml").to_arrays(charge = 1, multiplicity = 2)
+    assert arrays.atomic_numbers.tolist() == [6] * 6 + [1] * 6
+    assert arrays.coordinates.shape == (12, 3) and arrays.coordinates.dtype == numpy.float64
+    assert len(arrays.bonds) == len(arrays.bond_orders) == 12
+    assert (arrays.charge, arrays.multiplicity) == (1, 2)
+    
+    # And back again.
+    converter = Openbabel_converter.from_arrays(arrays)
+    assert converter.convert("xyz") == backend(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml").convert("xyz")
+    assert converter.convert("can").split()[0] == "c1ccccc1"
+    
+    # Bonds are perceived from coordinates if not given.
+    assert Openbabel_converter.from_arrays(Molecule_arrays(arrays.atomic_numbers, arrays.coordinates)).convert("can").split()[0] == "c1ccccc1"
+    
+    with pytest.raises(ValueError):
+        Molecule_arrays([6, 6], [[0, 0, 0]])
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("input_file_type", ["xyz", "sdf"])
+def test_chunked(workers, input_file_type, tmp_path):
+    """Test converting a multi-structure file in parallel chunks."""
+    molecule = Openbabel_converter.from_file(input_file_path = Path(DATA, "Benzene.cml")).convert(input_file_type)
+    input_file_path = Path(tmp_path, "Benzene." + input_file_type)
+    input_file_path.write_text(molecule * 10 + "\n")
+    
+    # Small chunks, so the file is split.
+    assert len(find_chunks(input_file_path, input_file_type, 1000)) > 1
+    
+    # Chunks are read from memory, so untitled molecules are not given the file name as their title.
+    expected = list(Openbabel_converter.from_file(input_file_buffer = input_file_path.read_text(), input_file_type = input_file_type).iter_convert("smi"))
+    assert list(iter_convert_chunked(input_file_path, "smi", workers = workers, chunk_bytes = 1000)) == expected
+    
+    assert convert_chunked(input_file_path, Path(tmp_path, "Benzene.smi"), workers = workers, chunk_bytes = 1000) == 10
+    assert Path(tmp_path, "Benzene.smi").read_text() == "".join(expected)
+
+def test_log_listener():
+    """Test log records of worker processes are sent to the parent, tagged with their job."""
+    from concurrent.futures import ProcessPoolExecutor
+    
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    
+    job = Conversion_job(input_file_path = Path(DATA, "Benzene.smi"), output_file_type = "xyz", gen3D = True, name = "Benzene")
+    with Log_listener(handler) as listener, ProcessPoolExecutor(1, initializer = init_worker_logger, initargs = (listener.queue,)) as executor:
+        assert executor.submit(run_job, 3, job).result().success
+    
+    messages = [json.loads(JSON_formatter().format(record)) for record in records]
+    assert any("Generating 3D coordinates" in message['message'] for message in messages)
+    assert all(message['job'] == 3 and message['input_name'] for message in messages)
+
+@pytest.mark.parametrize("max_length", [24000, 100])
+def test_convert_batch(max_length, tmp_path, monkeypatch):
+    """Test converting many files with as few obabel processes as possible."""
+    import shutil
+    
+    for name in ("Benzene1.cml", "Benzene2.cml", "Benzene3.cml", Path("Subdirectory", "Benzene1.cml")):
+        Path(tmp_path, name).parent.mkdir(exist_ok = True)
+        shutil.copy(Path(DATA, "Benzene.cml"), Path(tmp_path, name))
+    
+    Path(tmp_path, "Broken.cml").write_text("Not a cml file")
+    
+    jobs = [{"input_file_path": str(path), "output_file_type": "xyz"} for path in sorted(tmp_path.rglob("*.cml"))]
+    jobs.append({"input_file_path": str(Path(tmp_path, "Missing.cml")), "output_file_type": "xyz"})
+    jobs.append({"input_file_path": str(Path(DATA, "Benzene.cml")), "output_file": str(Path(tmp_path, "Benzene.xyz"))})
+    jobs.append({"input_file_buffer": Path(DATA, "Benzene.cml").read_text(), "input_file_type": "cml", "output_file_type": "xyz"})
+    
+    processes = []
+    run = subprocess.run
+    monkeypatch.setattr(subprocess, "run", lambda *args, **kwargs: processes.append(args) or run(*args, **kwargs))
+    
+    results = Obabel_converter.convert_batch(jobs, max_length = max_length)
+    expected = Obabel_converter(input_file_path = Path(DATA, "Benzene.cml"), input_file_type = "cml").convert("xyz")
+    
+    assert [result.index for result in results] == list(range(len(jobs)))
+    assert [result.success for result in results] == [True, True, True, False, True, False, True, True]
+    assert [result.output for result in results if result.success] == [expected, expected, expected, expected, None, expected]
+    assert Path(tmp_path, "Benzene.xyz").read_text() == expected
+    assert "Broken.cml" in str(results[3].error)
+    assert "Missing.cml" in str(results[5].error)
+    
+    if max_length > 1000:
+        # Every file is converted by one batch, except the second 'Benzene1.cml' (which is converted on its own) and the buffer.
+        assert len(processes) == 1
@@ -95,4 +95,150 @@ def test_gen3d(input_file_type):
     ]).stdout
 
     assert first == same
-    assert first != different
\ No newline at end of file
+    assert first != different
+
+@pytest.mark.parametrize("backend", ["Pybel", "Obabel"])
+def test_all(backend, tmp_path):
+    """Test converting every molecule in a multi-structure file."""
+    input_file_path = Path(tmp_path, "Benzene.xyz")
+    input_file_path.write_text(Path(DATA, "Benzene.xyz").read_text() * 3)
+
+    output = run([
+        "oprattle",
+        str(input_file_path),
+        "-o", "smi",
+        "--all",
+        "--backend", backend
+    ]).stdout
+
+    assert len(output.splitlines()) == 3
+
+@pytest.mark.parametrize("backend", ["Pybel", "Obabel"])
+def test_profile(backend):
+    """Test logging the time taken by each stage of a conversion."""
+    import json
+    
+    stderr = run([
+        "oprattle",
+        str(Path(DATA, "Benzene.cml")),
+        "-o", "xyz",
+        "--backend", backend,
+        "--profile"
+    ]).stderr
+
+    profiles = [json.loads(line)['profile'] for line in stderr.splitlines() if "profile" in json.loads(line)]
+    assert len(profiles) == 1
+    assert "convert" in profiles[0]['totals']
+    assert ("write" if backend == "Pybel" else "spawn") in profiles[0]['totals']
+
+@pytest.mark.parametrize("options", [["-j", "2"], ["--backend", "Obabel", "-j", "1"]])
+def test_batch(options, tmp_path):
+    """Test converting many files at once."""
+    import json
+    
+    input_files = [str(Path(DATA, "Benzene.cml")), str(Path(DATA, "Benzene.xyz")), str(Path(tmp_path, "Missing.cml"))]
+    
+    done = subprocess.run([
+        "oprattle",
+        *input_files,
+        "-o", "smi",
+        "--output-dir", str(Path(tmp_path, "output")),
+        "--output-name", "{index}_{stem}.{format}",
+        *options,
+        "--json"
+    ], stdout = subprocess.PIPE, universal_newlines = True)
+
+    summary = json.loads(done.stdout)
+    assert done.returncode == 1
+    assert [result['success'] for result in summary] == [True, True, False]
+    assert Path(tmp_path, "output", "0_Benzene.smi").exists()
+    assert Path(tmp_path, "output", "1_Benzene.smi").exists()
+
+def test_timeout(tmp_path):
+    """Test slow conversions are stopped, and the reason reported."""
+    import json
+    
+    input_file = Path(tmp_path, "Slow.smi")
+    input_file.write_text("CC(C)C" * 40 + "\n")
+    
+    done = subprocess.run(["oprattle", str(input_file), "-o", "xyz", "--gen3D", "True", "--timeout", "0.5", "--json"], capture_output = True, universal_newlines = True)
+    assert done.returncode != 0
+    assert [json.loads(line).get("reason") for line in done.stderr.splitlines()][-1] == "timeout"
+    
+    done = run(["oprattle", str(input_file), "-o", "xyz", "--gen3D", "True", "--timeout", "0.5", "--on-timeout", "without_gen3D"])
+    assert done.stdout.decode().split()[0] == "482"
+
+def test_server(tmp_path):
+    """Test converting with a server, and falling back when there isn't one."""
+    import time
+    
+    address = str(Path(tmp_path, "oprattle.sock"))
+    signature = ["oprattle", str(Path(DATA, "Benzene.cml")), "-o", "xyz", "--server", address]
+    
+    # No server running yet.
+    expected = run(signature).stdout
+    
+    server = subprocess.Popen(["oprattle", "serve", address])
+    try:
+        while not Path(address).exists():
+            assert server.poll() is None
+            time.sleep(0.05)
+        
+        assert run(signature).stdout == expected
+    
+    finally:
+        server.terminate()
+        server.wait()
+
+def test_stdio():
+    """Test converting many files with one process, with JSON lines on stdin and stdout."""
+    import json
+    import base64
+    
+    requests = [
+        {"id": 1, "input_file_path": str(Path(DATA, "Benzene.cml")), "output_file_type": "xyz"},
+        {"id": 2, "input_file_buffer": Path(DATA, "Benzene.xyz").read_text(), "input_file_type": "xyz", "output_file_type": "cml"},
+        {"id": 3, "input_file_base64": base64.b64encode(Path(DATA, "Benzene.cdx").read_bytes()).decode("ascii"), "input_file_type": "cdx", "output_file_type": "xyz"},
+        {"id": 4, "input_file_path": str(Path(DATA, "Missing.cml")), "output_file_type": "xyz"},
+    ]
+    
+    done = subprocess.run(
+        ["oprattle", "--stdio"],
+        input = "".join(json.dumps(request) + "\n" for request in requests),
+        stdout = subprocess.PIPE,
+        universal_newlines = True,
+        check = True
+    )
+    
+    responses = [json.loads(line) for line in done.stdout.splitlines()]
+    assert [response['id'] for response in responses] == [1, 2, 3, 4]
+    assert [response['success'] for response in responses] == [True, True, True, False]
+    assert responses[0]['output'].startswith("12\n")
+
+def test_multiple_formats(tmp_path):
+    """Test converting to several formats at once."""
+    run([
+        "oprattle",
+        str(Path(DATA, "Benzene.cdx")),
+        "-o", "xyz,cml,png",
+        "-O", str(Path(tmp_path, "Benzene"))
+    ])
+    
+    for output_format in ("xyz", "cml", "png"):
+        assert Path(tmp_path, "Benzene." + output_format).exists()
+
+def test_chunked(tmp_path):
+    """Test converting every molecule in a multi-structure file in parallel chunks."""
+    input_file_path = Path(tmp_path, "Benzene.xyz")
+    input_file_path.write_text(Path(DATA, "Benzene.xyz").read_text() * 5)
+
+    run([
+        "oprattle",
+        str(input_file_path),
+        "-O", str(Path(tmp_path, "Benzene.sdf")),
+        "--all",
+        "--split",
+        "-j", "2"
+    ])
+
+    assert [Path(tmp_path, "Benzene{}.sdf".format(number)).exists() for number in range(1, 7)] == [True] * 5 + [False]